@@ -207,6 +207,13 @@ def test_test_request_string():
                                     "data": {"count": 16, "target_id": 0, "address": None}}
 
 
+def test_test_request_priority():
+    msg = APITestRequest(count=16, priority=5)
+    assert json.loads(str(msg))['priority'] == 5
+    msg = APITestRequest(str(msg))
+    assert msg.priority == 5
+
+
 def test_test_response_validation_fail():
     msg = APITestResponse()
     exception = False
@@ -289,3 +296,109 @@ def test_encode_fields():
     msg4 = APIEncodeMsg()
     msg4.from_dict(msg.to_dict())
     assert msg4.to_dict() == msg.to_dict()
+
+
+def test_binary_envelope():
+    msg = APIEncodeMsg()
+    msg.enc = six.b('').join([six.int2byte(x) for x in range(0x0, 0xff)])
+    data = six.b('').join(msg.to_binary())
+    d, attachments = unpack_binary(data)
+    assert 'enc' not in d['data']
+    assert d['attachments'] == [['enc', 0xff]]
+
+    msg2 = APIEncodeMsg()
+    msg2.from_binary(data)
+    assert isinstance(msg2.enc, memoryview)
+    assert msg2.enc == msg.enc
+    assert msg2.to_dict() == msg.to_dict()
+
+
+def test_binary_envelope_truncated():
+    msg = APIEncodeMsg()
+    msg.enc = six.b('abcd')
+    data = six.b('').join(msg.to_binary())
+    exception = False
+    try:
+        unpack_binary(data[:-1])
+    except InvalidMessageException:
+        exception = True
+    assert exception
+
+
+def test_binary_envelope_batch():
+    msgs = [APIEncodeMsg(), APIEncodeMsg()]
+    msgs[0].enc = six.b('abcd')
+    data = six.b('').join(part for msg in msgs for part in msg.to_binary())
+    envelopes = unpack_binary_batch(data)
+    assert len(envelopes) == 2
+    assert envelopes[0][1]['enc'] == six.b('abcd')
+    assert 'enc' not in envelopes[1][1]
+
+
+def test_response_matches():
+    res = APISuccessResponse()
+    res.etag = '1-{}'.format(res.content_hash())
+    assert res.matches('5-{}'.format(res.content_hash()))
+    assert not res.matches('1-abcd')
+    assert not res.matches(None)
+
+
+def test_message_layout():
+    assert APITestRequest._layout.required_fields == ('type', 'request', 'block', 'timeout', 'count')
+    assert APITestRequest._layout.fields == tuple(APITestRequest._fields)
+
+    class APISlotMsg(APIMessage):
+        _fields = {'a': True, 'b': False}
+        _state = ['server_state']
+
+        b = 2
+
+    class APISlotSubMsg(APISlotMsg):
+        type = 'sub'
+        b = 3
+
+    assert APISlotMsg.__slots__ == ('a', 'b', 'server_state')
+    assert APISlotSubMsg.__slots__ == ()
+    assert not any('__dict__' in c.__dict__ for c in APISlotSubMsg.__mro__)
+
+    msg = APISlotMsg()
+    msg.a = 1
+    assert msg.b == 2
+    assert msg.to_dict() == {'type': None, 'data': {'a': 1, 'b': 2}}
+    msg.server_state = True
+    assert msg.server_state
+    exception = False
+    try:
+        msg.undeclared = True
+    except AttributeError:
+        exception = True
+    assert exception
+
+    # defaults can be overridden by subclasses, and read and set on the class
+    msg = APISlotSubMsg(a=1, c=4)
+    assert (msg.type, msg.b, msg.c) == ('sub', 3, 4)
+    assert msg.to_dict() == {'type': 'sub', 'data': {'a': 1, 'b': 3}}
+    assert (APISlotMsg.b, APISlotSubMsg.b) == (2, 3)
+    APISlotSubMsg.b = 5
+    assert (APISlotMsg().b, APISlotSubMsg().b, msg.b) == (2, 5, 3)
+    msg.b = 6
+    assert (msg.b, APISlotSubMsg.b) == (6, 5)
+
+    # keys that aren't fields can be read but aren't sent
+    msg = APISlotMsg('{"type": "slot", "data": {"a": 1, "z": 2}}')
+    assert (msg.a, msg.z) == (1, 2)
+    assert msg.to_dict() == {'type': 'slot', 'data': {'a': 1, 'b': 2}}
+
+
+def test_codec_wide_ints():
+    # SSE registers don't fit in 64 bits, make sure they come back as they went in whichever codec is used
+    d = {'xmm0': 0x0123456789abcdef0123456789abcdef, 'rip': 0x7fff5fbff000}
+    for c in [codec] + json_codecs():
+        data = c.dumps(d, wide_ints=True)
+        assert c.loads(data, wide_ints=True) == d
+        assert c.loads(data.encode('UTF-8'), wide_ints=True) == d
+        assert isinstance(c.loads(data, wide_ints=True)['xmm0'], six.integer_types)
+
+    res = api_response('registers', registers=d)
+    assert api_response('registers', data=str(res)).registers == d
+    assert unpack_binary(six.b('').join(res.to_binary()), wide_ints=True)[0]['data']['registers'] == d
@@ -0,0 +1,155 @@
+"""
+Micro-benchmarks for the API's hot paths.
+
+These aren't tests, run them directly:
+
+    python -m tests.benchmarks
+"""
+from __future__ import print_function
+
+import logging
+import timeit
+import tracemalloc
+
+import six
+
+import voltron
+from voltron.api import *
+from voltron.core import Server
+from voltron.plugin import *
+
+log = logging.getLogger('api')
+
+
+def payloads():
+    """
+    Return a dictionary of realistic API responses, as tuples of (dictionary
+    ready to be encoded, whether it may hold integers wider than 64 bits).
+    """
+    registers = api_response('registers')
+    registers.registers = dict(('r{}'.format(i), 0x7fff5fbff000 + i) for i in range(32))
+    registers.registers.update(dict(('xmm{}'.format(i), 0x0123456789abcdef0123456789abcdef) for i in range(16)))
+    registers.registers['rflags'] = 0x246
+
+    memory = api_response('memory')
+    memory.address = 0x7fff5fbff000
+    memory.memory = six.b('').join(six.int2byte(i % 256) for i in range(0x1000))
+    memory.bytes = 0x1000
+
+    disassemble = api_response('disassemble')
+    disassemble.host = 'lldb'
+    disassemble.flavor = 'intel'
+    disassemble.disassembly = '\n'.join('0x{:016x} <+{}>: mov rax, qword ptr [rbp - 0x{:x}]'.format(0x100000f00 + i * 4,
+                                        i * 4, i) for i in range(32))
+
+    return dict((name, (res.to_dict(), res._wide_ints)) for (name, res) in
+                [('registers', registers), ('memory', memory), ('disassemble', disassemble)])
+
+
+def timed(func, number=2000):
+    """
+    Return the best time of a few runs of `func`, in microseconds per call.
+    """
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def bench_codecs():
+    """
+    Compare the JSON codecs that are installed.
+    """
+    print('{:12s} {:12s} {:>10s} {:>10s}'.format('codec', 'payload', 'dumps us', 'loads us'))
+    for (name, (d, wide_ints)) in sorted(payloads().items()):
+        for c in json_codecs():
+            data = c.dumps(d, wide_ints=wide_ints)
+            print('{:12s} {:12s} {:10.2f} {:10.2f}'.format(c.name, name, timed(lambda: c.dumps(d, wide_ints=wide_ints)),
+                                                           timed(lambda: c.loads(data, wide_ints=wide_ints))))
+
+
+def allocated(func, number=1000):
+    """
+    Return the memory allocated by each call to `func` that's still in use
+    afterwards, in bytes.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objs = [func() for i in range(number)]
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del objs
+    return size / number
+
+
+def bench_messages():
+    """
+    Measure the cost of building messages and the memory they take up.
+    """
+    def request():
+        return api_request('memory', address=0x7fff5fbff000, length=0x100, target_id=0)
+
+    def response():
+        res = api_response('registers')
+        res.registers = {}
+        return res
+
+    def queued_request():
+        req = request()
+        req.queued_at = req.deadline = 0
+        req.source = req.unit = 1
+        return req
+
+    print('{:16s} {:>10s} {:>10s} {:>10s}'.format('message', 'build us', 'to_dict us', 'bytes'))
+    for (name, func) in [('request', request), ('queued request', queued_request), ('response', response)]:
+        msg = func()
+        print('{:16s} {:10.2f} {:10.2f} {:10.0f}'.format(name, timed(func), timed(msg.to_dict), allocated(func)))
+
+
+def legacy_parse_request(data):
+    """
+    Parse a request the way the server did before requests were parsed in a
+    single pass: decode it into a generic request to find its type, then
+    decode it again into the plugin's request class.
+    """
+    log.debug("data = {}".format(data))
+    req = APIRequest(data=data)
+    return api_request(req.request, data=data)
+
+
+def bench_ingestion():
+    """
+    Compare the per-request cost of parsing incoming requests, before and
+    after the single pass ingestion path.
+    """
+    server = Server()
+    debugger, voltron.debugger = voltron.debugger, True
+    try:
+        print('{:12s} {:>10s} {:>10s}'.format('request', 'legacy us', 'single us'))
+        reqs = [api_request('registers'), api_request('memory', address=0x1000, length=0x100),
+                api_request('disassemble', count=32)]
+        for req in reqs:
+            data = str(req)
+            print('{:12s} {:10.2f} {:10.2f}'.format(req.request, timed(lambda: legacy_parse_request(data)),
+                                                    timed(lambda: server.parse_request(codec.loads(data)))))
+
+        # a GET request used to be built, encoded as JSON and then parsed again
+        args = {'address': '4096', 'length': '256'}
+        print('{:12s} {:10.2f} {:10.2f}'.format('memory GET',
+                                                timed(lambda: legacy_parse_request(str(api_request('memory', **args)))),
+                                                timed(lambda: server.parse_request({'request': 'memory',
+                                                                                    'data': args}))))
+    finally:
+        voltron.debugger = debugger
+
+
+def main():
+    voltron.setup_env()
+    bench_codecs()
+    print()
+    bench_messages()
+    print()
+    bench_ingestion()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ import logging
 import sys
 import json
 import time
+import threading
 import subprocess
 
 from nose.tools import *
@@ -18,6 +19,7 @@ import voltron
 from voltron.core import *
 from voltron.api import *
 from voltron.plugin import *
+from voltron.dbg import DebuggerAdaptor, ReadWriteLock, cached_metadata, lock_host_read, lock_target_write
 
 import platform
 if platform.system() == 'Darwin':
@@ -26,10 +28,16 @@ if platform.system() == 'Darwin':
 from .common import *
 
 import requests
+import tempfile
+import socket
+import struct
+import six
 
 
 log = logging.getLogger('tests')
 
+rpc_sock = os.path.join(tempfile.gettempdir(), 'voltron-test-rpc.sock')
+
 
 class APIHostNotSupportedRequest(APIRequest):
     @server_side
@@ -52,7 +60,8 @@ def setup():
     voltron.setup_env()
     voltron.config['server'] = {
         "listen": {
-            "tcp":     ["127.0.0.1", 5555]
+            "tcp":     ["127.0.0.1", 5555],
+            "rpc":     rpc_sock
         }
     }
     pm = PluginManager()
@@ -66,10 +75,18 @@ def setup():
     # start up a voltron server
     server = Server()
     server.start()
+    voltron.server = server
 
     time.sleep(2)
 
 
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
 def teardown():
     server.stop()
     time.sleep(2)
@@ -161,3 +178,1032 @@ def test_breakpoints():
     res = api_response('breakpoints', data=data)
     assert res.is_success
     assert res.breakpoints == breakpoints_response
+
+
+def test_batch():
+    data = requests.post('http://localhost:5555/api/batch',
+                         data='[{"type":"request","request":"targets"},{"type":"request","request":"state"}]').text
+    batch = json.loads(data)
+    assert len(batch) == 2
+    res = api_response('targets', data=json.dumps(batch[0]))
+    assert res.is_success
+    assert res.targets == targets_response
+    res = api_response('state', data=json.dumps(batch[1]))
+    assert res.is_success
+    assert res.state == state_response
+
+
+def test_batch_bad_request():
+    data = requests.post('http://localhost:5555/api/batch',
+                         data='[{"type":"request","request":"no_such_request"},{"type":"request","request":"state"}]').text
+    batch = json.loads(data)
+    res = APIResponse(data=json.dumps(batch[0]))
+    assert res.is_error
+    assert res.code == 0x1002
+    res = api_response('state', data=json.dumps(batch[1]))
+    assert res.is_success
+
+
+def test_batch_bad_json():
+    data = requests.post('http://localhost:5555/api/batch', data='xxx').text
+    res = APIResponse(data=data)
+    assert res.is_error
+    assert res.code == 0x1001
+
+
+def test_client_send_batch():
+    client = Client(url='http://localhost:5555/api/request')
+    t_res, s_res = client.send_batch([api_request('targets'), api_request('state')])
+    assert t_res.is_success
+    assert t_res.targets == targets_response
+    assert s_res.is_success
+    assert s_res.state == state_response
+
+
+def test_client_send_batch_blocking():
+    client = Client(url='http://localhost:5555/api/request')
+    results = []
+    t = threading.Thread(target=lambda: results.extend(
+        client.send_batch([api_request('targets', block=True), api_request('state', block=True)])))
+    t.start()
+    time.sleep(0.5)
+    assert len(server.queue) == 2
+    server.dispatch_queue()
+    t.join()
+    t_res, s_res = results
+    assert t_res.is_success
+    assert t_res.targets == targets_response
+    assert s_res.is_success
+    assert s_res.state == state_response
+
+
+def test_response_cache():
+    server.advance_generation()
+    adaptor.targets.reset_mock()
+    stats = server.stats()['cache']
+    for i in range(3):
+        data = requests.get('http://localhost:5555/api/targets').text
+        res = api_response('targets', data=data)
+        assert res.is_success
+        assert res.targets == targets_response
+    assert adaptor.targets.call_count == 1
+    assert server.stats()['cache']['hits'] == stats['hits'] + 2
+
+    # a new stop generation means we go back to the debugger
+    server.advance_generation()
+    data = requests.get('http://localhost:5555/api/targets').text
+    assert api_response('targets', data=data).is_success
+    assert adaptor.targets.call_count == 2
+
+
+def test_response_cache_invalidated_by_command():
+    server.advance_generation()
+    adaptor.targets.reset_mock()
+    requests.get('http://localhost:5555/api/targets')
+    requests.get('http://localhost:5555/api/command?command=reg%20read&invalidate=1')
+    requests.get('http://localhost:5555/api/targets')
+    assert adaptor.targets.call_count == 2
+
+
+def test_response_cache_kept_by_command():
+    # views like the backtrace view run commands on every stop, that mustn't flush the cache
+    server.advance_generation()
+    adaptor.targets.reset_mock()
+    requests.get('http://localhost:5555/api/targets')
+    requests.get('http://localhost:5555/api/command?command=bt')
+    requests.get('http://localhost:5555/api/targets')
+    assert adaptor.targets.call_count == 1
+
+
+def test_memory_command_not_cached():
+    assert api_request('memory', address=0x1000, length=0x40).read_only
+    assert not api_request('memory', command='p $sp', length=0x40).read_only
+
+
+def test_run_batch():
+    # each of these requests makes several debugger calls, which should all be made in one batch
+    run_batch = adaptor.run_batch
+    adaptor.run_batch = Mock(side_effect=run_batch)
+    try:
+        for req in [api_request('registers'), api_request('stack', length=0x40),
+                    api_request('memory', address=0x1000, length=0x40)]:
+            adaptor.run_batch.reset_mock()
+            res = req.dispatch()
+            assert res.is_success
+            assert adaptor.run_batch.call_count == 1
+    finally:
+        adaptor.run_batch = run_batch
+
+
+def test_cached_metadata():
+    class Adaptor(DebuggerAdaptor):
+        calls = 0
+
+        @cached_metadata('arch')
+        def arch(self):
+            self.calls += 1
+            return 'x86_64'
+
+    a = Adaptor()
+    assert a.arch() == 'x86_64'
+    assert a.arch() == 'x86_64'
+    assert a.calls == 1
+
+    # a debugger event means it has to be fetched again
+    a.invalidate_metadata()
+    assert a.arch() == 'x86_64'
+    assert a.calls == 2
+
+
+def test_cached_metadata_targets():
+    class Adaptor(DebuggerAdaptor):
+        @cached_metadata('_target')
+        def _target(self, target_id=0):
+            return {'id': target_id, 'internal': True}
+
+        @cached_metadata('target')
+        def target(self, target_id=0):
+            return {'id': target_id}
+
+    # each target, and each method, is cached separately
+    a = Adaptor()
+    assert a.target() == {'id': 0}
+    assert a.target(1) == {'id': 1}
+    assert a.target(target_id=1) == {'id': 1}
+    assert a._target(target_id=2) == {'id': 2, 'internal': True}
+    assert a._target(0) == {'id': 0, 'internal': True}
+    assert a.target(2) == {'id': 2}
+
+
+def test_lock_target_id():
+    class Adaptor(DebuggerAdaptor):
+        def target_lock(self, target_id=0):
+            locked.append(target_id)
+            return super(Adaptor, self).target_lock(target_id)
+
+        @lock_host_read
+        def target(self, target_id=0):
+            return target_id
+
+        @lock_target_write
+        def write_memory(self, address, data, target_id=0):
+            return target_id
+
+    # the target's lock is taken whether its ID is passed by position or keyword
+    locked = []
+    a = Adaptor()
+    a.target(1)
+    a.target(target_id=2)
+    a.target()
+    a.write_memory(0x1000, b'x', 3)
+    a.write_memory(0x1000, b'x', target_id=4)
+    assert locked == [1, 2, 0, 3, 4]
+
+
+def test_read_write_lock():
+    lock = ReadWriteLock()
+    events = []
+
+    def read():
+        with lock.reading():
+            events.append('read')
+            time.sleep(0.2)
+
+    # readers don't wait for each other
+    threads = [threading.Thread(target=read) for i in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    assert events == ['read'] * 3
+
+    # a writer waits for them all to finish
+    with lock.writing():
+        assert len(lock.readers) == 0
+        # it can read and write again while it holds the lock
+        with lock.reading():
+            with lock.writing():
+                pass
+    for t in threads:
+        t.join()
+
+    with lock.reading():
+        assert_raises(RuntimeError, lock.acquire_write)
+
+
+def test_dispatch_concurrently():
+    threads = set()
+
+    def memory(address, length, target_id):
+        threads.add(threading.current_thread())
+        time.sleep(0.1)
+        return chr(address & 0xff) * length
+
+    m = adaptor.memory
+    capabilities = adaptor.capabilities
+    adaptor.memory = Mock(side_effect=memory)
+    adaptor.capabilities = Mock(return_value=['async'])
+    try:
+        server.advance_generation()
+        reqs = [str(api_request('memory', address=0x2000 + i, length=4)) for i in range(4)]
+        res = server.handle_batch('[{}]'.format(', '.join(reqs)))
+        assert [r.address for r in res] == [0x2000 + i for i in range(4)]
+        assert [r.memory for r in res] == [six.u(chr(i) * 4) for i in range(4)]
+        assert len(threads) > 1
+    finally:
+        adaptor.memory = m
+        adaptor.capabilities = capabilities
+
+
+def test_client_wide_registers():
+    registers = adaptor.registers
+    regs = {'xmm0': 0x0123456789abcdef0123456789abcdef, 'rip': 0x1000}
+    adaptor.registers = Mock(return_value=regs)
+    try:
+        server.advance_generation()
+        client = Client(url='http://localhost:5555/api/request')
+        assert client.send_request(api_request('registers')).registers == regs
+        # with the memory in the batch, the responses come back in binary envelopes
+        r_res, m_res = client.send_batch([api_request('registers'), api_request('memory', address=0x1000, length=16)])
+        assert r_res.registers == regs
+        client.stop()
+    finally:
+        adaptor.registers = registers
+
+
+def test_not_modified():
+    res = requests.post('http://localhost:5555/api/request', data=str(api_request('targets')))
+    etag = json.loads(res.text)['etag']
+    res = requests.post('http://localhost:5555/api/request',
+                        data=str(api_request('targets', if_none_match=etag)))
+    d = json.loads(res.text)
+    assert d['status'] == 'not_modified'
+    assert d['etag'] == etag
+    assert d['data'] == {}
+
+
+def test_lazy_etag():
+    server.advance_generation()
+    # debug logging serialises the response, which works out its etag
+    core_log = logging.getLogger('core')
+    level = core_log.level
+    core_log.setLevel(logging.INFO)
+    try:
+        res = server.dispatch_request(api_request('targets'))
+    finally:
+        core_log.setLevel(level)
+    assert res.etag_generation == server.generation
+    assert res._etag is None
+    etag = '{}-{}'.format(server.generation, res.content_hash())
+    assert res.to_dict()['etag'] == etag
+    assert res._etag == etag
+
+
+def test_client_not_modified():
+    client = Client(url='http://localhost:5555/api/request')
+    first = client.send_request(api_request('targets'))
+    assert first.etag
+    res = client.send_request(api_request('targets'))
+    assert res is not first
+    assert res.to_dict() == first.to_dict()
+    assert client.stats()['not_modified'] == 1
+    res, = client.send_batch([api_request('targets')])
+    assert res is not first
+    assert res.targets == first.targets
+    client.stop()
+
+
+def test_client_not_modified_render():
+    from argparse import Namespace
+    from voltron.plugins.view.memory import MemoryView
+    target = dict(targets_response[0], addr_size=8, byte_order='little')
+    adaptor.target = Mock(return_value=target)
+    adaptor.targets = Mock(return_value=[target])
+    adaptor.memory = Mock(return_value=six.b('\xff') * 0x20)
+    server.advance_generation()
+    try:
+        client = Client(url='http://localhost:5555/api/request')
+        view = MemoryView.__new__(MemoryView)
+        view.args = Namespace(words=None, bytes=8, track=False, deref=True, reverse=False)
+        reqs = [api_request('targets'), api_request('memory', address=0x1000, words=4, deref=True)]
+        first = client.send_requests(*reqs)
+        first_tokens = list(view.generate_tokens(first))
+        assert first_tokens
+        second = client.send_requests(*reqs)
+        assert client.stats()['not_modified'] == 2
+        assert list(view.generate_tokens(second)) == first_tokens
+        assert second[1].deref == first[1].deref
+    finally:
+        inject_mock(adaptor)
+        server.advance_generation()
+        client.stop()
+
+
+def test_client_response_cache_lru():
+    client = Client(url='http://localhost:5555/api/request')
+    client.response_cache_size = 2
+    for key in ['a', 'b']:
+        client.cache_response(key, APISuccessResponse(etag='1-' + key))
+    # using 'a' makes 'b' the least recently used
+    assert client.cached_response('a').etag == '1-a'
+    client.cache_response('c', APISuccessResponse(etag='1-c'))
+    assert client.cached_response('b') is None
+    assert client.cached_response('a').etag == '1-a'
+    assert client.cached_response('c').etag == '1-c'
+    client.stop()
+
+
+class MultiViewTestView(object):
+    def __init__(self, reqs, priority=None):
+        self.reqs = reqs
+        self.priority = priority
+        self.rendered = []
+        self.errors = []
+
+    def build_requests(self):
+        return [api_request(name, **args) for (name, args) in self.reqs]
+
+    def render(self, results):
+        self.rendered.append(results)
+
+    def do_render(self, error=None):
+        self.errors.append(error)
+
+
+def test_multi_view():
+    from voltron.plugins.view.multi import MultiView
+    regs = MultiViewTestView([('registers', {}), ('memory', {'address': 0x1000, 'length': 16})], priority=1)
+    targets = MultiViewTestView([('targets', {}), ('registers', {})], priority=5)
+    multi = MultiView.__new__(MultiView)
+    multi.views = [regs, targets]
+
+    # the registers request is only sent once, at the higher of the two views' priorities
+    reqs = multi.build_requests()
+    assert [req.request for req in reqs] == ['registers', 'memory', 'targets']
+    assert [req.priority for req in reqs] == [5, 1, 5]
+    assert multi.slices == [[0, 1], [2, 0]]
+
+    results = [api_response('registers', registers={'rip': 0x1000}), api_response('memory', memory=b'x' * 16),
+               api_response('targets', targets=targets_response)]
+    for res in results:
+        res.status = 'success'
+    multi.render(results)
+    assert regs.rendered == [[results[0], results[1]]]
+    res = targets.rendered[0]
+    assert res[0] is results[2]
+    # the second view gets its own copy of the shared registers response
+    assert res[1] is not results[0]
+    assert res[1].to_dict() == results[0].to_dict()
+    res[1].registers['rip'] = 0
+    assert results[0].registers['rip'] == 0x1000
+
+    multi.render(error='gone')
+    assert regs.errors == targets.errors == ['gone']
+
+
+def test_stats():
+    data = requests.get('http://localhost:5555/api/stats').text
+    res = api_response('stats', data=data)
+    assert res.is_success
+    assert res.stats['generation'] == server.generation
+    assert 'hits' in res.stats['cache']
+
+
+def test_gdb_stop_handler():
+    # load the GDB adaptor against a stand-in for GDB's module, just enough to create its command
+    import importlib
+    import types
+    from scruffy.plugin import PluginRegistry
+    from voltron.dbg import validate_busy
+    gdb = types.ModuleType('gdb')
+    gdb.Command = type('Command', (object,), {'__init__': lambda self, *args: None})
+    gdb.COMMAND_NONE = gdb.COMPLETE_NONE = 0
+    gdb.events = Mock()
+    gdb.post_event = Mock()
+    plugins = list(PluginRegistry.plugins)
+    sys.modules['gdb'] = gdb
+    try:
+        command = importlib.import_module('voltron.plugins.debugger.dbg_gdb').GDBCommand()
+    finally:
+        del sys.modules['gdb']
+        del sys.modules['voltron.plugins.debugger.dbg_gdb']
+        PluginRegistry.plugins[:] = plugins
+
+    # requests sent by anything that hears about the stop should see a stopped target
+    adaptor.busy = True
+    adaptor.target_is_busy = lambda target_id=0: adaptor.busy
+    adaptor.targets = types.MethodType(validate_busy(lambda self, target_id=0: targets_response), adaptor)
+    statuses = []
+
+    def callback(*args):
+        statuses.append(server.dispatch_request(api_request('targets')).status)
+
+    publish = server.publish
+    server.publish = lambda event: (callback(), publish(event))
+    adaptor.add_listener(callback)
+    try:
+        command.stop_handler(None)
+    finally:
+        server.publish = publish
+        adaptor.remove_listener(callback)
+        del adaptor.busy, adaptor.target_is_busy
+        inject_mock(adaptor)
+    assert statuses == ['success', 'success']
+
+
+def test_events():
+    client = Client(url='http://localhost:5555/api/request')
+    events = client.events()
+    hello = next(events)
+    assert hello.event == 'hello'
+    assert hello.generation == server.generation
+    server.state_changed('stopped')
+    event = next(events)
+    assert event.event == 'stopped'
+    assert event.state == 'stopped'
+    assert event.generation == hello.generation + 1
+    assert client.generation == event.generation
+    events.close()
+
+
+def test_async_client():
+    if six.PY2:
+        return
+    import asyncio
+    from voltron.aio import AsyncClient
+
+    async def run(url):
+        async with AsyncClient(url=url) as client:
+            res = await client.send_request(api_request('targets'))
+            assert res.targets == targets_response
+            results = await client.send_requests(api_request('targets'), api_request('version'))
+            assert results[0].targets == targets_response
+            assert results[1].is_success
+            results = await client.send_batch([api_request('targets'), api_request('version')])
+            assert results[0].targets == targets_response
+            assert results[1].is_success
+
+    asyncio.run(run('http://localhost:5555/api/request'))
+    asyncio.run(run('rpc+unix://' + rpc_sock))
+
+
+def test_async_client_stops():
+    if six.PY2:
+        return
+    import asyncio
+    from voltron.aio import AsyncClient
+
+    async def run(url):
+        async with AsyncClient(url=url) as client:
+            stops = client.stops()
+            hello = await stops.__anext__()
+            assert hello.event == 'hello'
+            server.state_changed('stopped')
+            event = await stops.__anext__()
+            assert event.event == 'stopped'
+            assert event.generation == hello.generation + 1
+            await stops.aclose()
+
+    asyncio.run(run('http://localhost:5555/api/request'))
+    asyncio.run(run('rpc+unix://' + rpc_sock))
+
+
+def test_async_client_round_trip():
+    if six.PY2:
+        return
+    import asyncio
+    from voltron.aio import AsyncClient
+
+    async def run(binary):
+        async with AsyncClient(url='http://localhost:5555/api/request', binary=binary) as client:
+            res = await client.send_request(api_request('registers'))
+            assert res.is_success
+            assert res.registers == registers_response
+            res = await client.send_request(api_request('state'))
+            assert res.state == state_response
+            # the connection is kept open and reused
+            assert len(client.connections) == 1
+
+            # a response we already have isn't sent again
+            first = await client.send_request(api_request('targets'))
+            assert first.etag
+            res = await client.send_request(api_request('targets'))
+            assert res is not first
+            assert res.to_dict() == first.to_dict()
+            assert client.client.stats()['not_modified'] == 1
+
+            # each request in a batch gets its own response, in order
+            results = await client.send_batch([api_request('registers'), APIRequest(request='no_such_request'),
+                                               api_request('targets'), api_request('state')])
+            assert results[0].registers == registers_response
+            assert results[1].is_error
+            assert results[1].code == APIPluginNotFoundErrorResponse.code
+            assert results[2].targets == targets_response
+            assert results[3].state == state_response
+            # we already had the successful ones
+            assert client.client.stats()['not_modified'] == 4
+
+            res = await client.send_request(APIRequest(request='no_such_request'))
+            assert res.is_error
+
+    asyncio.run(run(True))
+    asyncio.run(run(False))
+
+
+def test_rpc():
+    client = Client(url='rpc+unix://' + rpc_sock)
+    res = client.perform_request('targets')
+    assert res.is_success
+    assert res.targets == targets_response
+    res = client.perform_request('state')
+    assert res.is_success
+    assert res.state == state_response
+
+
+def test_rpc_batch():
+    client = Client(url='rpc+unix://' + rpc_sock)
+    t_res, s_res = client.send_batch([api_request('targets'), api_request('state')])
+    assert t_res.is_success
+    assert t_res.targets == targets_response
+    assert s_res.is_success
+    assert s_res.state == state_response
+
+
+def test_rpc_connection_reuse():
+    client = Client(url='rpc+unix://' + rpc_sock)
+    for i in range(3):
+        res, = client.send_requests(api_request('targets'))
+        assert res.targets == targets_response
+    assert len(client.rpc_connections) == 1
+    client.stop()
+    assert len(client.rpc_connections) == 0
+
+
+def test_client_connection_reuse():
+    client = Client(url='http://localhost:5555/api/request', build_requests=lambda: [api_request('targets')],
+                    callback=lambda results=None, error=None: None)
+    for i in range(3):
+        client.update()
+    stats = client.stats()
+    assert stats['requests'] == 3
+    assert stats['handshakes'] == 1
+    assert stats['reused'] == 2
+    client.stop()
+
+
+version_request = b'GET /api/version HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+def read_http_response(f):
+    assert f.readline().startswith(b'HTTP/1.1 200')
+    length = None
+    line = f.readline()
+    while line != b'\r\n':
+        key, _, value = line.partition(b':')
+        if key.lower() == b'content-length':
+            length = int(value)
+        line = f.readline()
+    return APIResponse(data=f.read(length).decode('UTF-8'))
+
+
+def test_http_pipelining():
+    # both requests arrive together, so the second is already in the server's buffer when it finishes the first
+    sock = socket.create_connection(('localhost', 5555))
+    try:
+        sock.settimeout(5)
+        sock.sendall(version_request * 2)
+        f = sock.makefile('rb')
+        for i in range(2):
+            assert read_http_response(f).is_success
+    finally:
+        sock.close()
+
+
+def test_client_worker_reuse():
+    client = Client(url='http://localhost:5555/api/request')
+    reqs = [api_request('targets') for i in range(3)]
+    for res in client.send_requests(*reqs):
+        assert res.targets == targets_response
+    stats = client.stats()
+    for res in client.send_requests(*reqs):
+        assert res.targets == targets_response
+    after = client.stats()
+    assert after['threads'] == stats['threads']
+    # one connection for each worker, plus the calling thread
+    assert after['handshakes'] <= after['threads'] + 1
+    client.stop()
+
+
+def test_socket_watcher():
+    if not sys.platform.startswith('linux'):
+        return
+    path = os.path.join(tempfile.mkdtemp(), 'sock')
+    watcher = SocketWatcher(path)
+    assert watcher.fd is not None
+    assert not watcher.wait(0.1)
+
+    def create():
+        time.sleep(0.2)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.close()
+    threading.Thread(target=create).start()
+    start = time.time()
+    assert watcher.wait(5)
+    assert time.time() - start < 1
+    watcher.close()
+    os.unlink(path)
+
+
+def test_client_retry_backoff():
+    client = Client(url='http://localhost:1/api/request')
+    client.socket_path = lambda: None
+    client.min_retry_delay = 0.01
+    client.max_retry_delay = 0.05
+    delays = []
+    for i in range(5):
+        client.wait_for_server()
+        delays.append(client.retry_delay)
+    assert delays == [0.01, 0.02, 0.04, 0.05, 0.05]
+
+
+def test_page_cache():
+    cache = PageCache(page_size=16)
+    fetches = []
+
+    def fetch(address, length):
+        fetches.append((address, length))
+        return six.b('').join(six.int2byte((address + i) % 256) for i in range(length))
+
+    assert cache.read(20, 8, 1, fetch).tobytes() == six.b('').join(six.int2byte(i) for i in range(20, 28))
+    assert fetches == [(16, 16)]
+    assert cache.read(8, 40, 1, fetch).tobytes() == six.b('').join(six.int2byte(i) for i in range(8, 48))
+    assert fetches == [(16, 16), (0, 16), (32, 16)]
+    assert cache.read(0, 48, 1, fetch).tobytes() == six.b('').join(six.int2byte(i) for i in range(0, 48))
+    assert len(fetches) == 3
+    stats = cache.stats()
+    assert stats['hits'] == 4
+    assert stats['misses'] == 3
+    assert stats['bytes_saved'] == 64
+
+    # a new generation throws everything away
+    cache.read(20, 8, 2, fetch)
+    assert fetches[-1] == (16, 16)
+    assert cache.read(100, 8, 2, lambda address, length: None) is None
+
+
+def test_client_page_cache():
+    memory = adaptor.memory
+    adaptor.memory = Mock(side_effect=lambda address, length, target_id: '\x41' * length)
+    try:
+        client = Client(url='http://localhost:5555/api/request')
+        client.generation = server.advance_generation()
+        res = client.send_request(api_request('memory', address=0x10000, length=16))
+        assert cast_b(res.memory) == six.b('A' * 16)
+        res1, res2 = client.send_batch([api_request('memory', address=0x10008, length=16),
+                                        api_request('memory', address=0x10ff8, length=16)])
+        assert res1.address == 0x10008
+        assert cast_b(res1.memory) == six.b('A' * 16)
+        assert cast_b(res2.memory) == six.b('A' * 16)
+        assert adaptor.memory.call_count == 2
+        stats = client.stats()['page_cache']
+        assert stats['hits'] == 2
+        assert stats['misses'] == 2
+        assert stats['bytes_saved'] == 2 * client.pages.page_size
+
+        # requests that dereference pointers always go to the server
+        client.send_request(api_request('memory', address=0x10000, length=16, deref=True))
+        assert adaptor.memory.call_count == 3
+        client.stop()
+    finally:
+        adaptor.memory = memory
+
+
+def test_repl_snapshot():
+    from voltron.repl import REPLClient
+    client = REPLClient(url='http://localhost:5555/api/request')
+    client.snapshot_mode()
+    assert client.rip == registers_response['rip']
+    assert client.rsp == registers_response['rsp']
+    assert client.stats()['requests'] == 1
+    client.snapshot_mode(False)
+    client.stop()
+
+
+def test_rpc_frame_too_large():
+    f = six.BytesIO(struct.pack('>I', MAX_FRAME_SIZE + 1))
+    exception = False
+    try:
+        read_frame(f)
+    except InvalidMessageException:
+        exception = True
+    assert exception
+
+
+def test_rpc_events():
+    client = Client(url='rpc+unix://' + rpc_sock)
+    events = client.events()
+    hello = next(events)
+    assert hello.event == 'hello'
+    server.state_changed('stopped')
+    event = next(events)
+    assert event.event == 'stopped'
+    assert event.generation == hello.generation + 1
+    events.close()
+
+
+def test_listener_stats():
+    listener = [s for s in server.listeners if s.listener_name == 'tcp'][0]
+    with listener.connections_lock:
+        before = set(listener.connections)
+    socks = [socket.create_connection(('localhost', 5555)) for i in range(3)]
+    time.sleep(0.5)
+    with listener.connections_lock:
+        new = listener.connections - before
+    assert len(new) == 3
+    stats = server.stats()['listeners']['tcp']
+    assert stats['workers'] <= stats['max_workers']
+    assert stats['connections'] == stats['active_connections'] + stats['idle_connections']
+
+    # connections are dropped from the registry as soon as they're closed
+    for sock in socks:
+        sock.close()
+    assert wait_for(lambda: not (new & listener.connections))
+
+
+def test_listener_not_starved_by_streams():
+    listener = [s for s in server.listeners if s.listener_name == 'tcp'][0]
+    max_workers = listener.pool.max_workers
+    listener.pool.max_workers = 2
+    streams = []
+    try:
+        for i in range(3):
+            events = Client(url='http://localhost:5555/api/request').events()
+            assert next(events).event == 'hello'
+            streams.append(events)
+        # the streams are written by the server's event streams rather than the listener's workers
+        assert wait_for(lambda: len(server.streams) >= 3)
+        assert listener.pool.stats()['detached'] == 0
+        res = requests.get('http://localhost:5555/api/version', timeout=5)
+        assert res.status_code == 200
+        server.state_changed('stopped')
+        for events in streams:
+            assert next(events).event == 'stopped'
+    finally:
+        listener.pool.max_workers = max_workers
+        for events in streams:
+            events.close()
+
+
+def test_listener_threads_bounded():
+    listener = [s for s in server.listeners if s.listener_name == 'tcp'][0]
+    max_workers = listener.pool.max_workers
+    listener.pool.max_workers = 2
+    conns = []
+    try:
+        threads = threading.active_count()
+        for i in range(8):
+            sock = socket.create_connection(('localhost', 5555))
+            sock.settimeout(5)
+            f = sock.makefile('rb')
+            conns.append((sock, f))
+            sock.sendall(version_request)
+            assert read_http_response(f).is_success
+
+        # the idle connections are parked on the selector rather than each holding a thread
+        assert wait_for(lambda: listener.stats()['parked'] == 8)
+        assert listener.pool.stats()['workers'] <= 2
+        assert threading.active_count() <= threads + 2
+
+        # and they're picked up again when they're used
+        for (sock, f) in conns:
+            sock.sendall(version_request)
+            assert read_http_response(f).is_success
+    finally:
+        listener.pool.max_workers = max_workers
+        for (sock, f) in conns:
+            f.close()
+            sock.close()
+    assert wait_for(lambda: listener.stats()['parked'] == 0)
+
+
+def test_worker_pool():
+    pool = WorkerPool(max_workers=2, idle_timeout=0.5)
+    done = []
+    event = threading.Event()
+    for i in range(5):
+        pool.submit(lambda i: (event.wait(), done.append(i)), i)
+    time.sleep(0.2)
+    assert pool.stats()['workers'] == 2
+    assert pool.stats()['queued'] == 3
+    event.set()
+    time.sleep(0.2)
+    assert sorted(done) == list(range(5))
+    time.sleep(1)
+    assert pool.stats()['workers'] == 0
+
+
+def test_worker_pool_detach():
+    pool = WorkerPool(max_workers=1, idle_timeout=0.5)
+    event = threading.Event()
+    done = []
+
+    def wait():
+        with detached_worker():
+            event.wait()
+        done.append('wait')
+
+    pool.submit(wait)
+    pool.submit(done.append, 'work')
+    assert wait_for(lambda: done == ['work'])
+    assert pool.stats()['detached'] == 1
+    event.set()
+    assert wait_for(lambda: sorted(done) == ['wait', 'work'])
+    assert wait_for(lambda: pool.stats()['workers'] <= 1)
+
+
+def test_worker_pool_max_detached():
+    pool = WorkerPool(max_workers=1, idle_timeout=0.5, max_detached=1)
+    event = threading.Event()
+    done = []
+
+    def wait():
+        with detached_worker():
+            event.wait()
+        done.append('wait')
+
+    for i in range(3):
+        pool.submit(wait)
+    # only one of the waits could detach, the next one holds the pool's only worker
+    assert wait_for(lambda: pool.stats()['workers'] == 1 and pool.stats()['detached'] == 1)
+    time.sleep(0.2)
+    assert pool.stats()['queued'] == 1
+    event.set()
+    assert wait_for(lambda: done == ['wait'] * 3)
+
+
+def test_queue_coalescing():
+    server.advance_generation()
+    adaptor.registers.reset_mock()
+    client = Client(url='http://localhost:5555/api/request')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.send_request(api_request('registers', block=True))))
+               for i in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.5)
+    assert len(server.queue) == 3
+    assert server.queue.stats()['distinct'] == 1
+    server.dispatch_queue()
+    for t in threads:
+        t.join()
+    assert len(results) == 3
+    assert all(res.is_success and res.registers == registers_response for res in results)
+    assert adaptor.registers.call_count == 1
+
+
+def test_queue_scheduling():
+    q = RequestQueue()
+    slow = [api_request('memory', block=True, address=i, length=0x40) for i in range(4)]
+    fast = api_request('registers', block=True)
+    urgent = api_request('disassemble', block=True, count=16, priority=10)
+    q.put(slow, source=1)
+    q.put([fast], source=2)
+    q.put([urgent], source=1)
+    q.put([slow[3]], source=1)
+    order = [[reqs[0] for reqs in unit] for unit in q.drain()]
+    # the batch stays together, and the other connection gets a turn before its next request
+    assert order == [[urgent], slow[:3], [fast], [slow[3]]]
+
+
+def test_queue_drops_expired():
+    adaptor.registers.reset_mock()
+    server.advance_generation()
+    dropped = server.queue.stats()['dropped']
+    req = api_request('registers', block=True)
+    server.queue_requests([req])
+    req.deadline = time.time() - 1
+    server.dispatch_queue()
+    assert req.wait_event.is_set()
+    assert req.response.timed_out
+    assert adaptor.registers.call_count == 0
+    stats = server.queue.stats()
+    assert stats['dropped'] == dropped + 1
+    assert stats['wait_max'] >= 0
+
+
+def test_dispatch_slices_keep_batches_together():
+    server.advance_generation()
+    reqs = [api_request('memory', block=True, address=i, length=0x40) for i in range(3)]
+    server.queue_requests(reqs)
+    assert not server.dispatch_queue(budget=0)
+    assert all(req.wait_event.is_set() for req in reqs)
+
+
+def test_dispatch_slices():
+    server.advance_generation()
+    adaptor.registers.reset_mock()
+    reqs = [api_request('memory', block=True, address=i, length=0x40) for i in range(3)]
+    for req in reqs:
+        server.queue_requests([req])
+    assert server.dispatch_queue(budget=0)
+    assert reqs[0].wait_event.is_set()
+    assert not reqs[1].wait_event.is_set()
+    assert server.stats()['queue']['pending'] == 2
+
+    # requests queued after the stop wait for the next one
+    late = api_request('registers', block=True)
+    server.queue_requests([late])
+    assert server.dispatch_pending(budget=0)
+    assert not server.dispatch_pending()
+    assert all(req.wait_event.is_set() for req in reqs)
+    assert not late.wait_event.is_set()
+    assert adaptor.registers.call_count == 0
+    server.dispatch_queue()
+    assert late.wait_event.is_set()
+
+
+def test_binary_memory():
+    server.advance_generation()
+    res = Client(url='http://localhost:5555/api/request').send_request(api_request('memory', address=0x1000, length=0x40))
+    assert res.is_success
+    assert isinstance(res.memory, memoryview)
+    assert res.memory == cast_b(memory_response)
+
+    json_client = Client(url='http://localhost:5555/api/request', binary=False)
+    res = json_client.send_request(api_request('memory', address=0x1000, length=0x40))
+    assert res.is_success
+    assert res.memory == cast_b(memory_response)
+
+
+def test_compression_skips_local_clients():
+    res = requests.get('http://localhost:5555/api/command?command=reg%20read', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in res.headers
+    assert APIResponse(data=res.text).output == command_response
+
+
+def test_compression():
+    # pretend we're remote
+    APIFlaskApp.compress_local = True
+    try:
+        res = requests.get('http://localhost:5555/api/command?command=reg%20read',
+                           headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['Content-Encoding'] == 'gzip'
+        assert int(res.headers['Content-Length']) < len(res.content)
+        assert APIResponse(data=res.text).output == command_response
+
+        res = requests.get('http://localhost:5555/api/command?command=reg%20read',
+                           headers={'Accept-Encoding': 'identity'})
+        assert 'Content-Encoding' not in res.headers
+
+        # small responses aren't worth compressing
+        res = requests.get('http://localhost:5555/api/version', headers={'Accept-Encoding': 'deflate'})
+        assert 'Content-Encoding' not in res.headers
+
+        client = Client(url='http://localhost:5555/api/request')
+        res = client.perform_request('command', command='reg read')
+        assert res.output == command_response
+        stats = client.stats()
+        assert stats['responses'] == 1
+        assert stats['compressed'] == 1
+        assert stats['compression_ratio'] > 1
+    finally:
+        APIFlaskApp.compress_local = False
+
+
+def test_client_async_updates():
+    results = []
+    capabilities = adaptor.capabilities
+    adaptor.capabilities = Mock(return_value=['async'])
+    client = Client(url='http://localhost:5555/api/request')
+    client.start(build_requests=lambda: [api_request('targets')],
+                 callback=lambda results_=None, error=None: results.append(results_))
+    try:
+        # the hello event brings the client up to date
+        assert wait_for(lambda: len(results) == 1)
+        assert client.rendered_generation == server.generation
+        server.state_changed('stopped')
+        assert wait_for(lambda: len(results) == 2)
+        assert results[-1][0].targets == targets_response
+    finally:
+        client.stop()
+        # wake the client up so it notices it's been stopped
+        server.state_changed('continued')
+        client.sw.join(5)
+        adaptor.capabilities = capabilities
+
+
+def test_client_priority():
+    req = api_request('targets')
+    client = Client(url='http://localhost:5555/api/request', priority=10,
+                    build_requests=lambda: [req], callback=lambda results: None)
+    client.update()
+    assert req.priority == 10
+
+
+def test_binary_batch():
+    server.advance_generation()
+    client = Client(url='http://localhost:5555/api/request')
+    t_res, m_res = client.send_batch([api_request('targets'), api_request('memory', address=0x1000, length=0x40)])
+    assert t_res.targets == targets_response
+    assert isinstance(m_res.memory, memoryview)
+    assert m_res.memory == cast_b(memory_response)
@@ -0,0 +1,300 @@
+"""
+An asyncio client for the Voltron server.
+
+This module requires Python 3.6 or later, so it isn't imported by the rest of
+Voltron. It can be used from asyncio applications (e.g. dashboards) to talk to
+one or more debuggers from a single event loop, without a thread per request.
+
+    async with AsyncClient(url='http://localhost:5555/api/request') as client:
+        async for event in client.stops():
+            res = await client.send_request(api_request('registers'))
+"""
+import asyncio
+import logging
+import struct
+import zlib
+
+from requests import ConnectionError
+from six.moves.urllib.parse import unquote, urlsplit
+
+from .api import *
+from .core import Client, MAX_FRAME_SIZE
+
+log = logging.getLogger('core')
+
+
+class AsyncClient(object):
+    """
+    Used by asyncio code to communicate with the server.
+
+    Accepts the same URLs as `Client` (HTTP over TCP or a Unix domain socket,
+    or the RPC listener), and returns the same APIResponse classes.
+    Connections to the server are kept open and reused between requests.
+    """
+    # maximum number of idle connections to keep open
+    pool_size = 4
+
+    def __init__(self, host='127.0.0.1', port=5555, sockfile=None, url=None, binary=True, priority=None):
+        """
+        Initialise a new client.
+
+        See `Client` for the arguments.
+        """
+        # the synchronous client works out the URLs and builds response objects, it never connects
+        self.client = Client(host=host, port=port, sockfile=sockfile, url=url, binary=binary, priority=priority)
+        self.binary = binary
+        self.priority = priority
+        self.connections = []
+        self.done = False
+        self.generation = None
+
+        u = urlsplit(self.client.url)
+        self.scheme = u.scheme
+        if self.scheme == 'http':
+            self.address = (u.hostname, u.port or 80)
+        else:
+            self.address = unquote(u.netloc) if self.scheme == 'http+unix' else self.client.rpc_path
+        self.host = u.netloc if self.scheme == 'http' else 'localhost'
+        self.path = u.path
+        self.batch_path = urlsplit(self.client.batch_url).path
+        self.events_path = urlsplit(self.client.events_url).path
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    async def connect(self):
+        if self.scheme == 'http':
+            return await asyncio.open_connection(*self.address)
+        else:
+            return await asyncio.open_unix_connection(self.address)
+
+    async def get_connection(self):
+        if self.connections:
+            return self.connections.pop()
+        return await self.connect()
+
+    def put_connection(self, conn):
+        if len(self.connections) < self.pool_size and not self.done:
+            self.connections.append(conn)
+        else:
+            conn[1].close()
+
+    async def read_frame(self, reader):
+        """
+        Read a length-prefixed frame from the RPC listener. See
+        `voltron.core.read_frame`.
+        """
+        (length,) = struct.unpack('>I', await reader.readexactly(4))
+        if length > MAX_FRAME_SIZE:
+            raise InvalidMessageException("Frame of {} bytes is too large".format(length))
+        return (await reader.readexactly(length)).decode('UTF-8')
+
+    def write_frame(self, writer, data):
+        data = data.encode('UTF-8')
+        writer.write(struct.pack('>I', len(data)) + data)
+
+    async def read_headers(self, reader):
+        """
+        Read an HTTP response's status line and headers.
+        """
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            k, v = line.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+        return status, headers
+
+    async def http(self, method, path, data=None, accept=None):
+        """
+        Send an HTTP request and return the status code, headers and body of
+        the response.
+        """
+        data = data.encode('UTF-8') if data else b''
+        headers = ['{} {} HTTP/1.1'.format(method, path), 'Host: {}'.format(self.host),
+                   'Content-Length: {}'.format(len(data))]
+        if accept:
+            headers.append('Accept: {}'.format(accept))
+        reader, writer = conn = await self.get_connection()
+        try:
+            writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + data)
+            status, headers = await self.read_headers(reader)
+            if 'content-length' in headers:
+                body = await reader.readexactly(int(headers['content-length']))
+            else:
+                body = await reader.read()
+        except Exception:
+            writer.close()
+            raise
+        if headers.get('connection', '').lower() == 'close' or 'content-length' not in headers:
+            writer.close()
+        else:
+            self.put_connection(conn)
+        if headers.get('content-encoding') in ('gzip', 'deflate'):
+            body = zlib.decompress(body, zlib.MAX_WBITS | 32)
+        return status, headers, body
+
+    async def send(self, path, data):
+        """
+        Send some serialised requests, and return the response as a tuple of
+        (status code, content type, body).
+        """
+        try:
+            if self.scheme == 'rpc+unix':
+                reader, writer = conn = await self.get_connection()
+                try:
+                    self.write_frame(writer, data)
+                    res = await self.read_frame(reader)
+                except Exception:
+                    writer.close()
+                    raise
+                self.put_connection(conn)
+                return 200, 'application/json', res
+            accept = '{}, application/json'.format(binary_mimetype) if self.binary else None
+            status, headers, body = await self.http('POST', path, data, accept)
+            return status, headers.get('content-type'), body
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            raise ConnectionError(e)
+
+    async def send_request(self, request):
+        """
+        Send a request to the server.
+
+        Returns an APIResponse or subclass instance. See `Client.send_request`.
+        """
+        if request.priority is None:
+            request.priority = self.priority
+        self.client.add_validator(request)
+        log.debug("AsyncClient sending request: %s", request)
+        status, content_type, data = await self.send(self.path, str(request))
+        if status != 200:
+            return APIGenericErrorResponse(data.decode('UTF-8') if isinstance(data, bytes) else data)
+        if content_type == binary_mimetype:
+            return self.client.resolve_response(request, self.client.response_from_binary(request, data))
+        if not data:
+            return APIEmptyResponseErrorResponse()
+        try:
+            d = codec.loads(data, wide_ints=self.client.wide_ints([request]))
+        except ValueError:
+            log.error('Invalid message: ' + str(data))
+            return APIEmptyResponseErrorResponse()
+        return self.client.resolve_response(request, self.client.response_from_dict(request, d))
+
+    async def send_batch(self, requests):
+        """
+        Send a batch of requests to the server in a single round trip.
+
+        See `Client.send_batch`.
+        """
+        for r in requests:
+            if r.priority is None:
+                r.priority = self.priority
+            self.client.add_validator(r)
+        data = '[{}]'.format(', '.join(str(r) for r in requests))
+        status, content_type, data = await self.send(self.batch_path, data)
+        if status == 404:
+            raise BatchNotSupportedError("Server does not support batched requests")
+        elif status != 200:
+            return [APIGenericErrorResponse(data.decode('UTF-8')) for r in requests]
+        elif content_type == binary_mimetype:
+            try:
+                envelopes = unpack_binary_batch(data, self.client.wide_ints(requests))
+            except InvalidMessageException:
+                envelopes = []
+            if len(envelopes) != len(requests):
+                log.error('Invalid binary batch of {} bytes'.format(len(data)))
+                return [APIEmptyResponseErrorResponse() for r in requests]
+            return [self.client.resolve_response(req, self.client.response_from_envelope(req, d, attachments))
+                    for (req, (d, attachments)) in zip(requests, envelopes)]
+
+        try:
+            batch = codec.loads(data, wide_ints=self.client.wide_ints(requests))
+        except ValueError:
+            log.error('Invalid batch: ' + str(data))
+            return [APIEmptyResponseErrorResponse() for r in requests]
+        if isinstance(batch, dict):
+            # the whole batch failed
+            batch = [batch] * len(requests)
+        return [self.client.resolve_response(req, self.client.response_from_dict(req, d))
+                for (req, d) in zip(requests, batch)]
+
+    async def send_requests(self, *args):
+        """
+        Send a set of requests concurrently, and return their responses once
+        they have all been fulfilled.
+        """
+        return await asyncio.gather(*[self.send_request(req) for req in args])
+
+    async def events(self):
+        """
+        Subscribe to the server's events.
+
+        This is an asynchronous generator that yields an APIEvent each time the
+        server pushes one, starting with a 'hello' event carrying the current
+        stop generation. See `Client.events`.
+        """
+        try:
+            reader, writer = await self.connect()
+        except OSError as e:
+            raise ConnectionError(e)
+        try:
+            if self.scheme == 'rpc+unix':
+                self.write_frame(writer, 'events')
+                while not self.done:
+                    try:
+                        data = await self.read_frame(reader)
+                    except asyncio.IncompleteReadError:
+                        break
+                    yield self.event(data)
+            else:
+                # HTTP/1.0, so the stream isn't chunked
+                writer.write('GET {} HTTP/1.0\r\nHost: {}\r\n\r\n'.format(self.events_path, self.host)
+                             .encode('latin-1'))
+                status, headers = await self.read_headers(reader)
+                if status == 404:
+                    raise EventsNotSupportedError("Server does not support events")
+                elif status != 200:
+                    raise ConnectionError("Error subscribing to events: {}".format(status))
+                while not self.done:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    line = line.decode('UTF-8')
+                    if line.startswith('data:'):
+                        yield self.event(line[5:].strip())
+        finally:
+            writer.close()
+
+    def event(self, data):
+        event = APIEvent(data=data)
+        log.debug('AsyncClient received event: %s', event)
+        self.generation = event.generation
+        return event
+
+    async def stops(self):
+        """
+        Yield an APIEvent each time the debugger stops.
+
+        Like `Client.run`, this also yields the initial 'hello' event if the
+        debugger has stopped since the last event this client saw, so callers
+        can catch up after (re)connecting.
+        """
+        seen = self.generation
+        async for event in self.events():
+            if event.event == 'stopped' or (event.event == 'hello' and event.generation != seen):
+                yield event
+
+    def close(self):
+        """
+        Stop any event iterators and close the client's connections.
+        """
+        self.done = True
+        conns, self.connections = self.connections, []
+        for reader, writer in conns:
+            writer.close()
+        self.client.stop()
@@ -8,6 +8,9 @@ import logging.config
 import json
 import inspect
 import base64
+import copy
+import hashlib
+import struct
 import six
 
 from collections import defaultdict
@@ -21,6 +24,101 @@ log = logging.getLogger('api')
 
 version = 1.1
 
+# MIME type of the binary envelope that API messages with encoded fields can
+# be sent in instead of JSON. See APIMessage.to_binary()
+binary_mimetype = 'application/x-voltron-binary'
+
+
+class JSONCodec(object):
+    """
+    Encodes and decodes API messages as JSON using a particular library.
+
+    Some of the faster libraries can't handle integers wider than 64 bits
+    (e.g. SSE registers), and orjson even decodes them as floats without
+    complaining. Scanning every message for long numbers costs more than the
+    faster library saves, so callers say when a message may hold wide
+    integers (see `APIMessage._wide_ints`), and those are handled by the
+    standard library unless the library supports them (`big_ints`).
+    Anything else the fast library fails on is handed to the standard
+    library too.
+    """
+
+    def __init__(self, name, dumps, loads, big_ints=True):
+        self.name = name
+        self.fast_dumps = dumps
+        self.fast_loads = loads
+        self.big_ints = big_ints
+
+    def dumps(self, obj, wide_ints=False):
+        """
+        Return `obj` encoded as a JSON string.
+
+        `wide_ints` says that `obj` may contain integers wider than 64 bits.
+        """
+        if wide_ints and not self.big_ints:
+            return json.dumps(obj)
+        try:
+            return self.fast_dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            return json.dumps(obj)
+
+    def loads(self, data, wide_ints=False):
+        """
+        Decode a JSON string (or bytes). Raises ValueError if it's invalid.
+
+        `wide_ints` says that the data may contain integers wider than 64
+        bits.
+        """
+        if wide_ints and not self.big_ints:
+            return json.loads(data)
+        try:
+            return self.fast_loads(data)
+        except (TypeError, ValueError, OverflowError):
+            return json.loads(data)
+
+
+def json_codecs():
+    """
+    Return a list of JSONCodecs for the JSON libraries that are installed,
+    fastest first. The standard library is always last.
+    """
+    codecs = []
+    try:
+        import orjson
+        codecs.append(JSONCodec('orjson', lambda obj: orjson.dumps(obj).decode('UTF-8'), orjson.loads,
+                                big_ints=False))
+    except ImportError:
+        pass
+    try:
+        import rapidjson
+        codecs.append(JSONCodec('rapidjson', rapidjson.dumps, rapidjson.loads))
+    except ImportError:
+        pass
+    try:
+        import ujson
+        codecs.append(JSONCodec('ujson', ujson.dumps, ujson.loads, big_ints=False))
+    except ImportError:
+        pass
+    codecs.append(JSONCodec('json', json.dumps, json.loads))
+    return codecs
+
+
+# the codec used for all API messages
+codec = json_codecs()[0]
+
+
+def set_codec(name):
+    """
+    Use the named JSON library for API messages (e.g. 'json' to use the
+    standard library).
+    """
+    for c in json_codecs():
+        if c.name == name:
+            # update the codec in place, so modules that imported it use the new one
+            codec.__dict__.update(c.__dict__)
+            return
+    raise ValueError("JSON library not available: {}".format(name))
+
 
 class InvalidRequestTypeException(Exception):
     """
@@ -121,6 +219,22 @@ class BlockingNotSupportedError(Exception):
     pass
 
 
+class EventsNotSupportedError(Exception):
+    """
+    Raised when a client subscribes to the event stream of a server that
+    does not support it.
+    """
+    pass
+
+
+class BatchNotSupportedError(Exception):
+    """
+    Raised when a client sends a batch of requests to a server that does not
+    support batched requests.
+    """
+    pass
+
+
 def server_side(func):
     """
     Decorator to designate an API method applicable only to server-side
@@ -156,6 +270,8 @@ def cast_b(val):
         return val
     elif isinstance(val, six.text_type):
         return val.encode('latin1')
+    elif isinstance(val, memoryview):
+        return val.tobytes()
     return six.binary_type(val)
 
 
@@ -167,24 +283,150 @@ def cast_s(val):
     return six.text_type(val)
 
 
+# sentinel for fields that haven't been set
+_missing = object()
+
+
+class MessageLayout(object):
+    """
+    The fields of an APIMessage class, worked out once when the class is
+    created rather than every time a message is built, serialised or
+    validated.
+    """
+    def __init__(self, cls):
+        self.top_fields = tuple(cls._top_fields)
+        self.optional_top_fields = tuple(cls._optional_top_fields)
+        self.fields = tuple(cls._fields)
+        self.encode_fields = frozenset(cls._encode_fields)
+        self.required_fields = self.top_fields + tuple(f for f in self.fields if cls._fields[f])
+        self.set_defaults = defaults_setter(cls._defaults)
+
+
+def defaults_setter(defaults):
+    """
+    Return a function that sets each of the fields in `defaults` to its
+    default value on a message.
+
+    The function is generated so it can set the slots directly, which is
+    several times faster than calling setattr for each of them in a loop.
+    """
+    fields = sorted(defaults)
+    src = 'def set_defaults(self):\n    pass\n'
+    src += ''.join('    self.{} = _{}\n'.format(field, i) for (i, field) in enumerate(fields))
+    ns = dict(('_{}'.format(i), defaults[field]) for (i, field) in enumerate(fields))
+    six.exec_(src, ns)
+    return ns['set_defaults']
+
+
+class APIMessageType(type):
+    """
+    Metaclass for API messages.
+
+    Compiles each message class's MessageLayout when the class is created,
+    and stores messages' fields in slots so that instances don't need a
+    dictionary.
+
+    Every top level field, data field and name in `_state` gets a slot in
+    the first class that declares it. A slot can't share its name with a
+    class attribute, so the default values that classes give them are
+    moved into the class's `_defaults` table instead. Instances start out
+    with those values, and getting or setting the default on the class
+    itself (e.g. `APITimedOutErrorResponse.code`) goes through a property
+    on the metaclass. Setting it only affects messages of that class that
+    are created afterwards.
+    """
+    def __new__(mcs, name, bases, ns):
+        names = set()
+        defaults = {}
+        for base in reversed(bases):
+            names.update(getattr(base, '_names', ()))
+            defaults.update(getattr(base, '_defaults', {}))
+
+        slots = list(ns.get('__slots__', ()))
+        for attr in ('_top_fields', '_optional_top_fields', '_fields', '_state'):
+            for field in ns.get(attr, ()):
+                # properties (e.g. APIResponse.etag) look after their own storage
+                if field in names or isinstance(ns.get(field), property) or \
+                        any(isinstance(getattr(b, field, None), property) for b in bases):
+                    continue
+                names.add(field)
+                slots.append(field)
+                defaults[field] = None
+                if field not in APIMessageType.__dict__ and not hasattr(type, field):
+                    setattr(APIMessageType, field, class_default(field))
+
+        for field in names:
+            if field in ns:
+                defaults[field] = ns.pop(field)
+
+        ns['__slots__'] = tuple(slots)
+        ns['_names'] = frozenset(names)
+        ns['_defaults'] = defaults
+        cls = super(APIMessageType, mcs).__new__(mcs, name, bases, ns)
+        cls._layout = MessageLayout(cls)
+        return cls
+
+
+def class_default(name):
+    """
+    Return a property for APIMessageType that gets and sets the default
+    value of the field `name` on a message class.
+
+    Classes that don't have a field called `name` get their own attribute.
+    """
+    def fget(cls):
+        if name in cls._names:
+            return cls._defaults.get(name)
+        for c in cls.__mro__:
+            if name in c.__dict__:
+                val = c.__dict__[name]
+                return val.__get__(None, cls) if hasattr(val, '__get__') else val
+        raise AttributeError(name)
+
+    def fset(cls, value):
+        if name not in cls._names:
+            raise AttributeError("{} has no field '{}'".format(cls.__name__, name))
+        # copy the table so the base classes' defaults aren't changed
+        cls._defaults = dict(cls._defaults)
+        cls._defaults[name] = value
+        cls._layout = MessageLayout(cls)
+
+    return property(fget, fset)
+
+
+@six.add_metaclass(APIMessageType)
 class APIMessage(object):
     """
     Top-level API message class.
     """
+    __slots__ = ('__weakref__',)
+
     _top_fields = ['type']
+    _optional_top_fields = []
     _fields = {}
     _encode_fields = []
+    # anything else that's kept on instances of the class, rather than sent
+    _state = ['_extra']
+    # whether the message's fields may hold integers wider than 64 bits, see JSONCodec
+    _wide_ints = False
 
     type = None
 
+    # keys given to from_dict or the constructor that aren't fields
+    _extra = None
+
     def __init__(self, data=None, *args, **kwargs):
+        # start from the defaults, so reading a field doesn't have to fall
+        # back on __getattr__
+        self._layout.set_defaults(self)
+
         # process any data that was passed in
         if data:
             self.from_json(data)
 
         # any other kwargs are treated as field values
         for field in kwargs:
-            setattr(self, field, kwargs[field])
+            self.set_field(field, kwargs[field])
 
     def __str__(self):
         """
@@ -192,53 +434,143 @@ class APIMessage(object):
         """
         return self.to_json()
 
-    def to_dict(self):
+    def to_dict(self, attachments=None):
         """
         Return a transmission-safe dictionary representation of the API message properties.
+
+        If `attachments` is a list, the values of any encoded fields are
+        appended to it as (field, bytes) tuples rather than being base64
+        encoded into the dictionary.
         """
-        d = {field: getattr(self, field) for field in self._top_fields if hasattr(self, field)}
-
-        # set values of data fields
-        d['data'] = {}
-        for field in self._fields:
-            if hasattr(self, field):
-                # base64 encode the field for transmission if necessary
-                if field in self._encode_fields:
-                    val = getattr(self, field)
-                    if val:
-                        val = cast_s(base64.b64encode(cast_b(val)))
-                    d['data'][field] = val
-                else:
-                    d['data'][field] = getattr(self, field)
+        layout = self._layout
+        d = {}
+        for field in layout.top_fields:
+            val = getattr(self, field, _missing)
+            if val is not _missing:
+                d[field] = val
+
+        # optional top level fields are only included if they're set
+        for field in layout.optional_top_fields:
+            val = getattr(self, field)
+            if val is not None:
+                d[field] = val
+
+        d['data'] = self.data_dict(attachments)
 
         return d
 
+    def data_dict(self, attachments=None):
+        """
+        Return a transmission-safe dictionary of the API message's data
+        fields. `attachments` is as for `to_dict`.
+        """
+        layout = self._layout
+        # fields that haven't been set are None
+        data = {}
+        encode_fields = layout.encode_fields
+        for field in layout.fields:
+            val = getattr(self, field)
+            if field in encode_fields and val:
+                # send the field as an attachment, or base64 encode it for transmission
+                if attachments is not None:
+                    attachments.append((field, cast_b(val)))
+                    continue
+                val = cast_s(base64.b64encode(cast_b(val)))
+            data[field] = val
+
+        return data
+
     def from_dict(self, d):
         """
         Initialise an API message from a transmission-safe dictionary.
         """
+        encode_fields = self._layout.encode_fields
         for key in d:
-            if key == 'data':
-                for dkey in d['data']:
-                    if dkey in self._encode_fields:
-                        setattr(self, str(dkey), base64.b64decode(d['data'][dkey]))
+            if key == 'attachments':
+                continue
+            elif key == 'data':
+                data = d['data']
+                for dkey in data:
+                    if dkey in encode_fields:
+                        self.set_field(str(dkey), base64.b64decode(data[dkey]))
                     else:
-                        setattr(self, str(dkey), d['data'][dkey])
+                        self.set_field(str(dkey), data[dkey])
             else:
-                setattr(self, str(key), d[key])
+                self.set_field(str(key), d[key])
+
+    def set_field(self, field, val):
+        """
+        Set the field `field`.
+
+        Messages don't have a dictionary, so if the class doesn't declare
+        `field` (e.g. a generic APIResponse holding a plugin's response) the
+        value is kept in `_extra` instead. It can still be read as an
+        attribute, but it isn't sent.
+        """
+        try:
+            setattr(self, field, val)
+        except AttributeError:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[field] = val
+
+    def copy(self):
+        """
+        Return a copy of the message that can be modified without affecting
+        this one.
+
+        Lists and dictionaries in the fields are copied too. Byte strings and
+        memoryviews aren't, as they can't be modified.
+        """
+        msg = self.__class__()
+        layout = self._layout
+        for field in layout.top_fields + layout.optional_top_fields + layout.fields:
+            val = getattr(self, field, _missing)
+            if val is not _missing:
+                setattr(msg, field, copy.deepcopy(val) if isinstance(val, (list, dict)) else val)
+        return msg
+
+    def to_binary(self):
+        """
+        Return a binary envelope representation of the API message, as a
+        list of byte strings to be sent one after the other.
+
+        The envelope is a 4 byte big-endian header length, followed by a JSON
+        header and then the raw values of the encoded fields. The header is
+        the same as the JSON representation, except that the encoded fields
+        are left out of the data and listed in `attachments` along with their
+        lengths, in the order they follow the header.
+        """
+        attachments = []
+        d = self.to_dict(attachments=attachments)
+        d['attachments'] = [[field, len(val)] for (field, val) in attachments]
+        header = codec.dumps(d, wide_ints=self._wide_ints).encode('UTF-8')
+        return [struct.pack('>I', len(header)), header] + [val for (field, val) in attachments]
+
+    def from_binary(self, data):
+        """
+        Initialise an API message from a binary envelope.
+
+        The encoded fields are set to memoryviews of `data`, so they aren't
+        copied.
+        """
+        d, attachments = unpack_binary(data, wide_ints=self._wide_ints)
+        self.from_dict(d)
+        for field in attachments:
+            setattr(self, field, attachments[field])
 
     def to_json(self):
         """
         Return a JSON representation of the API message properties.
         """
-        return json.dumps(self.to_dict())
+        return codec.dumps(self.to_dict(), wide_ints=self._wide_ints)
 
     def from_json(self, data):
         """
         Initialise an API message from a JSON representation.
         """
         try:
-            d = json.loads(data)
+            d = codec.loads(data, wide_ints=self._wide_ints)
         except ValueError:
             raise InvalidMessageException()
         self.from_dict(d)
@@ -247,11 +579,14 @@ class APIMessage(object):
         """
         Attribute accessor.
 
-        If a defined field is requested that doesn't have a value set,
-        return None.
+        If a field is requested that doesn't have a value set, return the
+        class's default value for it, or None if there isn't one.
         """
-        if name in self._fields:
-            return None
+        defaults = self._defaults
+        if name in defaults:
+            return defaults[name]
+        extra = self._extra
+        return extra.get(name) if extra else None
 
     def validate(self):
         """
@@ -259,12 +594,54 @@ class APIMessage(object):
 
         Ensure all the required fields are present and not None.
         """
-        required_fields = list(filter(lambda x: self._fields[x], self._fields.keys()))
-        for field in (self._top_fields + required_fields):
-            if not hasattr(self, field) or hasattr(self, field) and getattr(self, field) == None:
+        for field in self._layout.required_fields:
+            if getattr(self, field, None) is None:
                 raise MissingFieldError(field)
 
 
+def unpack_binary(data, wide_ints=False):
+    """
+    Unpack a binary envelope created by APIMessage.to_binary().
+
+    Returns a tuple of the header dictionary and a dictionary mapping the
+    names of the attached fields to memoryviews of their values in `data`.
+
+    `wide_ints` says that the header may hold integers wider than 64 bits.
+    """
+    envelopes = unpack_binary_batch(data, wide_ints)
+    if len(envelopes) != 1:
+        raise InvalidMessageException()
+    return envelopes[0]
+
+
+def unpack_binary_batch(data, wide_ints=False):
+    """
+    Unpack a series of binary envelopes, one after the other, like the
+    response to a batch of requests.
+
+    Returns a list of tuples like those returned by `unpack_binary`.
+    """
+    buf = memoryview(data)
+    offset = 0
+    envelopes = []
+    try:
+        while offset < len(buf):
+            (length,) = struct.unpack('>I', buf[offset:offset + 4].tobytes())
+            offset += 4
+            d = codec.loads(buf[offset:offset + length].tobytes(), wide_ints)
+            offset += length
+            attachments = {}
+            for (field, size) in d.get('attachments', []):
+                attachments[str(field)] = buf[offset:offset + size]
+                offset += size
+            envelopes.append((d, attachments))
+    except Exception:
+        raise InvalidMessageException()
+    if offset != len(buf):
+        raise InvalidMessageException()
+    return envelopes
+
+
 class APIRequest(APIMessage):
     """
     An API request object. Contains functions and accessors common to all API
@@ -276,17 +653,40 @@ class APIRequest(APIMessage):
     the requesting (probably a view class).
     """
     _top_fields = ['type', 'request', 'block', 'timeout']
+    _optional_top_fields = ['priority', 'if_none_match']
     _fields = {}
+    # kept by the server while the request is queued and dispatched
+    _state = ['response', 'wait_event', 'timed_out', 'queued_at', 'deadline', 'source', 'unit']
 
     type = 'request'
     request = None
     block = False
     timeout = 10
 
+    # Queued requests with a higher priority are dispatched first. Plugins
+    # can set a default in their request class, and clients can override it
+    # per request.
+    priority = None
+
+    # The validator (`etag`) of a response the client already has. If the
+    # response to this request is the same, the server sends an
+    # APINotModifiedResponse instead.
+    if_none_match = None
+
     response = None
     wait_event = None
     timed_out = False
 
+    # Read-only requests don't change the state of the debugger or the
+    # inferior, so their responses can be cached until the debugger stops
+    # again. Plugins opt in by setting this in their request class.
+    read_only = False
+
+    # Requests that can change the state of the debugger or the inferior
+    # (e.g. running arbitrary commands or writing memory) throw away any
+    # cached responses when they're dispatched.
+    invalidates_cache = False
+
     @server_side
     def dispatch(self):
         """
@@ -297,21 +697,65 @@ class APIRequest(APIMessage):
         raise NotImplementedError("Subclass APIRequest")
 
     @server_side
-    def wait(self):
+    def wait(self, timeout=None):
         """
         Wait for the request to be dispatched.
+
+        `timeout` overrides the request's own timeout if specified.
         """
-        self.wait_event = threading.Event()
-        timeout = int(self.timeout) if self.timeout else None
+        if not self.wait_event:
+            self.wait_event = threading.Event()
+        if timeout is None:
+            timeout = int(self.timeout) if self.timeout else None
         self.timed_out = not self.wait_event.wait(timeout)
 
+    def key(self):
+        """
+        Return a canonical key identifying this request.
+
+        Requests with the same type and field values have the same key.
+        """
+        return json.dumps([self.request, {f: getattr(self, f) for f in self._fields}], sort_keys=True)
+
     def signal(self):
         """
         Signal that the request has been dispatched and can return.
         """
+        if not self.wait_event:
+            self.wait_event = threading.Event()
         self.wait_event.set()
 
 
+class APIEvent(APIMessage):
+    """
+    An event pushed by the server to clients subscribed to its event stream
+    at /api/events.
+
+    {
+        "type":         "event",
+        "event":        "stopped",
+        "generation":   12,
+        "data": {
+            "state":    "stopped"
+        }
+    }
+
+    `event` is one of 'hello' (sent when the client subscribes), 'stopped',
+    'continued' or 'exited'.
+
+    `generation` is the server's stop generation after the event.
+
+    `state` is the target's state after the event.
+    """
+    _top_fields = ['type', 'event', 'generation']
+    _fields = {'state': False}
+
+    type = 'event'
+    event = None
+    generation = None
+    state = None
+
+
 class APIBlockingRequest(APIRequest):
     """
     An API request that blocks by default.
@@ -330,11 +774,36 @@ class APIResponse(APIMessage):
     instantiated by the Client class and returned by `send_request`.
     """
     _top_fields = ['type', 'status']
+    _optional_top_fields = ['etag']
     _fields = {}
+    _state = ['etag_generation', '_etag']
 
     type = 'response'
     status = None
 
+    # The stop generation a successful response was produced at. Set by the
+    # server so it can work out the response's `etag` when it's needed.
+    etag_generation = None
+    _etag = None
+
+    @property
+    def etag(self):
+        """
+        A validator for the response's content, of the form
+        '<stop generation>-<content hash>'.
+
+        Hashing the content isn't free, so the server doesn't do it until the
+        etag is first needed, i.e. when the response is serialised or
+        compared with a client's validator, and then keeps the result.
+        """
+        if self._etag is None and self.etag_generation is not None and self.is_success:
+            self._etag = '{}-{}'.format(self.etag_generation, self.content_hash())
+        return self._etag
+
+    @etag.setter
+    def etag(self, value):
+        self._etag = value
+
     @property
     def is_success(self):
         return self.status == 'success'
@@ -343,6 +812,33 @@ class APIResponse(APIMessage):
     def is_error(self):
         return self.status == 'error'
 
+    @property
+    def is_not_modified(self):
+        return self.status == 'not_modified'
+
+    def content_hash(self):
+        """
+        Return a hash of the response's data fields.
+        """
+        h = hashlib.sha1()
+        attachments = []
+        data = self.data_dict(attachments=attachments)
+        h.update(json.dumps(data, sort_keys=True).encode('UTF-8'))
+        for (field, val) in attachments:
+            h.update(field.encode('UTF-8'))
+            h.update(val)
+        return h.hexdigest()
+
+    def matches(self, validator):
+        """
+        Return True if the content of this response is the same as that of
+        the response with validator `validator`.
+
+        Only the content hashes are compared, so a response that's the same
+        as it was at a previous stop still matches.
+        """
+        return bool(self.etag and validator) and self.etag.split('-')[-1] == validator.split('-')[-1]
+
     def __repr__(self):
         return "<%s: success = %s, error = %s, body: %s>" % (
                 str(self.__class__),
@@ -359,6 +855,14 @@ class APISuccessResponse(APIResponse):
     status = 'success'
 
 
+class APINotModifiedResponse(APIResponse):
+    """
+    Sent instead of a response that the client already has, according to the
+    request's `if_none_match` validator.
+    """
+    status = 'not_modified'
+
+
 class APIErrorResponse(APIResponse):
     """
     A generic API error response.
@@ -1,3 +1,6 @@
+import contextlib
+import ctypes
+import ctypes.util
 import errno
 import json
 import logging
@@ -5,19 +8,28 @@ import logging.config
 import os
 import os.path
 import pkgutil
+import random
 import select
+import selectors
 import signal
 import socket
+import struct
 import sys
 import threading
 import time
+import zlib
 import six
 import voltron
+from collections import defaultdict, OrderedDict
 from flask import Flask, Response, make_response, redirect, render_template, request
 from werkzeug.serving import BaseWSGIServer, ThreadedWSGIServer, WSGIRequestHandler
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.middleware.shared_data import SharedDataMiddleware
+from werkzeug.exceptions import InternalServerError
+from werkzeug.wsgi import LimitedStream
 from requests import ConnectionError
+from requests.exceptions import ChunkedEncodingError
+from six.moves.queue import Queue, Empty
 
 
 # import pysigset
@@ -35,12 +47,14 @@ if six.PY2:
         from SocketServer import ThreadingMixIn
     else:
         from SocketServer import UnixStreamServer, ThreadingMixIn
+    from SocketServer import StreamRequestHandler
     from BaseHTTPServer import HTTPServer
 else:
     if sys.platform == 'win32':
         from six.moves.socketserver import ThreadingMixIn
     else:
         from six.moves.socketserver import UnixStreamServer, ThreadingMixIn
+    from six.moves.socketserver import StreamRequestHandler
     from six.moves.BaseHTTPServer import HTTPServer
 
 ThreadingMixIn.daemon_threads = True
@@ -76,28 +90,116 @@ else:
                        sys.version_info.major)
 
 
+def connection_id():
+    """
+    Return an identifier for the connection the current Flask request was
+    received on.
+    """
+    sock = request.environ.get('werkzeug.socket')
+    return id(sock) if sock else None
+
+
 class APIFlaskApp(Flask):
     """
     A Flask app for the API.
     """
+    # responses at least this big are compressed for remote clients that accept it
+    compress_threshold = 1024
+    compress_level = 6
+
+    # whether to compress responses to local clients too, which just burns CPU on the debugger's side
+    compress_local = False
+
     def __init__(self, *args, **kwargs):
         if 'server' in kwargs:
             self.server = kwargs['server']
             del kwargs['server']
         super(APIFlaskApp, self).__init__('voltron_api', *args, **kwargs)
 
-        def api_post():
-            res = self.server.handle_request(request.data.decode('UTF-8'))
+        config = voltron.config.server.compression
+        if config:
+            if config.threshold != None:
+                self.compress_threshold = int(config.threshold)
+            if config.level != None:
+                self.compress_level = int(config.level)
+            if config.local != None:
+                self.compress_local = bool(config.local)
+
+        def make_api_response(res):
+            # send responses with encoded fields (e.g. memory) as raw bytes rather than base64 if the client can
+            # handle it
+            if res._encode_fields and binary_mimetype in request.accept_mimetypes.values():
+                return Response(res.to_binary(), status=200, mimetype=binary_mimetype)
             return Response(str(res), status=200, mimetype='application/json')
 
+        def api_post():
+            res = self.server.handle_request(request.data.decode('UTF-8'), source=connection_id())
+            return make_api_response(res)
+
         def api_get():
-            res = self.server.handle_request(str(api_request(request.path.split('/')[-1], **request.args.to_dict())))
-            return Response(str(res), status=200, mimetype='application/json')
+            # the query args are the request's fields, so there's no need to encode them as JSON and parse it again
+            d = {'request': request.path.split('/')[-1], 'data': request.args.to_dict()}
+            res = self.server.handle_request_dict(d, source=connection_id())
+            return make_api_response(res)
+
+        def api_batch():
+            res = self.server.handle_batch(request.data.decode('UTF-8'), source=connection_id())
+            if isinstance(res, list):
+                # as for single requests, but the envelopes for each response follow one another
+                if any(r._encode_fields for r in res) and binary_mimetype in request.accept_mimetypes.values():
+                    return Response([part for r in res for part in r.to_binary()], status=200,
+                                    mimetype=binary_mimetype)
+                data = '[{}]'.format(', '.join(str(r) for r in res))
+            else:
+                data = str(res)
+            return Response(data, status=200, mimetype='application/json')
+
+        def api_events():
+            def encode(event):
+                # keepalives are comments, which clients ignore, so we find out if they've gone away
+                return (': keepalive\n\n' if event is None else 'data: {}\n\n'.format(str(event))).encode('UTF-8')
+
+            # the stream lasts as long as the client is connected, so rather than tying up one of the listener's
+            # workers, the connection is handed over to the server's event streams once the headers are sent
+            request.environ['voltron.stream_events'](self.server.streams, encode)
+            return Response(iter(()), status=200, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+        def is_local():
+            sock = request.environ.get('werkzeug.socket')
+            if sock and sock.family == getattr(socket, 'AF_UNIX', None):
+                return True
+            addr = request.remote_addr or ''
+            return addr.startswith('127.') or addr.startswith('::ffff:127.') or addr == '::1'
+
+        def compress_response(response):
+            # compress big responses for clients that accept it, unless they're local
+            if (response.status_code != 200 or response.is_streamed or 'Content-Encoding' in response.headers or
+                    self.compress_level <= 0 or (not self.compress_local and is_local())):
+                return response
+            encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+            data = response.get_data()
+            if encoding and len(data) >= self.compress_threshold:
+                # gzip and deflate are both zlib streams with different wrappers
+                c = zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                                     zlib.MAX_WBITS | 16 if encoding == 'gzip' else zlib.MAX_WBITS)
+                response.set_data(c.compress(data) + c.flush())
+                response.headers['Content-Encoding'] = encoding
+                response.headers['Vary'] = 'Accept-Encoding'
+            return response
+
+        self.after_request(compress_response)
 
         # Handle API POST requests at /api/request
         api_post.methods = ["POST"]
         self.add_url_rule('/request', 'request', api_post)
 
+        # Handle batches of API requests at /api/batch
+        api_batch.methods = ["POST"]
+        self.add_url_rule('/batch', 'batch', api_batch)
+
+        # Stream events (e.g. the debugger stopping) to subscribed clients at /api/events
+        self.add_url_rule('/events', 'events', api_events)
+
         # Handle API GET requests at /api/<request_name> e.g. /api/version
         for plugin in voltron.plugin.pm.api_plugins:
             self.add_url_rule('/{}'.format(plugin), plugin, api_get)
@@ -125,17 +227,38 @@ class Server(object):
     controlling the background thread that communicates with clients, and
     handling requests forwarded from that thread.
     """
+    keepalive_interval = 10
+    dispatch_workers = 4
+
+    event_states = {
+        'stopped':      'stopped',
+        'continued':    'running',
+        'exited':       'invalid'
+    }
+
     def __init__(self):
         self.threads = []
         self.listeners = []
         self.is_running = False
-        self.queue = []
-        self.queue_lock = threading.Lock()
+        self.queue = RequestQueue()
+        self.queue_lock = self.queue.lock
+        self.pending = []
+        self.generation = 0
+        self.generation_lock = threading.Lock()
+        self.cache = ResponseCache()
+        self.subscribers = []
+        self.subscribers_lock = threading.Lock()
+        self.streams = EventStreams(self)
+        self.dispatch_pool = None
 
     def start(self):
         """
         Start the server.
         """
+        workers = voltron.config.server.dispatch_workers
+        self.dispatch_pool = WorkerPool(max_workers=int(workers) if workers else self.dispatch_workers,
+                                        name='dispatch')
+
         plugins = voltron.plugin.pm.web_plugins
         self.app = DispatcherMiddleware(
             RootFlaskApp(),
@@ -153,6 +276,7 @@ class Server(object):
             # with pysigset.suspended_signals(signal.SIGCHLD):
             log.debug("Starting listener for {} socket on {}".format(name, str(arg)))
             s = cls(*arg)
+            s.listener_name = name
             t = threading.Thread(target=s.serve_forever)
             t.daemon = True
             t.start()
@@ -170,6 +294,14 @@ class Server(object):
                 pass
             run_listener('domain', ThreadedUnixWSGIServer, [path, self.app])
 
+        if voltron.config.server.listen.rpc and sys.platform != 'win32':
+            path = os.path.expanduser(str(voltron.config.server.listen.rpc))
+            try:
+                os.unlink(path)
+            except:
+                pass
+            run_listener('rpc', ThreadedUnixRPCServer, [path, self])
+
         self.is_running = True
 
     def stop(self):
@@ -183,6 +315,9 @@ class Server(object):
             s.shutdown()
             s.socket.close()
         self.cancel_queue()
+        self.cancel_subscribers()
+        if self.dispatch_pool:
+            self.dispatch_pool.shutdown()
         for t in self.threads:
             t.join()
         self.listeners = []
@@ -191,97 +326,288 @@ class Server(object):
         self.queue_lock.release()
         log.debug("Listeners stopped and threads joined")
 
-    def handle_request(self, data):
+    def handle_request(self, data, source=None):
+        """
+        Handle an API request.
+
+        `data` is the JSON request. `source` identifies the connection it was
+        received on, so the queue can share the debugger fairly between
+        clients.
+        """
+        if not self.is_running:
+            return APIServerNotRunningErrorResponse()
+
+        try:
+            d = codec.loads(data)
+        except Exception as e:
+            d = None
+            log.exception("Exception raised while parsing API request: {} {}".format(type(e), e))
+        return self.handle_request_dict(d, source)
+
+    def handle_request_dict(self, d, source=None):
+        """
+        Handle an API request that has already been decoded.
+
+        `d` is the request dictionary. See `handle_request`.
+        """
         req = None
         res = None
 
         if self.is_running:
-            # make sure we have a debugger, or we're gonna have a bad time
-            if voltron.debugger:
-                # parse incoming request with the top level APIRequest class so we can determine the request type
-                try:
-                    req = APIRequest(data=data)
-                except Exception as e:
-                    req = None
-                    log.exception("Exception raised while parsing API request: {} {}".format(type(e), e))
-
-                if req:
-                    # instantiate the request class
-                    try:
-                        log.debug("data = {}".format(data))
-                        req = api_request(req.request, data=data)
-                    except Exception as e:
-                        log.exception("Exception raised while creating API request: {} {}".format(type(e), e))
-                        req = None
-                    if not req:
-                        res = APIPluginNotFoundErrorResponse()
-                else:
-                    res = APIInvalidRequestErrorResponse()
-            else:
-                res = APIDebuggerNotPresentErrorResponse()
+            req, res = self.parse_request(d)
 
             if not res:
                 # no errors so far, queue the request and wait
                 if req and req.block:
-                    self.queue_lock.acquire()
-                    self.queue.append(req)
-                    self.queue_lock.release()
+                    self.queue_requests([req], source)
 
                     # When this returns the request will have been processed by the dispatch_queue method on the main
                     # thread (or timed out). We have to do it this way because GDB sucks.
-                    req.wait()
-
-                    if req.timed_out:
-                        res = APITimedOutErrorResponse()
-                    else:
-                        res = req.response
-
-                    # Remove the request from the queue
-                    self.queue_lock.acquire()
-                    if req in self.queue:
-                        self.queue.remove(req)
-                    self.queue_lock.release()
+                    with detached_worker():
+                        res = self.wait_for_requests([req])[0]
                 else:
                     # non-blocking, dispatch request straight away
-                    res = self.dispatch_request(req)
+                    res = self.conditional_response(req, self.dispatch_request(req))
         else:
             res = APIServerNotRunningErrorResponse()
 
         return res
 
+    def handle_batch(self, data, source=None):
+        """
+        Handle a batch of requests.
+
+        `data` is a JSON array of API requests. If any of the requests in the
+        batch are blocking, the whole batch is queued as one unit and
+        dispatched back to back in a single pass of `dispatch_queue`.
+        Otherwise the requests are dispatched straight away, in order.
+
+        Returns a list of responses in the same order as the requests, or a
+        single error response if the batch itself was invalid.
+        """
+        if not self.is_running:
+            return APIServerNotRunningErrorResponse()
+
+        try:
+            batch = codec.loads(data)
+        except Exception as e:
+            log.exception("Exception raised while parsing API batch: {} {}".format(type(e), e))
+            batch = None
+        if not isinstance(batch, list):
+            return APIInvalidRequestErrorResponse()
+
+        # parse the requests, keeping any errors in place
+        reqs = []
+        results = []
+        for d in batch:
+            req, res = self.parse_request(d)
+            reqs.append(req)
+            results.append(res)
+        pending = [req for (req, res) in zip(reqs, results) if not res]
+
+        if any(req.block for req in pending):
+            self.queue_requests(pending, source)
+            with detached_worker():
+                responses = self.wait_for_requests(pending)
+        else:
+            responses = self.dispatch_concurrently(pending)
+
+        # slot the responses in around any parse errors
+        responses = iter(responses)
+        return [res if res else next(responses) for res in results]
+
+    def dispatch_concurrently(self, reqs):
+        """
+        Dispatch a list of non-blocking requests straight away, and return
+        their responses in the same order.
+
+        If the debugger can be queried from background threads (it has the
+        'async' capability) and none of the requests change its state, they
+        are dispatched at the same time on the dispatch pool, so the
+        adaptor can serve them in parallel. Otherwise they're dispatched one
+        after another on this thread.
+        """
+        def dispatch(req):
+            return self.conditional_response(req, self.dispatch_request(req))
+
+        if (len(reqs) < 2 or not self.dispatch_pool or not all(req.read_only for req in reqs) or
+                'async' not in voltron.debugger.capabilities()):
+            return [dispatch(req) for req in reqs]
+
+        responses = [None] * len(reqs)
+        done = threading.Semaphore(0)
+
+        def work(i, req):
+            try:
+                responses[i] = dispatch(req)
+            except Exception as e:
+                msg = "Exception raised while dispatching request: {}".format(repr(e))
+                log.exception(msg)
+                responses[i] = APIGenericErrorResponse(msg)
+            finally:
+                done.release()
+
+        # dispatch the first one ourselves while the workers dispatch the rest
+        for i, req in enumerate(reqs[1:], 1):
+            self.dispatch_pool.submit(work, i, req)
+        work(0, reqs[0])
+        for req in reqs:
+            done.acquire()
+
+        return responses
+
+    def parse_request(self, d):
+        """
+        Instantiate the request class for a request parsed from JSON.
+
+        `d` is the request dictionary.
+
+        Returns a tuple of (request, error response), one of which will be
+        None.
+        """
+        req = None
+        res = None
+
+        # make sure we have a debugger, or we're gonna have a bad time
+        if voltron.debugger:
+            if isinstance(d, dict):
+                # look up the request class by type and populate it straight from the dictionary
+                log.debug("data = %s", d)
+                cls = pm.request_classes.get(d.get('request'))
+                if cls:
+                    try:
+                        req = cls()
+                        req.from_dict(d)
+                    except Exception as e:
+                        log.exception("Exception raised while creating API request: {} {}".format(type(e), e))
+                        req = None
+                if not req:
+                    res = APIPluginNotFoundErrorResponse()
+            else:
+                res = APIInvalidRequestErrorResponse()
+        else:
+            res = APIDebuggerNotPresentErrorResponse()
+
+        return req, res
+
+    def queue_requests(self, reqs, source=None):
+        """
+        Queue a set of requests to be dispatched by `dispatch_queue`.
+
+        The requests are added to the queue atomically so they will all be
+        dispatched in the same pass. `source` identifies the connection the
+        requests came from.
+        """
+        for req in reqs:
+            req.wait_event = threading.Event()
+        self.queue.put(reqs, source)
+
+    def wait_for_requests(self, reqs):
+        """
+        Wait for a set of queued requests to be dispatched.
+
+        The requests share the deadline they were given when they were
+        queued, based on the longest timeout of any of them.
+
+        Returns a list of responses.
+        """
+        responses = []
+        for req in reqs:
+            req.wait(max(req.deadline - time.time(), 0) if req.deadline else None)
+
+            if req.timed_out:
+                responses.append(APITimedOutErrorResponse())
+            else:
+                responses.append(req.response)
+
+        # Remove any requests that timed out from the queue
+        for req in reqs:
+            if req.timed_out:
+                self.queue.expire(req)
+
+        return responses
+
     def cancel_queue(self):
         """
         Cancel all requests in the queue so we can exit.
         """
-        q = list(self.queue)
-        self.queue = []
-        log.debug("Canceling requests: {}".format(q))
+        with self.queue_lock:
+            units = self.pending + self.queue.drain()
+            self.pending = []
+        q = [req for unit in units for reqs in unit for req in reqs]
+        log.debug("Canceling requests: %s", q)
         for req in q:
             req.response = APIServerNotRunningErrorResponse()
         for req in q:
             req.signal()
 
-    def dispatch_queue(self):
+    def dispatch_queue(self, budget=None):
         """
         Dispatch any queued requests.
 
-        Called by the debugger when it stops.
+        Requests are dispatched in the order decided by the queue's
+        scheduler. Identical requests that were coalesced in the queue are
+        dispatched once and the response is handed to each of them. Requests
+        whose deadline has passed by the time they come up are dropped
+        without being dispatched.
+
+        If `budget` is specified, requests are only dispatched until that
+        many seconds have passed, and the rest are left pending for
+        `dispatch_pending` to carry on with. Requests that were queued
+        together (e.g. a batch) are always dispatched in the same slice.
+        Requests queued after this call wait for the next one, as they're
+        waiting for the next stop.
+
+        Called by the debugger when it stops. Returns True if there are
+        requests left pending.
         """
-        self.queue_lock.acquire()
-        q = list(self.queue)
-        self.queue = []
-        self.queue_lock.release()
-        log.debug("Dispatching requests: {}".format(q))
-        for req in q:
-            req.response = self.dispatch_request(req)
-        for req in q:
-            req.signal()
+        with self.queue_lock:
+            self.pending.extend(self.queue.drain())
+        return self.dispatch_pending(budget)
+
+    def dispatch_pending(self, budget=None):
+        """
+        Dispatch requests left pending by a previous call to `dispatch_queue`
+        that ran out of time.
+
+        Debuggers that can schedule work on their main thread call this
+        repeatedly, so that the user gets their prompt back between slices.
+        At least one unit of requests that were queued together is
+        dispatched each call, however long it takes.
+
+        Returns True if there are still requests pending.
+        """
+        start = time.time()
+        while True:
+            with self.queue_lock:
+                if not self.pending:
+                    return False
+                unit = self.pending.pop(0)
+
+            log.debug("Dispatching requests: %s", unit)
+            for reqs in unit:
+                live = self.queue.prune(reqs)
+                if live:
+                    res = self.dispatch_request(live[0])
+                    for req in live:
+                        # coalesced requests may have come from clients holding different responses
+                        req.response = self.conditional_response(req, res)
+                for req in reqs:
+                    req.signal()
+
+            if budget is not None and time.time() - start >= budget:
+                with self.queue_lock:
+                    return len(self.pending) > 0
 
     def dispatch_request(self, req):
         """
         Dispatch a request object.
+
+        Responses to read-only requests are cached until the stop generation
+        advances, so identical requests made by several views at the same
+        stop only hit the debugger once.
         """
-        log.debug("Dispatching request: {}".format(str(req)))
+        log.debug("Dispatching request: %s", req)
 
         # make sure it's valid
         res = None
@@ -290,6 +616,16 @@ class Server(object):
         except MissingFieldError as e:
             res = APIMissingFieldErrorResponse(str(e))
 
+        # The cache is only used once we've been notified of a stop by the debugger, otherwise we'd have no idea
+        # when its contents went stale.
+        generation = self.generation
+        use_cache = req.read_only and generation > 0
+
+        # see if we've already got a response for this request
+        if not res and use_cache:
+            key = req.key()
+            res = self.cache.get(key, generation)
+
         # dispatch the request
         if not res:
             try:
@@ -299,38 +635,1124 @@ class Server(object):
                 log.exception(msg)
                 res = APIGenericErrorResponse(msg)
 
-        log.debug("Response: {}".format(str(res)))
+            if res.is_success and res.etag_generation is None:
+                # the etag itself is worked out lazily, see APIResponse.etag
+                res.etag_generation = generation
+
+            if use_cache and res.is_success:
+                self.cache.put(key, generation, res)
+            elif req.invalidates_cache:
+                # the request may have changed the debugger's state, so anything we've cached is suspect
+                self.advance_generation()
+
+        log.debug("Response: %s", res)
 
         return res
 
+    def conditional_response(self, req, res):
+        """
+        Return an APINotModifiedResponse if `res` is the same as the response
+        the client already has for `req`, according to its `if_none_match`
+        validator. Otherwise return `res`.
+        """
+        if req.if_none_match and res.is_success and res.matches(req.if_none_match):
+            return APINotModifiedResponse(etag=res.etag)
+        return res
 
-class VoltronWSGIServer(BaseWSGIServer):
+    def advance_generation(self):
+        """
+        Advance the stop generation and throw away any cached responses.
+
+        Called by the debugger when the target stops or continues, and from
+        server threads when a request changes the debugger's state. Returns
+        the new generation.
+        """
+        with self.generation_lock:
+            self.generation += 1
+            generation = self.generation
+            self.cache.invalidate(generation)
+        log.debug("Stop generation is now {}".format(generation))
+        return generation
+
+    def state_changed(self, event='stopped', advance=True):
+        """
+        Notify the server that the target's state has changed.
+
+        `event` is 'stopped', 'continued' or 'exited'.
+
+        Advances the stop generation and pushes the event to any subscribed
+        clients. Called by the debugger's stop/continue/exit hooks.
+
+        When the target stops, the debugger should advance the generation
+        itself before updating its state, and call this with `advance` False
+        once it's done. That way clients aren't told about the stop until
+        the adaptor is ready for their requests.
+        """
+        if advance:
+            generation = self.advance_generation()
+        else:
+            generation = self.generation
+        self.publish(APIEvent(event=event, generation=generation, state=self.event_states.get(event)))
+
+    def subscribe(self):
+        """
+        Subscribe to the server's events.
+
+        Returns a queue that the events will be pushed onto. Once the server
+        stops, None will be pushed onto the queue.
+        """
+        q = Queue()
+        q.put(APIEvent(event='hello', generation=self.generation))
+        with self.subscribers_lock:
+            self.subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        """
+        Unsubscribe a queue returned by `subscribe` from the server's events.
+        """
+        with self.subscribers_lock:
+            if q in self.subscribers:
+                self.subscribers.remove(q)
+
+    def publish(self, event):
+        """
+        Push an event to all the subscribed clients.
+        """
+        log.debug("Publishing event: %s", event)
+        with self.subscribers_lock:
+            for q in self.subscribers:
+                q.put(event)
+
+    def cancel_subscribers(self):
+        """
+        Tell all the subscribed clients that the server is going away.
+        """
+        with self.subscribers_lock:
+            for q in self.subscribers:
+                q.put(None)
+            self.subscribers = []
+
+    def stats(self):
+        """
+        Return a dictionary of statistics about the server.
+        """
+        with self.subscribers_lock:
+            subscribers = len(self.subscribers)
+        with self.queue_lock:
+            queue = self.queue.stats()
+            queue['pending'] = sum(len(reqs) for unit in self.pending for reqs in unit)
+        return {
+            'generation':   self.generation,
+            'cache':        self.cache.stats(),
+            'queue':        queue,
+            'subscribers':  subscribers,
+            'streams':      len(self.streams),
+            'dispatch':     self.dispatch_pool.stats() if self.dispatch_pool else {},
+            'listeners':    {s.listener_name: s.stats() for s in self.listeners}
+        }
+
+
+class RequestQueue(object):
     """
-    Custom version of the werkzeug WSGI server.
+    The queue of blocking requests waiting to be dispatched when the
+    debugger next stops.
+
+    Identical read-only requests (i.e. those with the same canonical key) are
+    grouped together as they're queued, so each distinct request is only
+    dispatched once no matter how many clients are waiting on it.
+
+    Requests queued together in one call to `put` (e.g. a batch) are
+    scheduled as a unit, so they're always dispatched back to back. When the
+    queue is drained the units are scheduled by priority (the highest of any
+    of their requests, highest first), then round-robin between the
+    connections that queued them, then in the order they were queued. That
+    way one client queueing a pile of slow requests can't hold up everybody
+    else.
+
+    Each request is given an absolute deadline when it's queued. Requests
+    whose deadline has passed are dropped rather than dispatched, as their
+    waiters have already given up on them.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.groups = {}
+        self.order = []
+        self.units = 0
+        self.coalesced = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def key(self, req):
+        if req.read_only:
+            return req.key()
+        else:
+            # requests that aren't read-only have to be dispatched individually
+            return id(req)
+
+    def priority(self, req):
+        try:
+            return int(req.priority or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def put(self, reqs, source=None):
+        """
+        Add a set of requests to the queue atomically.
+
+        The requests share a single deadline, based on the longest timeout of
+        any of them. `source` identifies the connection they came from.
+        """
+        now = time.time()
+        timeouts = [int(req.timeout) if req.timeout else None for req in reqs]
+        if None in timeouts or not timeouts:
+            deadline = None
+        else:
+            deadline = now + max(timeouts)
+
+        with self.lock:
+            self.units += 1
+            for req in reqs:
+                req.queued_at = now
+                req.deadline = deadline
+                req.source = source
+                req.unit = self.units
+                key = self.key(req)
+                if key in self.groups:
+                    self.groups[key].append(req)
+                    self.coalesced += 1
+                else:
+                    self.groups[key] = [req]
+                    self.order.append(key)
+
+    def remove(self, req):
+        """
+        Remove a request from the queue if it's still there.
+
+        Returns True if the request was removed.
+        """
+        with self.lock:
+            key = self.key(req)
+            group = self.groups.get(key)
+            if group and req in group:
+                group.remove(req)
+                if not group:
+                    del self.groups[key]
+                    self.order.remove(key)
+                return True
+        return False
+
+    def expire(self, req):
+        """
+        Drop a request whose waiter has given up on it.
+        """
+        with self.lock:
+            if self.remove(req):
+                self.dropped += 1
+
+    def drain(self):
+        """
+        Remove everything from the queue.
 
-    This just needs to exist so we can swallow errors when clients disconnect.
+        Returns a list of units, in the order they should be dispatched. Each
+        unit is a list of the groups of identical requests that were queued
+        together.
+        """
+        with self.lock:
+            groups = [self.groups[key] for key in self.order]
+            self.groups = {}
+            self.order = []
+
+        # put the groups back together into the units they were queued in. a group of coalesced requests belongs to
+        # the unit of the first request in it
+        units = []
+        index = {}
+        for reqs in groups:
+            if reqs[0].unit not in index:
+                index[reqs[0].unit] = len(units)
+                units.append([])
+            units[index[reqs[0].unit]].append(reqs)
+
+        # rank each unit amongst those queued by the same connection at the same priority, so connections take
+        # turns within each priority level
+        ranks = defaultdict(int)
+        schedule = []
+        for seq, unit in enumerate(units):
+            priority = max(self.priority(req) for reqs in unit for req in reqs)
+            source = unit[0][0].source
+            schedule.append((-priority, ranks[(source, priority)], seq))
+            ranks[(source, priority)] += 1
+
+        return [units[seq] for (_, _, seq) in sorted(schedule)]
+
+    def prune(self, reqs):
+        """
+        Drop any requests in a drained group whose deadline has passed.
+
+        Dropped requests are given a timed out response. Returns the list of
+        requests that are still live, and records how long they waited.
+        """
+        now = time.time()
+        live = []
+        for req in reqs:
+            if req.deadline and req.deadline <= now:
+                req.response = APITimedOutErrorResponse()
+            else:
+                live.append(req)
+
+        with self.lock:
+            self.dropped += len(reqs) - len(live)
+            for req in live:
+                wait = now - req.queued_at
+                self.dispatched += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+        return live
+
+    def stats(self):
+        """
+        Return a dictionary of queue statistics.
+        """
+        with self.lock:
+            return {
+                'queued':       len(self),
+                'distinct':     len(self.order),
+                'coalesced':    self.coalesced,
+                'dispatched':   self.dispatched,
+                'dropped':      self.dropped,
+                'wait_mean':    self.wait_total / self.dispatched if self.dispatched else 0.0,
+                'wait_max':     self.wait_max
+            }
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(group) for group in self.groups.values())
+
+    def __contains__(self, req):
+        with self.lock:
+            return req in self.groups.get(self.key(req), [])
+
+
+class ResponseCache(object):
     """
-    clients = []
+    A cache of responses to read-only requests.
 
-    def finish_request(self, *args):
-        self.clients.append(args[0])
-        log.debug("finish_request({})".format(args))
+    Responses are stored against the request's canonical key and the stop
+    generation at which they were generated. The cache is emptied each time
+    the generation advances.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        """
+        Return the cached response for `key` at `generation`, or None.
+        """
+        with self.lock:
+            res = self.entries.get((key, generation))
+            if res:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return res
+
+    def put(self, key, generation, res):
+        """
+        Cache a response for `key` at `generation`.
+        """
+        with self.lock:
+            if generation == self.generation:
+                self.entries[(key, generation)] = res
+
+    def invalidate(self, generation):
+        """
+        Throw away all the cached responses and start caching responses for
+        `generation`.
+        """
+        with self.lock:
+            self.entries = {}
+            self.generation = generation
+
+    def stats(self):
+        """
+        Return a dictionary of cache statistics.
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries':  len(self.entries),
+                'hits':     self.hits,
+                'misses':   self.misses,
+                'hit_ratio': float(self.hits) / total if total else 0.0
+            }
+
+
+worker_local = threading.local()
+
+
+class PageCache(object):
+    """
+    A client-side cache of the inferior's memory, in aligned pages.
+
+    Pages are stored for the stop generation they were read at, and thrown
+    away as soon as a read is made for a different generation. Reads are
+    split into pages, and only the runs of pages that aren't cached are
+    fetched.
+    """
+    def __init__(self, page_size=4096, max_pages=1024):
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def read(self, address, length, generation, fetch):
+        """
+        Read `length` bytes of memory at `address`, as of `generation`.
+
+        `fetch(address, length)` is called to read each run of missing
+        pages, and should return the bytes, or None if they couldn't be read.
+
+        Returns a memoryview, or None if any of the pages couldn't be read.
+        """
+        if length <= 0:
+            return memoryview(six.b(''))
+        first = address - address % self.page_size
+        last = address + length - 1
+        last -= last % self.page_size
+        addrs = list(range(first, last + 1, self.page_size))
+
+        with self.lock:
+            if generation != self.generation:
+                self.pages.clear()
+                self.generation = generation
+            pages = dict((a, self.pages.get(a)) for a in addrs)
+        missing = [a for a in addrs if pages[a] is None]
+
+        # fetch each run of contiguous missing pages in one go
+        runs = []
+        for a in missing:
+            if runs and runs[-1][-1] + self.page_size == a:
+                runs[-1].append(a)
+            else:
+                runs.append([a])
+        for run in runs:
+            data = fetch(run[0], len(run) * self.page_size)
+            if data is None or len(data) != len(run) * self.page_size:
+                return None
+            data = memoryview(data)
+            for (i, a) in enumerate(run):
+                pages[a] = data[i * self.page_size:(i + 1) * self.page_size]
+
+        with self.lock:
+            if generation == self.generation:
+                for a in missing:
+                    self.pages[a] = pages[a]
+                while len(self.pages) > self.max_pages:
+                    self.pages.popitem(last=False)
+            self.hits += len(addrs) - len(missing)
+            self.misses += len(missing)
+            self.bytes_saved += (len(addrs) - len(missing)) * self.page_size
+
+        # memory within a single page isn't copied, otherwise the pages are copied into one buffer
+        offset = address - first
+        if len(addrs) == 1:
+            return pages[first][offset:offset + length]
+        buf = bytearray(len(addrs) * self.page_size)
+        for (i, a) in enumerate(addrs):
+            buf[i * self.page_size:(i + 1) * self.page_size] = pages[a]
+        return memoryview(buf)[offset:offset + length]
+
+    def invalidate(self):
+        """
+        Throw away all the cached pages.
+        """
+        with self.lock:
+            self.pages.clear()
+
+    def stats(self):
+        """
+        Return a dictionary of cache statistics.
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'pages':        len(self.pages),
+                'hits':         self.hits,
+                'misses':       self.misses,
+                'hit_ratio':    float(self.hits) / total if total else 0.0,
+                'bytes_saved':  self.bytes_saved
+            }
+
+
+@contextlib.contextmanager
+def detached_worker():
+    """
+    Context manager for code running on a WorkerPool thread that's going to
+    spend a long time waiting rather than working, like streaming events or
+    waiting for the debugger to stop.
+
+    The thread stops counting towards the pool's limit until the block
+    exits, so it can't starve the pool of workers, unless the pool already
+    has `max_detached` detached workers. Does nothing on threads that don't
+    belong to a pool.
+    """
+    pool = getattr(worker_local, 'pool', None)
+    detached = pool.detach() if pool else False
+    try:
+        yield
+    finally:
+        if detached:
+            pool.reattach()
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of worker threads.
+
+    Workers are started on demand as work is submitted, up to `max_workers`.
+    Once that many are busy, new work waits in a queue until one of them is
+    free. Workers that have been idle for `idle_timeout` seconds exit, so the
+    pool shrinks back down when things are quiet.
+
+    Workers that are going to block for a long time can detach themselves
+    from the pool with `detached_worker`, so a replacement can be started.
+    At most `max_detached` workers (by default `max_workers`) can be
+    detached at once, so the pool never has more than `max_workers` +
+    `max_detached` threads.
+    """
+    def __init__(self, max_workers=32, idle_timeout=30, name='worker', max_detached=None):
+        self.max_workers = max_workers
+        self.max_detached = max_workers if max_detached is None else max_detached
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self.tasks = Queue()
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle = 0
+        self.pending = 0
+        self.detached = 0
+        self.started = 0
+
+    def submit(self, func, *args):
+        """
+        Run `func(*args)` on a worker thread.
+        """
+        with self.lock:
+            self.pending += 1
+            self.start_workers()
+        self.tasks.put((func, args))
+
+    def start_workers(self):
+        # must be called with the lock held
+        while self.pending > self.idle and self.workers < self.max_workers:
+            self.workers += 1
+            self.idle += 1
+            self.started += 1
+            t = threading.Thread(target=self.work, name='{}-{}'.format(self.name, self.workers))
+            t.daemon = True
+            t.start()
+
+    def detach(self):
+        """
+        Stop counting the current worker towards the pool's limit, and start
+        another worker if there's work waiting for one.
+
+        Returns False, and leaves the worker counting towards the limit, if
+        the pool already has `max_detached` detached workers.
+        """
+        with self.lock:
+            if self.detached >= self.max_detached:
+                return False
+            self.workers -= 1
+            self.detached += 1
+            self.start_workers()
+            return True
+
+    def reattach(self):
+        """
+        Count a detached worker towards the pool's limit again. If the pool
+        has since filled up, the worker exits once it's finished its task.
+        """
+        with self.lock:
+            self.workers += 1
+            self.detached -= 1
+
+    def work(self):
+        worker_local.pool = self
+        # start_workers counted us as idle already
+        started = True
+        while True:
+            if not started:
+                with self.lock:
+                    self.idle += 1
+            started = False
+            try:
+                task = self.tasks.get(timeout=self.idle_timeout)
+            except Empty:
+                with self.lock:
+                    self.idle -= 1
+                    # only exit if there isn't work on its way that was counting on this worker picking it up
+                    if self.pending <= self.idle:
+                        self.workers -= 1
+                        return
+                continue
+            with self.lock:
+                self.idle -= 1
+                self.pending -= 1
+            if task is None:
+                with self.lock:
+                    self.workers -= 1
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception as e:
+                log.exception("Exception in {} thread: {}".format(self.name, e))
+            with self.lock:
+                # a worker that detached and came back might have put us over the limit
+                if self.workers > self.max_workers:
+                    self.workers -= 1
+                    return
+
+    def shutdown(self):
+        """
+        Tell all the workers to exit once they've finished what they're doing.
+        """
+        with self.lock:
+            n = self.workers
+            self.pending += n
+        for i in range(n):
+            self.tasks.put(None)
+
+    def stats(self):
+        """
+        Return a dictionary of statistics about the pool.
+        """
+        with self.lock:
+            return {
+                'max_workers':  self.max_workers,
+                'workers':      self.workers,
+                'busy':         self.workers - self.idle,
+                'idle':         self.idle,
+                'detached':     self.detached,
+                'queued':       max(self.pending - self.idle, 0),
+                'started':      self.started
+            }
+
+
+class ConnectionSelector(object):
+    """
+    Watches connections that are waiting for their next request on a single
+    thread, so idle connections don't need a thread each.
+
+    `watch` calls a function once a connection is readable (i.e. the client
+    has sent something, or hung up), or has been idle for too long. The
+    functions are called on the selector's thread, so they should be quick,
+    e.g. handing the connection to a WorkerPool.
+    """
+    def __init__(self, name='selector'):
+        self.name = name
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        # connections to start watching, registered by the selector's own thread
+        self.added = []
+        self.watching = 0
+        self.closed = False
+        self.thread = None
+        self.wakeup, self.waker = socket.socketpair()
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+
+    def watch(self, conn, func, timeout=None):
+        """
+        Call `func(True)` once `conn` is readable, or `func(False)` if it
+        hasn't been within `timeout` seconds, or the selector is closed.
+        """
+        with self.lock:
+            closed = self.closed
+            if not closed:
+                self.added.append((conn, func, time.time() + timeout if timeout else None))
+                self.watching += 1
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name=self.name)
+                    self.thread.daemon = True
+                    self.thread.start()
+        if closed:
+            self.call(func, False)
+        else:
+            self.wake()
+
+    def wake(self):
         try:
-            super(VoltronWSGIServer, self).finish_request(*args)
-        except socket.error as e:
-            log.error("Error in finish_request: {}".format(e))
+            self.waker.send(b'\0')
+        except socket.error:
+            pass
+
+    def call(self, func, readable):
+        try:
+            func(readable)
+        except Exception as e:
+            log.exception("Exception in {} thread: {}".format(self.name, e))
+
+    def release(self, key, readable):
+        self.selector.unregister(key.fileobj)
+        with self.lock:
+            self.watching -= 1
+        self.call(key.data[0], readable)
+
+    def run(self):
+        while True:
+            with self.lock:
+                added, self.added = self.added, []
+                closed = self.closed
+            for (conn, func, deadline) in added:
+                try:
+                    self.selector.register(conn, selectors.EVENT_READ, (func, deadline))
+                except (ValueError, KeyError, socket.error):
+                    # closed while it was waiting to be registered
+                    with self.lock:
+                        self.watching -= 1
+                    self.call(func, False)
+            keys = [key for key in self.selector.get_map().values() if key.fileobj is not self.wakeup]
+            if closed:
+                break
+
+            deadlines = [key.data[1] for key in keys if key.data[1]]
+            timeout = max(min(deadlines) - time.time(), 0) if deadlines else None
+            for (key, mask) in self.selector.select(timeout):
+                if key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                else:
+                    self.release(key, True)
+
+            now = time.time()
+            for key in keys:
+                if key.data[1] and key.data[1] <= now and key.fileobj in self.selector.get_map():
+                    self.release(key, False)
+
+        for key in keys:
+            self.release(key, False)
+        self.selector.close()
+        self.wakeup.close()
+        self.waker.close()
+
+    def close(self):
+        """
+        Stop watching. Everything that was being watched is told it isn't
+        readable.
+        """
+        with self.lock:
+            self.closed = True
+            thread = self.thread
+        if thread:
+            self.wake()
+            thread.join()
+
+    def __len__(self):
+        with self.lock:
+            return self.watching
+
+
+class EventStreams(object):
+    """
+    Writes the server's events to the clients that have subscribed to them,
+    on a single thread, so each subscribed connection doesn't need a thread
+    of its own.
+
+    Each stream is a connection, a function that writes an event to it, and
+    a function that closes it. The write function is called with None every
+    `keepalive_interval` seconds when there haven't been any events, to make
+    sure the client is still there, and returns False once it isn't.
+    Streams that fail are closed and dropped, and the rest are closed when
+    the server stops.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.streams = []
+        self.queue = None
+        self.thread = None
+
+    def add(self, conn, write, close):
+        """
+        Start streaming events to `conn`, beginning with a 'hello' event
+        carrying the current stop generation.
+        """
+        if not self.server.is_running:
+            close()
+            return
+        # a stuck client can hold up the other streams, but not forever
+        conn.settimeout(self.server.keepalive_interval)
+        with self.lock:
+            if self.thread is None:
+                self.queue = self.server.subscribe()
+                # our own hello event, we send each stream its own
+                self.queue.get()
+                self.thread = threading.Thread(target=self.run, args=(self.queue,), name='event-streams')
+                self.thread.daemon = True
+                self.thread.start()
+            # new streams go through the queue, so they're in order with the events
+            self.queue.put((conn, write, close))
+
+    def run(self, q):
+        streams = []
+        while True:
+            try:
+                item = q.get(timeout=self.server.keepalive_interval)
+            except Empty:
+                item = False
+            if item is None:
+                break
+            if isinstance(item, tuple):
+                streams.append(item)
+                todo = [(item, APIEvent(event='hello', generation=self.server.generation))]
+            else:
+                # a keepalive if there wasn't an event
+                todo = [(stream, item or None) for stream in streams]
+            for (stream, event) in todo:
+                (conn, write, close) = stream
+                try:
+                    ok = write(event)
+                except socket.error:
+                    ok = False
+                if not ok:
+                    streams.remove(stream)
+                    close()
+            with self.lock:
+                self.streams = list(streams)
+
+        with self.lock:
+            self.streams = []
+            self.thread = None
+        for (conn, write, close) in streams:
+            close()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.streams)
+
+
+class PoolingMixIn(object):
+    """
+    Mix-in for socketserver servers that handles each connection on a thread
+    from a bounded WorkerPool, rather than starting a new thread for every
+    connection like ThreadingMixIn.
+
+    Request handlers can hand their connection over to something else (see
+    `hand_off`) rather than have it closed when they return. Connections
+    waiting for their next request are parked on the listener's
+    ConnectionSelector, and get a worker again once the request arrives.
+
+    Keeps a registry of live connections, which are removed as soon as
+    they're closed.
+    """
+    multithread = True
+    max_workers = 32
+
+    def server_activate(self):
+        max_workers = voltron.config.server.max_workers
+        self.pool = WorkerPool(max_workers=int(max_workers) if max_workers else self.max_workers,
+                               name=self.__class__.__name__)
+        self.selector = ConnectionSelector(name='{}-selector'.format(self.__class__.__name__))
+        self.connections = set()
+        self.handed_off = {}
+        self.connections_lock = threading.Lock()
+        super(PoolingMixIn, self).server_activate()
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+        self.pool.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def hand_off(self, request, func):
+        """
+        Called by a request handler to have `func(request)` called once the
+        handler has returned, rather than the connection being closed.
+
+        `func` is then responsible for the connection, and should close it
+        with `drop_connection` when it's finished with it.
+        """
+        with self.connections_lock:
+            self.handed_off[request] = func
+
+    def park(self, request, client_address, timeout=None):
+        """
+        Called by a request handler to wait for the next request on its
+        connection without tying up a worker.
+
+        Once the handler returns, the connection is parked on the selector,
+        and handed to a new handler on a worker once it's readable. It's
+        closed if it's idle for `timeout` seconds.
+        """
+        def unpark(readable):
+            if readable:
+                self.pool.submit(self.process_request_worker, request, client_address)
+            else:
+                self.drop_connection(request)
+
+        self.hand_off(request, lambda request: self.selector.watch(request, unpark, timeout))
+
+    def shutdown_request(self, request):
+        with self.connections_lock:
+            func = self.handed_off.pop(request, None)
+        if func:
+            func(request)
+        else:
+            self.drop_connection(request)
+
+    def drop_connection(self, request):
+        """
+        Close a connection and remove it from the registry.
+        """
+        with self.connections_lock:
+            self.connections.discard(request)
+        super(PoolingMixIn, self).shutdown_request(request)
 
     def shutdown(self):
-        super(VoltronWSGIServer, self).shutdown()
-        for c in self.clients:
+        super(PoolingMixIn, self).shutdown()
+        with self.connections_lock:
+            connections = list(self.connections)
+        for c in connections:
             try:
                 c.shutdown(socket.SHUT_RD)
                 c.close()
             except:
                 pass
+        self.selector.close()
+        self.pool.shutdown()
+
+    def stats(self):
+        """
+        Return a dictionary of statistics about the listener's connections
+        and worker threads.
+        """
+        stats = self.pool.stats()
+        with self.connections_lock:
+            stats['connections'] = len(self.connections)
+        stats['parked'] = len(self.selector)
+        stats['active_connections'] = stats['busy'] + stats['detached']
+        stats['idle_connections'] = max(stats['connections'] - stats['active_connections'], 0)
+        return stats
 
 
-class ThreadedVoltronWSGIServer(ThreadingMixIn, VoltronWSGIServer):
+def input_waiting(rfile, sock):
+    """
+    Return True if there's something to read from `rfile`, a buffered file
+    object for the socket `sock`, without blocking.
+
+    Clients can send their next request before they've read the response to
+    the last one, in which case it may already be sitting in rfile's buffer,
+    where select() won't see it.
+    """
+    peek = getattr(rfile, 'peek', None)
+    if peek is None:
+        # python 2's socket._fileobject doesn't have peek(), but keeps what it's buffered in _rbuf
+        return rfile._rbuf.tell() > 0 or bool(select.select([sock], [], [], 0)[0])
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        if peek(1):
+            return True
+    except socket.error:
+        return False
+    finally:
+        sock.settimeout(timeout)
+    # there's nothing to read, but the socket is readable if the client has hung up
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+class VoltronRequestHandler(WSGIRequestHandler):
+    """
+    A WSGIRequestHandler that keeps HTTP/1.1 connections open between
+    requests, so clients don't have to reconnect for every update.
+
+    Recent versions of werkzeug close the connection after every response,
+    and read and throw away anything else the client has sent, so this
+    handler runs the app itself. Responses are sent with a Content-Length,
+    or chunked if they're streamed (e.g. the event stream), and the
+    connection is kept open unless the client asks for it to be closed.
+
+    While a connection is idle between requests it's parked on the
+    listener's selector, and the event stream is handed over to the
+    server's EventStreams, so neither of them holds on to a worker.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # idle connections are closed after this many seconds
+    keepalive_timeout = 60
+
+    def handle_one_request(self):
+        if getattr(self, 'handled', False) and not input_waiting(self.rfile, self.connection):
+            # park the kept-alive connection until its next request arrives
+            self.server.park(self.request, self.client_address, self.keepalive_timeout)
+            self.close_connection = True
+            return
+        self.handled = True
+        return super(VoltronRequestHandler, self).handle_one_request()
+
+    def make_environ(self, *args, **kwargs):
+        environ = super(VoltronRequestHandler, self).make_environ(*args, **kwargs)
+        if not environ.get('wsgi.input_terminated'):
+            # only let the app read this request's body, so we can find the start of the next one
+            environ['wsgi.input'] = LimitedStream(self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+            environ['wsgi.input_terminated'] = True
+        environ['voltron.stream_events'] = self.stream_events
+        return environ
+
+    def stream_events(self, streams, encode):
+        """
+        Called by the app, as the environ's 'voltron.stream_events', to hand
+        the connection over to `streams` (the server's EventStreams) once
+        the response's headers have been sent, rather than finishing the
+        response.
+
+        `encode(event)` returns the body bytes for an event, or for a
+        keepalive if `event` is None.
+        """
+        self.event_streams = (streams, encode)
+
+    def hand_off_events(self, chunked):
+        """
+        Hand the connection over to the EventStreams passed to
+        `stream_events`, once this handler's finished with it.
+        """
+        streams, encode = self.event_streams
+        conn = self.connection
+
+        def write(event):
+            data = encode(event)
+            if chunked:
+                data = '{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n'
+            conn.sendall(data)
+            return True
+
+        self.close_connection = True
+        self.server.hand_off(self.request, lambda request: streams.add(conn, write,
+                                                                       lambda: self.server.drop_connection(request)))
+
+    def run_wsgi(self):
+        if self.headers.get('Expect', '').lower().strip() == '100-continue':
+            self.wfile.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        self.event_streams = None
+        self.environ = environ = self.make_environ()
+        if not isinstance(environ['wsgi.input'], LimitedStream):
+            # the request body was chunked, so we can't be sure where the next request starts
+            self.close_connection = True
+
+        # the status and headers passed to start_response, and whether they've been sent
+        state = {'status': None, 'headers': None, 'sent': False, 'chunked': False}
+
+        def write(data):
+            if not state['sent']:
+                state['sent'] = True
+                code, _, msg = state['status'].partition(' ')
+                code = int(code)
+                self.send_response(code, msg)
+                keys = set()
+                for (key, value) in state['headers']:
+                    self.send_header(key, value)
+                    keys.add(key.lower())
+                if ('content-length' not in keys and environ['REQUEST_METHOD'] != 'HEAD' and code >= 200 and
+                        code not in (204, 304)):
+                    if self.request_version >= 'HTTP/1.1':
+                        state['chunked'] = True
+                        self.send_header('Transfer-Encoding', 'chunked')
+                    else:
+                        # the end of the response is marked by closing the connection
+                        self.send_header('Connection', 'close')
+                self.end_headers()
+            if data:
+                if state['chunked']:
+                    self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+                else:
+                    self.wfile.write(data)
+            self.wfile.flush()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info:
+                try:
+                    if state['sent']:
+                        six.reraise(*exc_info)
+                finally:
+                    exc_info = None
+            state['status'] = status
+            state['headers'] = headers
+            return write
+
+        def execute(app):
+            app_iter = app(environ, start_response)
+            try:
+                for data in app_iter:
+                    write(data)
+                if not state['sent']:
+                    write(b'')
+                if self.event_streams:
+                    self.hand_off_events(state['chunked'])
+                elif state['chunked']:
+                    self.wfile.write(b'0\r\n\r\n')
+                    self.wfile.flush()
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+
+        try:
+            execute(self.server.app)
+            if not self.close_connection:
+                # skip anything the app didn't read of the request body
+                environ['wsgi.input'].exhaust()
+        except socket.error as e:
+            self.close_connection = True
+            self.connection_dropped(e, environ)
+        except Exception:
+            if self.server.passthrough_errors:
+                raise
+            self.close_connection = True
+            log.exception("Exception raised while handling request")
+            if not state['sent']:
+                try:
+                    execute(InternalServerError())
+                except Exception:
+                    pass
+
+
+class VoltronWSGIServer(BaseWSGIServer):
+    """
+    Custom version of the werkzeug WSGI server.
+
+    This swallows errors when clients disconnect, and keeps connections
+    alive between requests.
+    """
+    def __init__(self, host, port, app, handler=None, *args, **kwargs):
+        super(VoltronWSGIServer, self).__init__(host, port, app, handler or VoltronRequestHandler, *args, **kwargs)
+
+    def finish_request(self, *args):
+        log.debug("finish_request({})".format(args))
+        try:
+            super(VoltronWSGIServer, self).finish_request(*args)
+        except socket.error as e:
+            log.error("Error in finish_request: {}".format(e))
+
+
+class ThreadedVoltronWSGIServer(PoolingMixIn, VoltronWSGIServer):
     """
     Threaded WSGI server to replace werkzeug's
     """
@@ -352,7 +1774,7 @@ if sys.platform != 'win32':
             self.host = 'localhost'
             self.port = 0
 
-    class UnixWSGIRequestHandler(WSGIRequestHandler):
+    class UnixWSGIRequestHandler(VoltronRequestHandler):
         """
         A WSGIRequestHandler that does sane things with Unix domain sockets.
         """
@@ -360,44 +1782,231 @@ if sys.platform != 'win32':
             self.client_address = ('127.0.0.1', 0)
             return super(UnixWSGIRequestHandler, self).make_environ(*args, **kwargs)
 
-    class ThreadedUnixWSGIServer(ThreadingMixIn, UnixWSGIServer):
+    class ThreadedUnixWSGIServer(PoolingMixIn, UnixWSGIServer):
         """
         Threaded HTTP server that works over Unix domain sockets.
 
         Note: this intentionally does not inherit from HTTPServer. Go look at the
         source and you'll see why.
         """
-        multithread = True
+        pass
+
 
+# the largest frame we'll accept, anything bigger is assumed to be garbage
+MAX_FRAME_SIZE = 64 * 1024 * 1024
 
-class ClientThread(threading.Thread):
+
+def read_frame(f):
+    """
+    Read a length-prefixed frame from a file-like object.
+
+    Frames are a 4 byte big-endian length, followed by that many bytes of
+    UTF-8 encoded payload (an API message in JSON).
+
+    Returns the payload as a string, or None if the other end has hung up.
+    Raises InvalidMessageException if the frame is larger than
+    MAX_FRAME_SIZE.
     """
-    A thread that performs an API request with a client.
+    header = f.read(4)
+    if len(header) < 4:
+        return None
+    (length,) = struct.unpack('>I', header)
+    if length > MAX_FRAME_SIZE:
+        raise InvalidMessageException("Frame of {} bytes is too large".format(length))
+    data = f.read(length)
+    if len(data) < length:
+        return None
+    return data.decode('UTF-8')
+
+
+def write_frame(f, data):
     """
-    def __init__(self, client, request, *args, **kwargs):
-        self.request = request
-        self.response = None
-        self.exception = None
-        self.client = client
-        super(ClientThread, self).__init__(*args, **kwargs)
+    Write a length-prefixed frame to a file-like object.
 
-    def run(self):
+    See `read_frame`.
+    """
+    f.write(encode_frame(data))
+    f.flush()
+
+
+def encode_frame(data):
+    """
+    Return a string as a length-prefixed frame. See `read_frame`.
+    """
+    data = data.encode('UTF-8')
+    return struct.pack('>I', len(data)) + data
+
+
+class RPCRequestHandler(StreamRequestHandler):
+    """
+    Handles connections to the RPC listener.
+
+    Each frame received from the client is an API request, or a JSON array
+    of API requests to be handled as a batch, and is answered with a frame
+    containing the response(s). A frame containing just `events` subscribes
+    the connection to the server's events, which are then written as frames
+    until the server stops.
+    """
+    def handle(self):
+        server = self.server.voltron_server
+        while True:
+            if not input_waiting(self.rfile, self.connection):
+                # clients keep their connections open between requests, park it until the next one arrives
+                self.server.park(self.request, self.client_address)
+                break
+            data = read_frame(self.rfile)
+            if data is None:
+                break
+            if data == 'events':
+                self.stream_events(server)
+                break
+            elif data.startswith('['):
+                res = server.handle_batch(data, source=id(self.request))
+                if isinstance(res, list):
+                    res = '[{}]'.format(', '.join(str(r) for r in res))
+            else:
+                res = server.handle_request(data, source=id(self.request))
+            write_frame(self.wfile, str(res))
+
+    def stream_events(self, server):
+        """
+        Hand the connection over to the server's EventStreams once this
+        handler's finished with it.
+        """
+        conn = self.connection
+
+        def write(event):
+            if event is None:
+                return not self.client_gone()
+            conn.sendall(encode_frame(str(event)))
+            return True
+
+        self.server.hand_off(self.request, lambda request: server.streams.add(conn, write,
+                                                                              lambda: self.server.drop_connection(request)))
+
+    def client_gone(self):
+        """
+        Check whether the client has hung up. Clients don't send anything
+        once they've subscribed to events, so if the connection is readable
+        it's been closed.
+        """
         try:
-            self.response = self.client.send_request(self.request)
-        except Exception as e:
-            self.exception = e
+            r, w, x = select.select([self.connection], [], [], 0)
+            return bool(r) and not self.connection.recv(1, socket.MSG_PEEK)
+        except socket.error:
+            return True
+
+
+if sys.platform != 'win32':
+    class ThreadedUnixRPCServer(PoolingMixIn, UnixStreamServer):
+        """
+        Threaded server that speaks length-prefixed API messages over a Unix
+        domain socket, so local clients can skip HTTP altogether.
+        """
+        def __init__(self, sockfile=None, server=None):
+            UnixStreamServer.__init__(self, sockfile, RPCRequestHandler)
+            self.voltron_server = server
+
+        def handle_error(self, request, client_address):
+            log.exception("Error in RPC request handler")
+
+
+class SocketWatcher(object):
+    """
+    Waits for a Unix domain socket to be created.
+
+    Uses inotify to watch the socket's directory where it's available (i.e.
+    on Linux), otherwise `wait` just sleeps.
+    """
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        if not sys.platform.startswith('linux'):
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(self.IN_CLOEXEC)
+            if fd < 0:
+                return
+            directory = os.path.dirname(path) or '.'
+            if libc.inotify_add_watch(fd, directory.encode('UTF-8'), self.IN_CREATE | self.IN_MOVED_TO) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            log.debug("Can't watch for {} to be created: {}".format(path, e))
+
+    def wait(self, timeout):
+        """
+        Wait up to `timeout` seconds for the socket to be created.
+
+        Returns True if it was.
+        """
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        name = os.path.basename(self.path).encode('UTF-8')
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            r, w, x = select.select([self.fd], [], [], remaining)
+            if not r:
+                return False
+            # a series of inotify_event structs: int wd, uint32 mask, cookie, len, then len bytes of name
+            data = os.read(self.fd, 4096)
+            offset = 0
+            while offset + 16 <= len(data):
+                (wd, mask, cookie, length) = struct.unpack_from('iIII', data, offset)
+                offset += 16
+                if data[offset:offset + length].rstrip(six.b('\0')) == name:
+                    return True
+                offset += length
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
 
 class Client(object):
     """
     Used by a client (ie. a view) to communicate with the server.
     """
+    # maximum number of idle connections to the RPC listener to keep open
+    rpc_pool_size = 4
+
+    # maximum number of threads used to send requests concurrently
+    max_workers = 8
+
+    # maximum number of previous responses to keep, so the server can tell us when they haven't changed
+    response_cache_size = 256
+
+    # bounds of the delay between attempts to reconnect to the server, in seconds
+    min_retry_delay = 0.05
+    max_retry_delay = 2.0
+
     def __init__(self, host='127.0.0.1', port=5555, sockfile=None, url=None,
-                 build_requests=None, callback=None, supports_blocking=True):
+                 build_requests=None, callback=None, supports_blocking=True, binary=True, priority=None):
         """
         Initialise a new client
+
+        If `binary` is True, the server is asked to send responses containing
+        raw data (e.g. memory) as binary envelopes rather than base64 encoded
+        JSON.
+
+        `priority` is the default priority for the requests sent by `update`.
         """
-        self.session = requests.Session()
+        self.binary = binary
+        self.local = threading.local()
+        self.sessions = []
+        self.sessions_lock = threading.Lock()
+        self.pool = WorkerPool(max_workers=self.max_workers, idle_timeout=None, name='client')
         if url:
             self.url = url
         elif sockfile:
@@ -407,12 +2016,219 @@ class Client(object):
         else:
             self.url = 'http://{}:{}/api/request'.format(host, port)
         self.url = self.url.replace('~', os.path.expanduser('~').replace('/', '%2f'))
+        if self.url.startswith('rpc+unix://'):
+            self.rpc_path = six.moves.urllib.parse.unquote(self.url[len('rpc+unix://'):])
+        else:
+            self.rpc_path = None
+        self.rpc_connections = []
+        self.rpc_lock = threading.Lock()
+        self.batch_url = self.url.rsplit('/', 1)[0] + '/batch'
+        self.events_url = self.url.rsplit('/', 1)[0] + '/events'
+        self.supports_batch = True
+        self.supports_events = True
+        self.generation = None
+        self.rendered_generation = None
         self.callback = callback
         self.build_requests = build_requests
         self.done = False
         self.server_version = None
         self.block = False
         self.supports_blocking = supports_blocking
+        self.priority = priority
+        self.counters = defaultdict(int)
+        self.counters_lock = threading.Lock()
+        self.responses = OrderedDict()
+        self.responses_lock = threading.Lock()
+        self.retry_delay = None
+        self.watcher = None
+        self.pages = PageCache()
+        self.cache_memory = True
+        self.memory_bases = {}
+
+    @property
+    def session(self):
+        """
+        The requests session for the current thread.
+
+        Sessions aren't thread safe, so each of the client's threads gets its
+        own, which keeps its connections to the server open between updates.
+        """
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            if self.binary:
+                session.headers['Accept'] = '{}, application/json'.format(binary_mimetype)
+            self.local.session = session
+            with self.sessions_lock:
+                self.sessions.append(session)
+        return session
+
+    def add_validator(self, request):
+        """
+        Ask the server not to send the response to `request` again if it
+        hasn't changed since the last one we received.
+        """
+        res = self.cached_response(request.key())
+        request.if_none_match = res.etag if res else None
+
+    def cached_response(self, key):
+        """
+        Return the last response we received for the request with key `key`,
+        or None.
+        """
+        with self.responses_lock:
+            res = self.responses.pop(key, None)
+            if res is not None:
+                # move it to the most recently used end
+                self.responses[key] = res
+            return res
+
+    def cache_response(self, key, res):
+        """
+        Keep `res` as the last response received for the request with key
+        `key`, throwing away the least recently used responses once there
+        are more than `response_cache_size`.
+        """
+        with self.responses_lock:
+            self.responses.pop(key, None)
+            self.responses[key] = res
+            while len(self.responses) > self.response_cache_size:
+                self.responses.popitem(last=False)
+
+    def resolve_response(self, request, res):
+        """
+        Return the response to use for `request`, given the response `res`
+        from the server.
+
+        If the server said the response hasn't changed, this is a copy of the
+        response we already have. It's a copy so that a view that modifies
+        the response it's given doesn't change the cached one.
+        """
+        key = request.key()
+        if res.is_not_modified:
+            cached = self.cached_response(key)
+            if cached:
+                with self.counters_lock:
+                    self.counters['not_modified'] += 1
+                return cached.copy()
+            return APIEmptyResponseErrorResponse()
+        if res.is_success and res.etag:
+            self.cache_response(key, res)
+        if request.request == 'memory' and res.is_success:
+            self.record_memory_address(request, res)
+        return res
+
+    def cacheable_memory_address(self, request):
+        """
+        Return the address a memory request will read from, if it can be
+        served from the page cache, otherwise None.
+
+        Requests that dereference pointers or calculate the address with a
+        command can't be. Requests for memory at a register's address can be,
+        once we've seen where the register points at the current generation.
+        """
+        if (not self.cache_memory or self.generation is None or getattr(self.local, 'fetching_pages', False) or
+                request.request != 'memory' or request.deref or request.command or request.words or
+                not request.length):
+            return None
+        if request.address:
+            base = request.address
+        elif request.register:
+            base = self.memory_bases.get((self.generation, request.target_id, request.register))
+            if base is None:
+                return None
+        else:
+            return None
+        return int(base) + int(request.offset or 0)
+
+    def record_memory_address(self, request, res):
+        # remember where a register pointed, so later requests for memory around it can use the page cache
+        if request.register and not request.command and not request.words and res.address is not None:
+            if any(key[0] != self.generation for key in self.memory_bases):
+                self.memory_bases = {}
+            key = (self.generation, request.target_id, request.register)
+            self.memory_bases[key] = int(res.address) - int(request.offset or 0)
+
+    def cached_memory(self, request):
+        """
+        Return a response to a memory request from the page cache, fetching
+        any pages that aren't cached, or None if the request can't be served
+        from the cache.
+        """
+        address = self.cacheable_memory_address(request)
+        if address is None:
+            return None
+
+        def fetch(address, length):
+            self.local.fetching_pages = True
+            try:
+                res = self.send_request(api_request('memory', address=address, length=length,
+                                                    target_id=request.target_id))
+            finally:
+                self.local.fetching_pages = False
+            if res.is_success:
+                return res.memory
+
+        data = self.pages.read(address, int(request.length), self.generation, fetch)
+        if data is None:
+            return None
+        res = api_response('memory')
+        res.address = address
+        res.memory = data
+        res.bytes = len(data)
+        return res
+
+    def record_response(self, response):
+        """
+        Record the size of a response received over HTTP, before and after
+        it was decompressed.
+        """
+        size = len(response.content)
+        wire_size = size
+        if response.headers.get('Content-Encoding') and response.headers.get('Content-Length'):
+            wire_size = int(response.headers['Content-Length'])
+        with self.counters_lock:
+            self.counters['responses'] += 1
+            self.counters['bytes'] += size
+            self.counters['wire_bytes'] += wire_size
+            if wire_size != size:
+                self.counters['compressed'] += 1
+
+    def stats(self):
+        """
+        Return a dictionary of statistics about the client's requests.
+
+        `compression_ratio` is the ratio of the size of the responses received
+        to the number of bytes that actually came over the wire.
+        """
+        with self.counters_lock:
+            d = dict(self.counters)
+        for key in ['responses', 'compressed', 'bytes', 'wire_bytes']:
+            d.setdefault(key, 0)
+        d['compression_ratio'] = float(d['bytes']) / d['wire_bytes'] if d['wire_bytes'] else 1.0
+
+        # connections to the server
+        d['requests'] = d.pop('rpc_requests', 0)
+        d['handshakes'] = d.pop('rpc_handshakes', 0)
+        with self.sessions_lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            for adapter in session.adapters.values():
+                # requests_unixsocket's adapter keeps its own pools
+                pools = getattr(adapter, 'pools', None)
+                if pools is None:
+                    pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    try:
+                        pool = pools[key]
+                    except KeyError:
+                        continue
+                    d['requests'] += pool.num_requests
+                    d['handshakes'] += pool.num_connections
+        d['reused'] = d['requests'] - d['handshakes']
+        d['threads'] = self.pool.stats()['started']
+        d['page_cache'] = self.pages.stats()
+        return d
 
     def send_request(self, request):
         """
@@ -425,58 +2241,346 @@ class Client(object):
         the plugin's specified response class if one exists, otherwise it will
         be an APIResponse.
         """
+        # serve memory from the page cache if we can
+        res = self.cached_memory(request)
+        if res:
+            return res
+
         # default to an empty response error
         res = APIEmptyResponseErrorResponse()
 
         # perform the request
-        log.debug("Client sending request: " + str(request))
-        response = self.session.post(self.url, data=str(request))
-        data = response.text
-        if response.status_code != 200:
-            res = APIGenericErrorResponse(response.text)
+        self.add_validator(request)
+        log.debug("Client sending request: %s", request)
+        if self.rpc_path:
+            data = self.send_rpc(str(request))
+            status_code = 200
+        else:
+            response = self.session.post(self.url, data=str(request))
+            self.record_response(response)
+            if response.status_code == 200 and response.headers.get('Content-Type') == binary_mimetype:
+                return self.resolve_response(request, self.response_from_binary(request, response.content))
+            data = response.text
+            status_code = response.status_code
+        if status_code != 200:
+            res = APIGenericErrorResponse(data)
         elif data and len(data) > 0:
-            log.debug('Client received message: ' + data)
+            log.debug('Client received message: %s', data)
 
+            # parse the response data once, and build the right type of response from it
             try:
-                # parse the response data
-                generic_response = APIResponse(data=data)
-
-                # if there's an error, return an error response
-                if generic_response.is_error:
-                    res = APIErrorResponse(data=data)
-                else:
-                    # success; generate a proper response
-                    plugin = voltron.plugin.pm.api_plugin_for_request(request.request)
-                    if plugin and plugin.response_class:
-                        # found a plugin for the request we sent, use its response type
-                        res = plugin.response_class(data=data)
-                    else:
-                        # didn't find a plugin, just return the generic APIResponse we already generated
-                        res = generic_response
-            except Exception as e:
-                log.exception('Exception parsing message: ' + str(e))
+                d = codec.loads(data, wide_ints=self.wide_ints([request]))
+            except ValueError as e:
                 log.error('Invalid message: ' + data)
+            else:
+                res = self.response_from_dict(request, d)
         else:
             res = APIEmptyResponseErrorResponse()
 
+        return self.resolve_response(request, res)
+
+    def send_batch(self, requests):
+        """
+        Send a batch of requests to the server in a single round trip.
+
+        `requests` is a list of APIRequest subclass instances.
+
+        Returns a list of responses in the same order as the requests. See
+        `send_request` for the types of responses that may be returned.
+        """
+        # serve memory from the page cache if we can, and send the rest
+        results = [self.cached_memory(req) for req in requests]
+        rest = [req for (req, res) in zip(requests, results) if not res]
+        responses = iter(self.send_uncached_batch(rest) if rest else [])
+        return [res if res else next(responses) for res in results]
+
+    def send_uncached_batch(self, requests):
+        """
+        Send a batch of requests to the server. See `send_batch`.
+        """
+        for req in requests:
+            self.add_validator(req)
+        log.debug("Client sending batch: %s", requests)
+        data = '[{}]'.format(', '.join(str(r) for r in requests))
+        if self.rpc_path:
+            data = self.send_rpc(data)
+        else:
+            response = self.session.post(self.batch_url, data=data)
+            self.record_response(response)
+            if response.status_code == 404:
+                raise BatchNotSupportedError("Server does not support batched requests")
+            elif response.status_code != 200:
+                return [APIGenericErrorResponse(response.text) for r in requests]
+            elif response.headers.get('Content-Type') == binary_mimetype:
+                try:
+                    envelopes = unpack_binary_batch(response.content, self.wide_ints(requests))
+                except InvalidMessageException:
+                    envelopes = []
+                if len(envelopes) != len(requests):
+                    log.error('Invalid binary batch of {} bytes'.format(len(response.content)))
+                    return [APIEmptyResponseErrorResponse() for r in requests]
+                return [self.resolve_response(req, self.response_from_envelope(req, d, attachments))
+                        for (req, (d, attachments)) in zip(requests, envelopes)]
+            data = response.text
+
+        log.debug('Client received batch: %s', data)
+        try:
+            batch = codec.loads(data, wide_ints=self.wide_ints(requests))
+        except Exception as e:
+            log.exception('Exception parsing batch: ' + str(e))
+            log.error('Invalid batch: ' + data)
+            return [APIEmptyResponseErrorResponse() for r in requests]
+
+        if isinstance(batch, dict):
+            # the batch as a whole failed, so every request gets the same error
+            batch = [batch] * len(requests)
+
+        return [self.resolve_response(req, self.response_from_dict(req, d)) for (req, d) in zip(requests, batch)]
+
+    def send_rpc(self, data):
+        """
+        Send a frame to the server's RPC listener and return the response.
+
+        Connections to the listener are kept open in a small pool shared by
+        all the client's threads, and reused for later requests.
+        """
+        conn = None
+        try:
+            with self.rpc_lock:
+                if self.rpc_connections:
+                    conn = self.rpc_connections.pop()
+            if not conn:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                conn = (sock, sock.makefile('rwb'))
+                sock.connect(self.rpc_path)
+                with self.counters_lock:
+                    self.counters['rpc_handshakes'] += 1
+            with self.counters_lock:
+                self.counters['rpc_requests'] += 1
+            write_frame(conn[1], data)
+            res = read_frame(conn[1])
+            if res is None:
+                raise socket.error("Connection closed by server")
+        except (socket.error, InvalidMessageException) as e:
+            if conn:
+                self.close_rpc_connection(conn)
+            raise ConnectionError(e)
+
+        # put the connection back in the pool, unless it's full
+        with self.rpc_lock:
+            if len(self.rpc_connections) < self.rpc_pool_size:
+                self.rpc_connections.append(conn)
+                conn = None
+        if conn:
+            self.close_rpc_connection(conn)
+        return res
+
+    def close_rpc_connection(self, conn):
+        sock, f = conn
+        try:
+            f.close()
+            sock.close()
+        except socket.error:
+            pass
+
+    def rpc_events(self):
+        """
+        Subscribe to the server's events over the RPC listener.
+
+        See `events`.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.rpc_path)
+            f = sock.makefile('rwb')
+            write_frame(f, 'events')
+            while not self.done:
+                data = read_frame(f)
+                if data is None:
+                    break
+                event = APIEvent(data=data)
+                log.debug('Client received event: %s', event)
+                self.generation = event.generation
+                yield event
+        except socket.error as e:
+            raise ConnectionError(e)
+        finally:
+            sock.close()
+
+    def events(self):
+        """
+        Subscribe to the server's event stream.
+
+        This is a generator that yields an APIEvent each time the server
+        pushes one, starting with a 'hello' event carrying the current stop
+        generation. It finishes when the server goes away or the client is
+        stopped.
+        """
+        if self.rpc_path:
+            for event in self.rpc_events():
+                yield event
+            return
+
+        session = requests.Session()
+        response = session.get(self.events_url, stream=True)
+        try:
+            if response.status_code == 404:
+                raise EventsNotSupportedError("Server does not support events")
+            elif response.status_code != 200:
+                raise ConnectionError("Error subscribing to events: {}".format(response.status_code))
+
+            buf = six.b('')
+            for chunk in response.iter_content(chunk_size=None):
+                buf += chunk
+                while six.b('\n\n') in buf:
+                    message, buf = buf.split(six.b('\n\n'), 1)
+                    for line in message.decode('UTF-8').split('\n'):
+                        if line.startswith('data:'):
+                            event = APIEvent(data=line[5:].strip())
+                            log.debug('Client received event: %s', event)
+                            self.generation = event.generation
+                            yield event
+                if self.done:
+                    break
+        finally:
+            response.close()
+            session.close()
+
+    def wide_ints(self, requests):
+        """
+        Return True if any of the responses to `requests` may hold integers
+        wider than 64 bits, which need decoding carefully. See `JSONCodec`.
+        """
+        for req in requests:
+            plugin = pm.api_plugin_for_request(req.request)
+            if plugin and plugin.response_class._wide_ints:
+                return True
+        return False
+
+    def response_from_binary(self, request, data):
+        """
+        Create a response object for a request from a binary envelope.
+
+        The encoded fields of the response are memoryviews of `data`, rather
+        than copies.
+        """
+        try:
+            d, attachments = unpack_binary(data, self.wide_ints([request]))
+        except InvalidMessageException:
+            log.error('Invalid binary message of {} bytes'.format(len(data)))
+            return APIEmptyResponseErrorResponse()
+        return self.response_from_envelope(request, d, attachments)
+
+    def response_from_envelope(self, request, d, attachments):
+        """
+        Create a response object for a request from an unpacked binary
+        envelope. See `unpack_binary`.
+        """
+        log.debug('Client received binary message: %s + %d attachment(s)', d, len(attachments))
+        res = self.response_from_dict(request, d)
+        for field in attachments:
+            setattr(res, field, attachments[field])
+        return res
+
+    def response_from_dict(self, request, d):
+        """
+        Create a response object for a request from a dictionary that has
+        been parsed from JSON.
+        """
+        res = APIEmptyResponseErrorResponse()
+        try:
+            if d.get('status') == 'error':
+                # if there's an error, return an error response
+                r = APIErrorResponse()
+            else:
+                # success; use the plugin's response type if there is one
+                plugin = voltron.plugin.pm.api_plugin_for_request(request.request)
+                if plugin and plugin.response_class:
+                    r = plugin.response_class()
+                else:
+                    r = APIResponse()
+            r.from_dict(d)
+            res = r
+        except Exception as e:
+            log.exception('Exception parsing message: ' + str(e))
+            log.error('Invalid message: ' + str(d))
         return res
 
+    def socket_path(self):
+        """
+        Return the path of the Unix domain socket that appears when the
+        server starts listening, or None.
+
+        That's the socket we connect to if there is one, otherwise the
+        server's configured domain socket.
+        """
+        if self.rpc_path:
+            return self.rpc_path
+        elif self.url.startswith('http+unix://'):
+            return six.moves.urllib.parse.unquote(self.url[len('http+unix://'):].split('/', 1)[0])
+        elif voltron.config.server.listen.domain and sys.platform != 'win32':
+            return os.path.expanduser(str(voltron.config.server.listen.domain))
+        return None
+
+    def wait_for_server(self):
+        """
+        Wait before trying to reconnect to the server.
+
+        Waits for a jittered delay that doubles each time, or until the
+        server's Unix domain socket is created if we can watch for it,
+        whichever comes first.
+        """
+        if self.retry_delay:
+            self.retry_delay = min(self.retry_delay * 2, self.max_retry_delay)
+        else:
+            self.retry_delay = self.min_retry_delay
+        delay = random.uniform(self.retry_delay / 2, self.retry_delay)
+
+        if not self.watcher:
+            path = self.socket_path()
+            if path:
+                self.watcher = SocketWatcher(path)
+        if self.watcher:
+            if self.watcher.wait(delay):
+                log.debug("Server socket created, reconnecting")
+                self.retry_delay = None
+        else:
+            time.sleep(delay)
+
     def send_requests(self, *args):
         """
         Send a set of requests.
 
-        Each request is sent over its own connection and the function will
-        return when all the requests have been fulfilled.
+        The requests are sent concurrently by the client's worker threads,
+        which keep their connections to the server open between calls. The
+        function will return when all the requests have been fulfilled.
         """
-        threads = [ClientThread(self, req) for req in args]
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
-        exceptions = [t.exception for t in threads if t.exception]
+        if len(args) == 1:
+            return [self.send_request(args[0])]
+
+        responses = [None] * len(args)
+        exceptions = [None] * len(args)
+        done = threading.Semaphore(0)
+
+        def send(i, req):
+            try:
+                responses[i] = self.send_request(req)
+            except Exception as e:
+                exceptions[i] = e
+            finally:
+                done.release()
+
+        # send the first one ourselves while the workers send the rest
+        for i, req in enumerate(args[1:], 1):
+            self.pool.submit(send, i, req)
+        send(0, args[0])
+        for i in range(len(args)):
+            done.acquire()
+
+        exceptions = [e for e in exceptions if e]
         if len(exceptions):
             raise exceptions[0]
-        return [t.response for t in threads]
+        return responses
 
     def create_request(self, request_type, *args, **kwargs):
         """
@@ -512,7 +2616,16 @@ class Client(object):
         reqs = self.build_requests()
         for r in reqs:
             r.block = self.block
-        results = self.send_requests(*reqs)
+            if r.priority is None:
+                r.priority = self.priority
+        if len(reqs) > 1 and self.supports_batch:
+            try:
+                results = self.send_batch(reqs)
+            except BatchNotSupportedError:
+                self.supports_batch = False
+                results = self.send_requests(*reqs)
+        else:
+            results = self.send_requests(*reqs)
 
         # call callback with the results
         self.callback(results)
@@ -543,11 +2656,13 @@ class Client(object):
                 # get the server version info
                 if not self.server_version:
                     self.server_version = self.perform_request('version')
+                    self.retry_delay = None
 
                     # if the server supports async mode, use it, as some views may only work in async mode
                     if self.server_version.capabilities and 'async' in self.server_version.capabilities:
-                        self.update()
                         self.block = False
+                        if not self.supports_events:
+                            self.update()
                     elif self.supports_blocking:
                         self.block = True
                     else:
@@ -556,16 +2671,41 @@ class Client(object):
                 if self.block:
                     # synchronous requests
                     self.update()
+                elif self.supports_events:
+                    # async requests, wait for the server to tell us the debugger has stopped again
+                    try:
+                        for event in self.events():
+                            # the first event tells us the current generation, if the debugger has stopped since we
+                            # last updated (or we never have), catch up
+                            if event.event == 'stopped' or (event.event == 'hello' and
+                                                            event.generation != self.rendered_generation):
+                                self.update()
+                                self.rendered_generation = event.generation
+                            if self.done:
+                                break
+                    except EventsNotSupportedError:
+                        self.supports_events = False
+                        self.update()
+                    else:
+                        # the stream ended, so the server has probably gone away
+                        self.server_version = None
                 else:
                     # async requests, block using a null request until the debugger stops again
                     res = self.perform_request('null', block=True)
                     if res.is_success:
                         self.server_version = res
                         self.update()
-            except ConnectionError as e:
+            except (ConnectionError, ChunkedEncodingError) as e:
                 self.callback(error='Error: {}'.format(normalise_requests_err(e)))
                 self.server_version = None
-                time.sleep(1)
+                # the server may have restarted, and its generations with it
+                self.generation = None
+                self.pages.invalidate()
+                self.wait_for_server()
+
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
 
     def start(self, build_requests=None, callback=None):
         """
@@ -582,6 +2722,15 @@ class Client(object):
 
     def stop(self):
         """
-        Stop the background thread.
+        Stop the background thread, and close the client's connections.
         """
         self.done = True
+        self.pool.shutdown()
+        with self.sessions_lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.close()
+        with self.rpc_lock:
+            conns, self.rpc_connections = self.rpc_connections, []
+        for conn in conns:
+            self.close_rpc_connection(conn)
@@ -3,6 +3,11 @@ try:
 except:
     capstone = None
 
+import contextlib
+import functools
+import inspect
+import threading
+
 from voltron.api import *
 from voltron.plugin import *
 
@@ -84,6 +89,193 @@ def lock_host(func, *args, **kwargs):
     return inner
 
 
+class ReadWriteLock(object):
+    """
+    A reentrant reader/writer lock.
+
+    Any number of threads can hold the lock for reading at the same time, or
+    one thread can hold it for writing. Writers take priority, so once a
+    writer is waiting new readers wait for it to finish.
+
+    A thread that holds the lock either way can acquire it again for
+    reading, and a writer can acquire it again for writing. Upgrading a read
+    lock to a write lock would deadlock with other readers doing the same,
+    so it raises a RuntimeError instead.
+    """
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = {}
+        self.writer = None
+        self.writes = 0
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.current_thread()
+        with self.cond:
+            if me not in self.readers and self.writer is not me:
+                while self.writer is not None or self.waiting_writers:
+                    self.cond.wait()
+            self.readers[me] = self.readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.current_thread()
+        with self.cond:
+            self.readers[me] -= 1
+            if not self.readers[me]:
+                del self.readers[me]
+                if not self.readers:
+                    self.cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.current_thread()
+        with self.cond:
+            if self.writer is not me:
+                if me in self.readers:
+                    raise RuntimeError("Can't upgrade a read lock to a write lock")
+                self.waiting_writers += 1
+                try:
+                    while self.writer is not None or self.readers:
+                        self.cond.wait()
+                finally:
+                    self.waiting_writers -= 1
+                self.writer = me
+            self.writes += 1
+
+    def release_write(self):
+        with self.cond:
+            self.writes -= 1
+            if not self.writes:
+                self.writer = None
+                self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def lock_host_read(func, *args, **kwargs):
+    """
+    A decorator for methods that read from a target. Takes the read side of
+    the adaptor's host lock and the target's lock, so reads from any number
+    of threads can run at the same time.
+
+    The target ID is the method's `target_id` argument, whether it's passed
+    by keyword or by position.
+    """
+    index = target_id_index(func)
+
+    @functools.wraps(func)
+    def inner(self, *args, **kwargs):
+        with self.rw_lock.reading():
+            with self.target_lock(get_target_id(index, args, kwargs)).reading():
+                return func(self, *args, **kwargs)
+    return inner
+
+
+def lock_target_write(func, *args, **kwargs):
+    """
+    A decorator for methods that modify a target (e.g. writing to its
+    memory). Takes the read side of the adaptor's host lock, and the write
+    side of the target's lock, so other targets can still be read. The
+    target ID is found as for `lock_host_read`.
+    """
+    index = target_id_index(func)
+
+    @functools.wraps(func)
+    def inner(self, *args, **kwargs):
+        with self.rw_lock.reading():
+            with self.target_lock(get_target_id(index, args, kwargs)).writing():
+                return func(self, *args, **kwargs)
+    return inner
+
+
+def lock_host_write(func, *args, **kwargs):
+    """
+    A decorator for methods that might change anything in the debugger
+    (e.g. executing a command). Takes the write side of the adaptor's host
+    lock, so nothing else can access the debugger until it's done.
+    """
+    @functools.wraps(func)
+    def inner(self, *args, **kwargs):
+        with self.rw_lock.writing():
+            return func(self, *args, **kwargs)
+    return inner
+
+
+def target_id_index(func):
+    """
+    Return the index of the `target_id` parameter of an adaptor method among
+    its positional arguments (not counting `self`), or None if it doesn't
+    have one.
+
+    Decorators between `func` and the method need to use functools.wraps,
+    so the method's signature can be found.
+    """
+    try:
+        params = list(inspect.signature(func).parameters)
+    except (TypeError, ValueError):
+        return None
+    return params.index('target_id') - 1 if 'target_id' in params else None
+
+
+def get_target_id(index, args, kwargs):
+    """
+    Return the `target_id` argument of a call to an adaptor method, whether
+    it was passed by keyword or by position, or 0 if it wasn't passed.
+
+    `index` is the parameter's index as returned by `target_id_index`.
+    """
+    if kwargs.get('target_id') is not None:
+        return kwargs['target_id']
+    if index is not None and index < len(args) and args[index] is not None:
+        return args[index]
+    return 0
+
+
+def cached_metadata(key):
+    """
+    A decorator that caches the result of an adaptor method that returns
+    metadata about the target (e.g. its architecture), until the adaptor's
+    metadata cache is invalidated by a debugger event. See
+    `DebuggerAdaptor.invalidate_metadata`.
+
+    Each method needs its own `key`. If the method has a `target_id`
+    parameter, the result is cached for each target. Its other arguments
+    aren't part of the cache key, so it should only be used on methods whose
+    result doesn't depend on them.
+    """
+    def decorator(func):
+        index = target_id_index(func)
+
+        @functools.wraps(func)
+        def inner(self, *args, **kwargs):
+            cache = self.metadata
+            k = key if index is None else (key, get_target_id(index, args, kwargs))
+            try:
+                return cache[k]
+            except KeyError:
+                pass
+
+            # if the cache is invalidated while we're getting the value, it may be stale, but it'll go into the old
+            # cache that's been thrown away
+            res = cache[k] = func(self, *args, **kwargs)
+            return res
+        return inner
+    return decorator
+
+
 class DebuggerAdaptor(object):
     """
     Base debugger adaptor class. Debugger adaptors implemented in plugins for
@@ -115,6 +307,9 @@ class DebuggerAdaptor(object):
 
     def __init__(self, *args, **kwargs):
         self.listeners = []
+        self.metadata = {}
+        self.rw_lock = ReadWriteLock()
+        self.target_locks = {}
 
     def target_exists(self, target_id=0):
         """
@@ -180,6 +375,26 @@ class DebuggerAdaptor(object):
         for listener in self.listeners:
             listener['callback']()
 
+    def target_lock(self, target_id=0):
+        """
+        Return the ReadWriteLock for a target. See `lock_host_read`.
+        """
+        try:
+            return self.target_locks[target_id]
+        except KeyError:
+            # setdefault so threads racing to create the lock all end up with the same one
+            return self.target_locks.setdefault(target_id, ReadWriteLock())
+
+    def invalidate_metadata(self):
+        """
+        Invalidate the cached target metadata (e.g. the target's state,
+        architecture and byte order).
+
+        Called by the debugger's event handlers when something happens that
+        might change it, e.g. the target stopping or a file being loaded.
+        """
+        self.metadata = {}
+
     def register_command_plugin(self, name, cls):
         pass
 
@@ -194,6 +409,19 @@ class DebuggerAdaptor(object):
         """
         return []
 
+    def run_batch(self, callables):
+        """
+        Run a sequence of adaptor operations and return a list of their
+        results, in the same order.
+
+        `callables` is a list of callables that take no arguments, each of
+        which may call any number of adaptor methods. Adaptors for hosts that
+        can only be queried from one thread (e.g. GDB) run the whole batch in
+        a single trip to that thread, rather than one for each method called.
+        If any of the operations raises an exception, it is raised here.
+        """
+        return [func() for func in callables]
+
     def pc(self, target_id=0, thread_id=None):
         return self.program_counter(target_id, thread_id)
 
@@ -244,7 +472,9 @@ class DebuggerCommand (object):
         elif 'init' in command:
             self.register_hooks()
         elif 'stopped' in command or 'update' in command:
+            voltron.server.advance_generation()
             self.adaptor.update_state()
+            voltron.server.state_changed('stopped', advance=False)
             voltron.server.dispatch_queue()
         else:
             print("Usage: voltron <init|debug|update>")
@@ -27,6 +27,7 @@ class PluginManager(object):
         self._view_plugins = defaultdict(lambda: None)
         self._web_plugins = defaultdict(lambda: None)
         self._command_plugins = defaultdict(lambda: None)
+        self._request_classes = {}
 
     def register_plugins(self):
         for p in voltron.env.plugins:
@@ -41,6 +42,14 @@ class PluginManager(object):
     def api_plugins(self):
         return self._api_plugins
 
+    @property
+    def request_classes(self):
+        """
+        A dictionary mapping request types to their request classes, so the
+        server can find the class for an incoming request with one lookup.
+        """
+        return self._request_classes
+
     @property
     def debugger_plugins(self):
         return self._debugger_plugins
@@ -71,6 +80,7 @@ class PluginManager(object):
         if self.valid_api_plugin(plugin):
             log.debug("Registering API plugin: {}".format(plugin))
             self._api_plugins[plugin.request] = plugin()
+            self._request_classes[plugin.request] = plugin.request_class
         elif self.valid_debugger_plugin(plugin):
             log.debug("Registering debugger plugin: {}".format(plugin))
             self._debugger_plugins[plugin.host] = plugin()
@@ -21,6 +21,8 @@ class APIBacktraceRequest(APIRequest):
         "request":      "backtrace"
     }
     """
+    read_only = True
+
     @server_side
     def dispatch(self):
         try:
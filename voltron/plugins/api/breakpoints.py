@@ -21,6 +21,8 @@ class APIBreakpointsRequest(APIRequest):
         "request":      "breakpoints"
     }
     """
+    read_only = True
+
     @server_side
     def dispatch(self):
         try:
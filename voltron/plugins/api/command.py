@@ -15,11 +15,24 @@ class APICommandRequest(APIRequest):
         "type":         "request",
         "request":      "command"
         "data": {
-            "command":  "break list"
+            "command":  "break list",
+            "invalidate": false
         }
     }
+
+    Command output is never cached. Running a command doesn't throw away
+    the server's cached responses either, as views run commands like `bt`
+    on every stop. Set `invalidate` if the command changes the state of the
+    debugger or the inferior (e.g. `set var`), so that later requests don't
+    get stale cached responses.
     """
-    _fields = {'command': True}
+    _fields = {'command': True, 'invalidate': False}
+
+    invalidate = False
+
+    @property
+    def invalidates_cache(self):
+        return bool(self.invalidate)
 
     @server_side
     def dispatch(self):
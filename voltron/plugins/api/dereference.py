@@ -21,6 +21,8 @@ class APIDerefRequest(APIRequest):
     """
     _fields = {'pointer': True}
 
+    read_only = True
+
     @server_side
     def dispatch(self):
         try:
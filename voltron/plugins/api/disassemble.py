@@ -34,6 +34,8 @@ class APIDisassembleRequest(APIRequest):
     address = None
     count = 16
 
+    read_only = True
+
     @server_side
     def dispatch(self):
         try:
@@ -52,59 +52,16 @@ class APIMemoryRequest(APIRequest):
 
     target_id = 0
 
+    @property
+    def read_only(self):
+        # the address can be calculated with an arbitrary debugger command, which might have side effects
+        return not self.command
+
     @server_side
     def dispatch(self):
         try:
-            target = voltron.debugger.target(self.target_id)
-
-            # if 'words' was specified, get the addr_size and calculate the length to read
-            if self.words:
-                self.length = self.words * target['addr_size']
-
-            # calculate the address at which to begin reading
-            if self.address:
-                addr = self.address
-            elif self.command:
-                output = voltron.debugger.command(self.command)
-                if output:
-                    for item in reversed(output.split()):
-                        log.debug("checking item: {}".format(item))
-                        try:
-                            addr = int(item)
-                            break
-                        except:
-                            try:
-                                addr = int(item, 16)
-                                break
-                            except:
-                                pass
-            elif self.register:
-                regs = voltron.debugger.registers(registers=[self.register])
-                addr = list(regs.values())[0]
-            if self.offset:
-                if self.words:
-                    addr += self.offset * target['addr_size']
-                else:
-                    addr += self.offset
-
-            # read memory
-            memory = voltron.debugger.memory(address=int(addr), length=int(self.length), target_id=int(self.target_id))
-
-            # deref pointers
-            deref = None
-            if self.deref:
-                fmt = ('<' if target['byte_order'] == 'little' else '>') + {2: 'H', 4: 'L', 8: 'Q'}[target['addr_size']]
-                deref = []
-                for chunk in zip(*[six.iterbytes(memory)] * target['addr_size']):
-                    chunk = ''.join([six.unichr(x) for x in chunk]).encode('latin1')
-                    p = list(struct.unpack(fmt, chunk))[0]
-                    if p > 0:
-                        try:
-                            deref.append(voltron.debugger.dereference(pointer=p))
-                        except:
-                            deref.append([])
-                    else:
-                        deref.append([])
+            # make all of the debugger calls in one batch, so hosts like GDB only switch threads once
+            addr, memory, deref = voltron.debugger.run_batch([self.read_memory])[0]
 
             res = APIMemoryResponse()
             res.address = addr
@@ -122,6 +79,66 @@ class APIMemoryRequest(APIRequest):
 
         return res
 
+    def read_memory(self):
+        """
+        Read the memory from the debugger, dereferencing any pointers in it
+        if requested.
+
+        Returns a tuple of (address, memory, deref).
+        """
+        target = voltron.debugger.target(self.target_id)
+
+        # if 'words' was specified, get the addr_size and calculate the length to read
+        if self.words:
+            self.length = self.words * target['addr_size']
+
+        # calculate the address at which to begin reading
+        if self.address:
+            addr = self.address
+        elif self.command:
+            output = voltron.debugger.command(self.command)
+            if output:
+                for item in reversed(output.split()):
+                    log.debug("checking item: {}".format(item))
+                    try:
+                        addr = int(item)
+                        break
+                    except:
+                        try:
+                            addr = int(item, 16)
+                            break
+                        except:
+                            pass
+        elif self.register:
+            regs = voltron.debugger.registers(registers=[self.register])
+            addr = list(regs.values())[0]
+        if self.offset:
+            if self.words:
+                addr += self.offset * target['addr_size']
+            else:
+                addr += self.offset
+
+        # read memory
+        memory = voltron.debugger.memory(address=int(addr), length=int(self.length), target_id=int(self.target_id))
+
+        # deref pointers
+        deref = None
+        if self.deref:
+            fmt = ('<' if target['byte_order'] == 'little' else '>') + {2: 'H', 4: 'L', 8: 'Q'}[target['addr_size']]
+            deref = []
+            for chunk in zip(*[six.iterbytes(memory)] * target['addr_size']):
+                chunk = ''.join([six.unichr(x) for x in chunk]).encode('latin1')
+                p = list(struct.unpack(fmt, chunk))[0]
+                if p > 0:
+                    try:
+                        deref.append(voltron.debugger.dereference(pointer=p))
+                    except:
+                        deref.append([])
+                else:
+                    deref.append([])
+
+        return addr, memory, deref
+
 
 class APIMemoryResponse(APISuccessResponse):
     """
@@ -32,24 +32,16 @@ class APIRegistersRequest(APIRequest):
     thread_id = None
     registers = []
 
+    read_only = True
+
     @server_side
     def dispatch(self):
         try:
-            regs = voltron.debugger.registers(target_id=self.target_id, thread_id=self.thread_id, registers=self.registers)
+            # make all of the debugger calls in one batch, so hosts like GDB only switch threads once
+            regs, deref = voltron.debugger.run_batch([self.read_registers])[0]
             res = APIRegistersResponse()
             res.registers = regs
-            res.deref = {}
-            for reg, val in regs.items():
-                try:
-                    if val > 0:
-                        try:
-                            res.deref[reg] = voltron.debugger.dereference(pointer=val)
-                        except:
-                            res.deref[reg] = []
-                    else:
-                        res.deref[reg] = []
-                except TypeError:
-                    res.deref[reg] = []
+            res.deref = deref
         except TargetBusyException:
             res = APITargetBusyErrorResponse()
         except NoSuchTargetException:
@@ -61,6 +53,27 @@ class APIRegistersRequest(APIRequest):
 
         return res
 
+    def read_registers(self):
+        """
+        Read the registers from the debugger and dereference their values.
+
+        Returns a tuple of (registers, deref).
+        """
+        regs = voltron.debugger.registers(target_id=self.target_id, thread_id=self.thread_id, registers=self.registers)
+        deref = {}
+        for reg, val in regs.items():
+            try:
+                if val > 0:
+                    try:
+                        deref[reg] = voltron.debugger.dereference(pointer=val)
+                    except:
+                        deref[reg] = []
+                else:
+                    deref[reg] = []
+            except TypeError:
+                deref[reg] = []
+        return regs, deref
+
 
 class APIRegistersResponse(APISuccessResponse):
     """
@@ -76,6 +89,8 @@ class APIRegistersResponse(APISuccessResponse):
     }
     """
     _fields = {'registers': True, 'deref': False}
+    # vector registers are wider than 64 bits
+    _wide_ints = True
 
 
 class APIRegistersPlugin(APIPlugin):
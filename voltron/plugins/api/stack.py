@@ -31,11 +31,13 @@ class APIStackRequest(APIRequest):
     thread_id = None
     length = None
 
+    read_only = True
+
     @server_side
     def dispatch(self):
         try:
-            sp_name, sp = voltron.debugger.stack_pointer(target_id=self.target_id)
-            memory = voltron.debugger.memory(address=sp, length=self.length, target_id=self.target_id)
+            # read the stack pointer and the memory it points to in one batch
+            sp, memory = voltron.debugger.run_batch([self.read_stack])[0]
             res = APIStackResponse()
             res.memory = memory
             res.stack_pointer = sp
@@ -50,6 +52,16 @@ class APIStackRequest(APIRequest):
 
         return res
 
+    def read_stack(self):
+        """
+        Read the stack pointer and the memory it points to.
+
+        Returns a tuple of (stack pointer, memory).
+        """
+        sp_name, sp = voltron.debugger.stack_pointer(target_id=self.target_id)
+        memory = voltron.debugger.memory(address=sp, length=self.length, target_id=self.target_id)
+        return sp, memory
+
 
 class APIStackResponse(APISuccessResponse):
     """
@@ -0,0 +1,54 @@
+import voltron
+import voltron.api
+from voltron.api import *
+
+from scruffy.plugin import Plugin
+
+
+class APIStatsRequest(APIRequest):
+    """
+    API server statistics request.
+
+    {
+        "type":         "request",
+        "request":      "stats"
+    }
+    """
+    @server_side
+    def dispatch(self):
+        res = APIStatsResponse()
+        res.stats = voltron.server.stats()
+        return res
+
+
+class APIStatsResponse(APISuccessResponse):
+    """
+    API server statistics response.
+
+    {
+        "type":         "response",
+        "status":       "success",
+        "data": {
+            "stats": {
+                "generation":   12,
+                "cache": {
+                    "entries":      3,
+                    "hits":         24,
+                    "misses":       6,
+                    "hit_ratio":    0.8
+                }
+            }
+        }
+    }
+    """
+    _fields = {
+        'stats': True
+    }
+
+    stats = None
+
+
+class APIStatsPlugin(APIPlugin):
+    request = 'stats'
+    request_class = APIStatsRequest
+    response_class = APIStatsResponse
@@ -18,6 +18,8 @@ class APITargetsRequest(APIRequest):
     """
     _fields = {}
 
+    read_only = True
+
     @server_side
     def dispatch(self):
         try:
@@ -38,6 +38,8 @@ class APIWriteMemoryRequest(APIRequest):
 
     target_id = 0
 
+    invalidates_cache = True
+
     @server_side
     def dispatch(self):
         try:
@@ -1,5 +1,7 @@
 from __future__ import print_function
 
+import binascii
+import functools
 import logging
 import threading
 import re
@@ -20,13 +22,20 @@ log = logging.getLogger('debugger')
 
 if HAVE_GDB:
 
+    # GDB loads voltron on its main thread
+    main_thread = threading.current_thread()
+
     def post_event(func):
         """
         Decorator to wrap a GDB adaptor method in a mechanism to run the method
         on the main thread at the next possible time.
+
+        If we're already on the main thread (e.g. dispatching queued requests
+        from a stop handler or a posted event) the method is just called.
         """
+        @functools.wraps(func)
         def inner(self, *args, **kwargs):
-            if self.use_post_event:
+            if self.use_post_event and threading.current_thread() is not main_thread:
                 # create ephemeral queue
                 q = Queue()
 
@@ -72,8 +81,37 @@ if HAVE_GDB:
             'arm': 4,
             'powerpc': 4,
         }
+        # the registers to read for each architecture, by group
+        register_groups = {
+            'x86_64': {
+                'general': ['rax', 'rbx', 'rcx', 'rdx', 'rbp', 'rsp', 'rdi', 'rsi', 'rip', 'r8', 'r9', 'r10', 'r11',
+                            'r12', 'r13', 'r14', 'r15', 'cs', 'ds', 'es', 'fs', 'gs', 'ss', 'rflags'],
+                'sse': ['xmm{}'.format(i) for i in range(16)],
+                'fpu': ['st{}'.format(i) for i in range(8)],
+            },
+            'x86': {
+                'general': ['eax', 'ebx', 'ecx', 'edx', 'ebp', 'esp', 'edi', 'esi', 'eip', 'cs', 'ds', 'es', 'fs', 'gs',
+                            'ss', 'eflags'],
+                'sse': ['xmm{}'.format(i) for i in range(8)],
+                'fpu': ['st{}'.format(i) for i in range(8)],
+            },
+            'arm': {
+                'general': ['pc', 'sp', 'lr', 'cpsr', 'r0', 'r1', 'r2', 'r3', 'r4', 'r5', 'r6', 'r7', 'r8', 'r9', 'r10',
+                            'r11', 'r12'],
+            },
+            'powerpc': {
+                'general': ['pc', 'msr', 'cr', 'lr', 'ctr'] + ['r{}'.format(i) for i in range(32)],
+            },
+        }
+        # registers we report under a different name to GDB's
+        register_aliases = {'rflags': 'eflags'}
         max_frame = 64
         max_string = 128
+        # minimum number of characters for memory to be treated as a UTF-16 string
+        min_unicode = 4
+        page_size = 4096
+        ascii_re = re.compile(b'[\x01-\x7f]*')
+        utf16_re = re.compile(b'(?:[\x01-\x7f]\x00)*')
         use_post_event = True
 
         """
@@ -84,6 +122,8 @@ if HAVE_GDB:
             self.host_lock = threading.RLock()
             self.host = gdb
             self.busy = False
+            self.descriptors = {}
+            self.metadata = {}
 
         def target_is_busy(self, target_id=0):
             """
@@ -94,6 +134,17 @@ if HAVE_GDB:
             """
             return self.busy
 
+        @post_event
+        def run_batch(self, callables):
+            """
+            Run a sequence of adaptor operations in a single posted event.
+
+            The adaptor methods they call are already on the main thread, so
+            they're called directly rather than each posting an event of its
+            own. See `DebuggerAdaptor.run_batch`.
+            """
+            return super(GDBAdaptor, self).run_batch(callables)
+
         @post_event
         def version(self):
             """
@@ -109,6 +160,7 @@ if HAVE_GDB:
                 version = None
             return version
 
+        @cached_metadata('_target')
         def _target(self, target_id=0):
             """
             Return information about the specified target.
@@ -148,6 +200,7 @@ if HAVE_GDB:
 
             return d
 
+        @cached_metadata('target')
         @post_event
         def target(self, target_id=0):
             """
@@ -202,21 +255,10 @@ if HAVE_GDB:
 
             # get registers
             if registers != []:
-                regs = {}
-                for reg in registers:
-                    regs[reg] = self.get_register(reg)
+                regs = self.read_registers(names=registers)
             else:
                 log.debug('Getting registers for arch {}'.format(arch))
-                if arch == "x86_64":
-                    regs = self.get_registers_x86_64()
-                elif arch == "x86":
-                    regs = self.get_registers_x86()
-                elif arch == "arm":
-                    regs = self.get_registers_arm()
-                elif arch == "powerpc":
-                    regs = self.get_registers_powerpc()
-                else:
-                    raise UnknownArchitectureException()
+                regs = self.read_registers()
 
             return regs
 
@@ -345,18 +387,9 @@ if HAVE_GDB:
                         log.debug("symbol context: {}".format(str(chain[-1])))
                     else:
                         log.debug("no symbol context, trying as a string")
-                        mem = gdb.selected_inferior().read_memory(addr, 2)
-                        if ord(mem[0]) <= 127 and ord(mem[0]) != 0:
-                            a = []
-                            for i in range(0, self.max_string):
-                                mem = gdb.selected_inferior().read_memory(addr + i, 1)
-                                if ord(mem[0]) == 0 or ord(mem[0]) > 127:
-                                    break
-                                if isinstance(mem, memoryview):
-                                    a.append(mem.tobytes().decode('latin1'))
-                                else:
-                                    a.append(str(mem))
-                            chain.append(('string', ''.join(a)))
+                        string = self.read_string(addr)
+                        if string:
+                            chain.append(string)
 
                 log.debug("chain: {}".format(chain))
             else:
@@ -364,6 +397,46 @@ if HAVE_GDB:
 
             return chain
 
+        def read_string(self, addr):
+            """
+            Probe the memory at `addr` for a string.
+
+            The memory is read in one block, which stops at the end of the
+            page so a string just before an unmapped page can still be read.
+            The next page is only read if the string runs to the end of the
+            block. The block is scanned for ASCII, then UTF-16 (ASCII with a
+            NUL after each character) if that doesn't look like a string.
+
+            Returns a ('string', ...) or ('unicode', ...) tuple, or None if
+            the memory doesn't hold a string.
+            """
+            wanted = self.max_string * 2
+            length = min(wanted, self.page_size - addr % self.page_size)
+            inferior = gdb.selected_inferior()
+            try:
+                mem = bytearray(inferior.read_memory(addr, length))
+            except gdb.MemoryError:
+                return None
+
+            def scan():
+                # the lengths of the ASCII and UTF-16 strings at the start of the block
+                return (len(self.ascii_re.match(mem).group(0)),
+                        len(self.utf16_re.match(mem).group(0)))
+
+            n_ascii, n_utf16 = scan()
+            if length < wanted and length in (n_ascii, n_utf16):
+                try:
+                    mem += bytearray(inferior.read_memory(addr + length, wanted - length))
+                    n_ascii, n_utf16 = scan()
+                except gdb.MemoryError:
+                    pass
+
+            if n_ascii == 0:
+                return None
+            if n_ascii == 1 and n_utf16 >= self.min_unicode * 2:
+                return ('unicode', bytes(mem[:n_utf16:2]).decode('latin1'))
+            return ('string', bytes(mem[:min(n_ascii, self.max_string)]).decode('latin1'))
+
         @post_event
         def command(self, command=None):
             """
@@ -378,6 +451,7 @@ if HAVE_GDB:
 
             return res
 
+        @cached_metadata('flavor')
         @post_event
         def disassembly_flavor(self):
             """
@@ -471,6 +545,7 @@ if HAVE_GDB:
         # Private functions
         #
 
+        @cached_metadata('state')
         def _state(self):
             """
             Get the state of a given target. Internal use.
@@ -493,157 +568,96 @@ if HAVE_GDB:
             return state
 
         def get_register(self, reg_name):
-            arch = self.get_arch()
+            """
+            Read a single register from the selected frame, see
+            `read_registers`.
+            """
+            val = self.read_registers(names=[reg_name])[reg_name]
+            if val == 'N/A':
+                raise gdb.error('Failed getting reg: ' + reg_name)
+            return val
 
-            if arch == "x86_64":
-                reg = self.get_register_x86_64(reg_name)
-            elif arch == "x86":
-                reg = self.get_register_x86(reg_name)
-            elif arch == "arm":
-                reg = self.get_register_arm(reg_name)
-            elif arch == "powerpc":
-                reg = self.get_register_powerpc(reg_name)
-            else:
-                raise UnknownArchitectureException()
+        def read_registers(self, names=None):
+            """
+            Read registers from the selected frame in a single pass.
 
-            return reg
+            `names` is a list of the registers to read. If it's None, all the
+            registers in the architecture's `register_groups` are read.
 
-        def get_registers_x86_64(self):
-            # Get regular registers
-            regs = ['rax','rbx','rcx','rdx','rbp','rsp','rdi','rsi','rip','r8','r9','r10','r11','r12','r13','r14','r15',
-                    'cs','ds','es','fs','gs','ss']
+            Returns a dictionary of register values. Registers that couldn't
+            be read are 'N/A'.
+            """
+            arch = self.get_arch()
+            if arch not in self.register_groups:
+                raise UnknownArchitectureException()
+            table = self.register_groups[arch]
+            if names is None:
+                names = [reg for group in table for reg in table[group]]
+
+            frame = gdb.selected_frame()
+            descriptors = self.register_descriptors(frame)
+            mask = (1 << (self.sizes[arch] * 8)) - 1
+            little = None
             vals = {}
-            for reg in regs:
+            for name in names:
+                gdb_name = self.register_aliases.get(name, name)
                 try:
-                    vals[reg] = self.get_register_x86_64(reg)
-                except:
-                    log.debug('Failed getting reg: ' + reg)
-                    vals[reg] = 'N/A'
-
-            # Get flags
-            try:
-                vals['rflags'] = int(gdb.execute('info reg $eflags', to_string=True).split()[1], 16)
-            except:
-                log.debug('Failed getting reg: eflags')
-                vals['rflags'] = 'N/A'
-
-            # Get SSE registers
-            try:
-                sse = self.get_registers_sse(16)
-                vals = dict(list(vals.items()) + list(sse.items()))
-            except gdb.error:
-                log.exception("Failed to get SSE registers")
-
-            # Get FPU registers
-            try:
-                fpu = self.get_registers_fpu()
-                vals = dict(list(vals.items()) + list(fpu.items()))
-            except gdb.error:
-                log.exception("Failed to get FPU registers")
+                    value = frame.read_register(descriptors.get(gdb_name, gdb_name) if descriptors else gdb_name)
+                    if value.type.strip_typedefs().code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_PTR, gdb.TYPE_CODE_FLAGS,
+                                                            gdb.TYPE_CODE_ENUM, gdb.TYPE_CODE_BOOL):
+                        vals[name] = int(value) & mask
+                    else:
+                        # vector and floating point registers are reported as the integer value of their raw bytes
+                        if little is None:
+                            little = self.get_byte_order() == 'little'
+                        vals[name] = self.decode_register(gdb_name, value, little)
+                except (gdb.error, ValueError, TypeError):
+                    log.debug('Failed getting reg: ' + name)
+                    vals[name] = 'N/A'
 
             return vals
 
-        def get_register_x86_64(self, reg):
-            return int(gdb.parse_and_eval('(long long)$'+reg)) & 0xFFFFFFFFFFFFFFFF
+        def register_descriptors(self, frame):
+            """
+            Return a dictionary mapping the names of the registers the frame's
+            architecture has to their descriptors, which `read_register` looks
+            up faster than names.
 
-        def get_registers_x86(self):
-            # Get regular registers
-            regs = ['eax','ebx','ecx','edx','ebp','esp','edi','esi','eip','cs','ds','es','fs','gs','ss']
-            vals = {}
-            for reg in regs:
+            The registers are enumerated once for each architecture. GDB
+            versions without `Architecture.registers()` get None, and register
+            names are passed to `read_register` as they are.
+            """
+            arch = frame.architecture()
+            name = arch.name()
+            if name not in self.descriptors:
                 try:
-                    vals[reg] = self.get_register_x86(reg)
-                except:
-                    log.debug('Failed getting reg: ' + reg)
-                    vals[reg] = 'N/A'
+                    self.descriptors[name] = dict((r.name, r) for r in arch.registers())
+                except AttributeError:
+                    self.descriptors[name] = None
+            return self.descriptors[name]
 
-            # Get flags
-            try:
-                vals['eflags'] = int(gdb.execute('info reg $eflags', to_string=True).split()[1], 16)
-            except:
-                log.debug('Failed getting reg: eflags')
-                vals['eflags'] = 'N/A'
-
-            # Get SSE registers
-            try:
-                sse = self.get_registers_sse(8)
-                vals = dict(list(vals.items()) + list(sse.items()))
-            except gdb.error:
-                log.exception("Failed to get SSE registers")
+        def decode_register(self, name, value, little=True):
+            """
+            Return the integer value of a register's raw bytes.
 
-            # Get FPU registers
+            `Value.bytes` is only available in newer versions of GDB. Older
+            versions fall back to the integer view of the vector registers, or
+            the raw value shown by `info reg` for the FPU registers.
+            """
             try:
-                fpu = self.get_registers_fpu()
-                vals = dict(list(vals.items()) + list(fpu.items()))
-            except gdb.error:
-                log.exception("Failed to get SSE registers")
-
-            return vals
-
-        def get_register_x86(self, reg):
-            log.debug('Getting register: ' + reg)
-            return int(gdb.parse_and_eval('(long)$'+reg)) & 0xFFFFFFFF
-
-        def get_registers_sse(self, num=8):
-            # the old way of doing this randomly crashed gdb or threw a python exception
-            regs = {}
-            for line in gdb.execute('info all-registers', to_string=True).split('\n'):
-                m = re.match('^([xyz]mm\d+)\s.*uint128 = (0x[0-9a-f]+)\}', line)
-                if m:
-                    regs[m.group(1)] = int(m.group(2), 16)
-            return regs
-
-        def get_registers_fpu(self):
-            regs = {}
-            for i in range(8):
-                reg = 'st'+str(i)
-                try:
-                    regs[reg] = int(gdb.execute('info reg '+reg, to_string=True).split()[-1][2:-1], 16)
-                except:
-                    log.debug('Failed getting reg: ' + reg)
-                    regs[reg] = 'N/A'
-            return regs
-
-        def get_registers_arm(self):
-            log.debug('Getting registers')
-            regs = ['pc','sp','lr','cpsr','r0','r1','r2','r3','r4','r5','r6', 'r7','r8','r9','r10','r11','r12']
-            vals = {}
-            for reg in regs:
-                try:
-                    vals[reg] = self.get_register_arm(reg)
-                except:
-                    log.debug('Failed getting reg: ' + reg)
-                    vals[reg] = 'N/A'
-            return vals
-
-        def get_register_arm(self, reg):
-            log.debug('Getting register: ' + reg)
-            return int(gdb.parse_and_eval('(long)$'+reg)) & 0xFFFFFFFF
-
-        def get_registers_powerpc(self):
-            log.debug('Getting registers')
-            # TODO This could ideally pull from a single definition for the arch
-            regs = ['pc','msr','cr','lr', 'ctr',
-                    'r0','r1','r2','r3','r4','r5','r6', 'r7',
-                    'r8','r9','r10','r11','r12','r13','r14', 'r15',
-                    'r16','r17','r18','r19','r20','r21','r22', 'r23',
-                    'r24','r25','r26','r27','r28','r29','r30', 'r31']
-            vals = {}
-            for reg in regs:
-                try:
-                    vals[reg] = self.get_register_powerpc(reg)
-                except:
-                    log.debug('Failed getting reg: ' + reg)
-                    vals[reg] = 'N/A'
-            return vals
-
-        def get_register_powerpc(self, reg):
-            log.debug('Getting register: ' + reg)
-            return int(gdb.parse_and_eval('(long)$'+reg)) & 0xFFFFFFFF
+                raw = bytearray(value.bytes)
+            except AttributeError:
+                if value.type.strip_typedefs().code == gdb.TYPE_CODE_FLT:
+                    return int(gdb.execute('info reg ' + name, to_string=True).split()[-1][2:-1], 16)
+                return int(value['uint128'])
+            if little:
+                raw.reverse()
+            return int(binascii.hexlify(raw), 16)
 
         def get_next_instruction(self):
             return self.get_disasm().split('\n')[0].split(':')[1].strip()
 
+        @cached_metadata('arch')
         def get_arch(self):
             try:
                 arch = gdb.selected_frame().architecture().name()
@@ -656,6 +670,7 @@ if HAVE_GDB:
 
             return self.sizes[arch]
 
+        @cached_metadata('byte_order')
         def get_byte_order(self):
             return 'little' if 'little' in gdb.execute('show endian', to_string=True) else 'big'
 
@@ -668,16 +683,27 @@ if HAVE_GDB:
             super(GDBCommand, self).__init__("voltron", gdb.COMMAND_NONE, gdb.COMPLETE_NONE)
             self.adaptor = voltron.debugger
             self.registered = False
+            self.dispatch_posted = False
+            budget = voltron.config.server.dispatch_budget
+            self.dispatch_budget = float(budget) if budget else None
             self.register_hooks()
 
         def invoke(self, arg, from_tty):
             self.handle_command(arg)
 
+        # events after which the adaptor's cached target metadata may be stale. before_prompt covers settings
+        # (e.g. `set disassembly-flavor`) and inferior selection, which don't have events of their own. Older
+        # versions of GDB don't have all of these.
+        metadata_events = ['new_objfile', 'clear_objfiles', 'new_inferior', 'inferior_deleted', 'before_prompt']
+
         def register_hooks(self):
             if not self.registered:
                 gdb.events.stop.connect(self.stop_handler)
                 gdb.events.exited.connect(self.stop_and_exit_handler)
                 gdb.events.cont.connect(self.cont_handler)
+                for name in self.metadata_events:
+                    if hasattr(gdb.events, name):
+                        getattr(gdb.events, name).connect(self.metadata_handler)
                 self.registered = True
 
         def unregister_hooks(self):
@@ -685,17 +711,46 @@ if HAVE_GDB:
                 gdb.events.stop.disconnect(self.stop_handler)
                 gdb.events.exited.disconnect(self.stop_and_exit_handler)
                 gdb.events.cont.disconnect(self.cont_handler)
+                for name in self.metadata_events:
+                    if hasattr(gdb.events, name):
+                        getattr(gdb.events, name).disconnect(self.metadata_handler)
                 self.registered = False
 
+        def metadata_handler(self, *args):
+            self.adaptor.invalidate_metadata()
+
         def stop_handler(self, event):
-            self.adaptor.update_state()
+            self.adaptor.invalidate_metadata()
+            voltron.server.advance_generation()
+            # clients send requests as soon as they hear about the stop, so the adaptor has to be ready for them
+            # before the event is published
             voltron.debugger.busy = False
-            voltron.server.dispatch_queue()
+            self.adaptor.update_state()
+            voltron.server.state_changed('stopped', advance=False)
+            if voltron.server.dispatch_queue(self.dispatch_budget):
+                self.post_dispatch()
             log.debug('Inferior stopped')
 
+        def post_dispatch(self):
+            """
+            Schedule another slice of queued requests to be dispatched from
+            GDB's event loop, once it's had a chance to handle user input.
+            """
+            if not self.dispatch_posted:
+                self.dispatch_posted = True
+                gdb.post_event(self.dispatch_slice)
+
+        def dispatch_slice(self):
+            self.dispatch_posted = False
+            # if the inferior has been continued, whatever's left will be dispatched at the next stop
+            if not voltron.debugger.busy and voltron.server.dispatch_pending(self.dispatch_budget):
+                self.post_dispatch()
+
         def exit_handler(self, event):
             log.debug('Inferior exited')
+            self.adaptor.invalidate_metadata()
             voltron.debugger.busy = False
+            voltron.server.state_changed('exited')
 
         def stop_and_exit_handler(self, event):
             log.debug('Inferior stopped and exited')
@@ -705,7 +760,9 @@ if HAVE_GDB:
 
         def cont_handler(self, event):
             log.debug('Inferior continued')
+            self.adaptor.invalidate_metadata()
             voltron.debugger.busy = True
+            voltron.server.state_changed('continued')
 
 
     class GDBAdaptorPlugin(DebuggerAdaptorPlugin):
@@ -10,10 +10,13 @@ from voltron.api import NoSuchThreadException
 from voltron.colour import uncolour
 from voltron.plugin import voltron
 from voltron.dbg import (
-    lock_host,
+    lock_host_read,
+    lock_host_write,
+    lock_target_write,
     validate_target,
     validate_busy,
     DebuggerAdaptor,
+    ReadWriteLock,
     InvalidPointerError,
     DebuggerCommand,
     DebuggerAdaptorPlugin
@@ -39,6 +42,12 @@ if HAVE_LLDB:
         def __init__(self, host=None):
             self.listeners = []
             self.host_lock = threading.RLock()
+            self.metadata = {}
+            # reads can run concurrently, see `lock_host_read`
+            self.rw_lock = ReadWriteLock()
+            self.target_locks = {}
+            # LLDB's command interpreter can only run one command at a time, even for reads
+            self.interpreter_lock = threading.RLock()
             if host:
                 log.debug("Passed a debugger host")
                 self.host = host
@@ -115,14 +124,14 @@ if HAVE_LLDB:
 
             return d
 
-        @lock_host
+        @lock_host_read
         def target(self, target_id=0):
             """
             Return information about the specified target.
             """
             return self._target(target_id=target_id)
 
-        @lock_host
+        @lock_host_read
         def targets(self, target_ids=None):
             """
             Return information about the debugger's current targets.
@@ -155,7 +164,7 @@ if HAVE_LLDB:
             return targets
 
         @validate_target
-        @lock_host
+        @lock_host_read
         def state(self, target_id=0):
             """
             Get the state of a given target.
@@ -169,7 +178,7 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def registers(self, target_id=0, thread_id=None, registers=[]):
             """
             Get the register values for a given target/thread.
@@ -232,7 +241,7 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def stack_pointer(self, target_id=0, thread_id=None):
             """
             Get the value of the stack pointer register.
@@ -255,7 +264,7 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def program_counter(self, target_id=0, thread_id=None):
             """
             Get the value of the program counter register.
@@ -278,7 +287,7 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def memory(self, address, length, target_id=0):
             """
             Get the register values for .
@@ -303,7 +312,28 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_target_write
+        def write_memory(self, address, data, target_id=0):
+            """
+            Write to the inferior's memory.
+
+            `address` is the address at which to start write
+            `data` is the data to write
+            `target_id` is a target ID (or None for the first target)
+            """
+            target = self.host.GetTargetAtIndex(target_id)
+
+            log.debug('Writing 0x{:x} bytes of memory at 0x{:x}'.format(len(data), address))
+
+            error = lldb.SBError()
+            target.process.WriteMemory(address, data, error)
+
+            if not error.Success():
+                raise Exception("Failed writing memory: {}".format(error.GetCString()))
+
+        @validate_busy
+        @validate_target
+        @lock_host_read
         def stack(self, length, target_id=0, thread_id=None):
             """
             Get the register values for .
@@ -322,7 +352,7 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def disassemble(self, target_id=0, address=None, count=None):
             """
             Get a disassembly of the instructions at the given address.
@@ -335,15 +365,15 @@ if HAVE_LLDB:
             if address is None:
                 pc_name, address = self.program_counter(target_id=target_id)
 
-            # disassemble
-            output = self.command('disassemble -s {} -c {}'.format(address, count))
+            # disassemble, this doesn't change anything so it doesn't need the write lock `command` takes
+            output = self._command('disassemble -s {} -c {}'.format(address, count))
             output = uncolour(output)
 
             return output
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def dereference(self, pointer, target_id=0):
             """
             Recursively dereference a pointer for display
@@ -393,18 +423,26 @@ if HAVE_LLDB:
 
             return chain
 
-        @lock_host
+        @lock_host_write
         def command(self, command=None):
             """
             Execute a command in the debugger.
 
             `command` is the command string to execute.
             """
+            return self._command(command)
+
+        def _command(self, command=None):
+            """
+            Implementation of executing a command, for methods that run
+            commands which only read from the debugger.
+            """
             # for some reason this doesn't work - figure it out
             if command:
                 res = lldb.SBCommandReturnObject()
                 ci = self.host.GetCommandInterpreter()
-                ci.HandleCommand(str(command), res, False)
+                with self.interpreter_lock:
+                    ci.HandleCommand(str(command), res, False)
                 if res.Succeeded():
                     output = res.GetOutput()
                     return output.strip() if output else ""
@@ -413,7 +451,7 @@ if HAVE_LLDB:
             else:
                 raise Exception("No command specified")
 
-        @lock_host
+        @lock_host_read
         def disassembly_flavor(self):
             """
             Return the disassembly flavor setting for the debugger.
@@ -422,7 +460,8 @@ if HAVE_LLDB:
             """
             res = lldb.SBCommandReturnObject()
             ci = self.host.GetCommandInterpreter()
-            ci.HandleCommand('settings show target.x86-disassembly-flavor', res)
+            with self.interpreter_lock:
+                ci.HandleCommand('settings show target.x86-disassembly-flavor', res)
             if res.Succeeded():
                 output = res.GetOutput().strip()
                 flavor = output.split()[-1]
@@ -435,7 +474,7 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def breakpoints(self, target_id=0):
             """
             Return a list of breakpoints.
@@ -486,7 +525,7 @@ if HAVE_LLDB:
 
         @validate_busy
         @validate_target
-        @lock_host
+        @lock_host_read
         def backtrace(self, target_id=0, thread_id=None):
             """
             Return a list of stack frames.
@@ -6,6 +6,8 @@ import pygments.formatters
 
 
 class DisasmView(TerminalView):
+    priority = 10
+
     @classmethod
     def configure_subparser(cls, subparsers):
         sp = subparsers.add_parser('disasm', help='disassembly view', aliases=('d', 'dis'))
@@ -14,6 +14,7 @@ class MemoryView(TerminalView):
     printable_filter = ''.join([(len(repr(chr(x))) == 3) and chr(x) or '.' for x in range(256)])
 
     asynchronous = True
+    priority = 10
     last_memory = None
     last_address = 0
 
@@ -83,6 +84,8 @@ class MemoryView(TerminalView):
 
         if m_res and m_res.is_success:
             bytes_per_chunk = self.args.words*target['addr_size'] if self.args.words else self.args.bytes
+            # don't consume the response's deref list, the same response may be rendered again
+            derefs = iter(m_res.deref or [])
             for c in range(0, m_res.bytes, bytes_per_chunk):
                 chunk = m_res.memory[c:c + bytes_per_chunk]
                 yield (Name.Label, self.format_address(m_res.address + c, size=target['addr_size'], pad=False))
@@ -123,7 +126,7 @@ class MemoryView(TerminalView):
 
                 # Deref chain
                 if self.args.deref:
-                    chain = m_res.deref.pop(0)
+                    chain = next(derefs, [])
                     for i, (t, item) in enumerate(chain):
                         if t == "pointer":
                             yield (Number.Hex, self.format_address(item, size=target['addr_size'], pad=False))
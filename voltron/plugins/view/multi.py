@@ -0,0 +1,163 @@
+import argparse
+import copy
+import logging
+import os
+import shlex
+import subprocess
+
+from scruffy import ConfigNode
+
+import voltron
+from voltron.view import *
+from voltron.plugin import *
+from voltron.api import *
+
+log = logging.getLogger('view')
+
+
+class MultiView (VoltronView):
+    """
+    Runs several views in one process.
+
+    The views share a single client, so there's one connection to the server
+    and one subscription to its events rather than one for each view. Each
+    time the debugger stops, the views' requests are merged into a single
+    batch with duplicates (e.g. several views asking for the registers)
+    removed, and each view is handed its slice of the responses.
+
+    The first view is rendered in this terminal. Each of the others gets a
+    new tmux pane, which is just used as a terminal to render to.
+
+        voltron view multi register disasm 'memory --register sp'
+    """
+    @classmethod
+    def configure_subparser(cls, subparsers):
+        sp = subparsers.add_parser('multi', aliases=('mu',), help='run several views in one process using tmux panes')
+        VoltronView.add_generic_arguments(sp)
+        sp.add_argument('views', nargs='+', metavar='view',
+                        help='a view and its arguments, e.g. "memory --register sp"')
+        sp.add_argument('--layout', '-l', action='store', default=None,
+                        help='tmux layout to apply once the panes are created (e.g. "tiled")')
+        sp.set_defaults(func=MultiView)
+
+    def setup(self):
+        self.views = []
+        self.panes = []
+        self.slices = []
+        if len(self.args.views) > 1 and not os.environ.get('TMUX'):
+            raise Exception("The multi view must be run inside tmux")
+
+        # parse each view's arguments as if it had been run by itself
+        parser = argparse.ArgumentParser(prog='voltron view multi')
+        parser.register('action', 'parsers', AliasedSubParsersAction)
+        sp = parser.add_subparsers(title='views', dest='view')
+        sp.required = True
+        for name in voltron.plugin.pm.view_plugins:
+            view_class = voltron.plugin.pm.view_plugins[name].view_class
+            if view_class is not MultiView:
+                view_class.configure_subparser(sp)
+
+        for i, spec in enumerate(self.args.views):
+            args = parser.parse_args(shlex.split(spec))
+            out = self.open_pane() if i > 0 else None
+
+            # views update their config in place, so they each need their own copy
+            config = ConfigNode(data=copy.deepcopy(self.loaded_config._get_value()))
+            view = args.func(args, loaded_config=config, out=out)
+            view.client = self.client
+            view.exit = self.exit
+            self.views.append(view)
+
+        if self.args.layout:
+            subprocess.check_call(['tmux', 'select-layout', self.args.layout])
+
+    def open_pane(self):
+        """
+        Create a tmux pane and return its terminal, opened for writing.
+
+        The pane just runs `cat`, which swallows anything typed into it.
+        """
+        out = subprocess.check_output(['tmux', 'split-window', '-d', '-P', '-F', '#{pane_id} #{pane_tty}',
+                                       'cat >/dev/null'])
+        pane, tty = out.decode('UTF-8').split()
+        self.panes.append(pane)
+        return open(tty, 'w')
+
+    def build_requests(self):
+        """
+        Build the merged set of requests for all the views.
+        """
+        reqs = []
+        indexes = {}
+        slices = []
+        for view in self.views:
+            s = []
+            for req in view.build_requests():
+                if req.priority is None:
+                    req.priority = view.priority
+                key = req.key()
+                if key in indexes:
+                    # another view already asked for this, dispatch it at the highest priority either of them wants
+                    other = reqs[indexes[key]]
+                    if (req.priority or 0) > (other.priority or 0):
+                        other.priority = req.priority
+                else:
+                    indexes[key] = len(reqs)
+                    reqs.append(req)
+                s.append(indexes[key])
+            slices.append(s)
+        self.slices = slices
+        return reqs
+
+    def render(self, results=[], error=None):
+        given = set()
+        for view, s in zip(self.views, self.slices):
+            if error:
+                view.do_render(error=error)
+            else:
+                # views can modify the responses they're given, so views after the first to get one get a copy
+                res = [results[i].copy() if i in given else results[i] for i in s]
+                given.update(s)
+                if len(res) and not res[0].timed_out:
+                    view.render(res)
+
+    def sigwinch_handler(self, sig, stack):
+        for view in self.views:
+            view.do_render()
+
+    def run(self):
+        """
+        Run the views, and handle keypresses in this terminal for the first
+        view.
+        """
+        self.client.start(self.build_requests, self.render)
+        view = self.views[0]
+        try:
+            with view.t.cbreak():
+                while True:
+                    val = view.t.inkey(timeout=1)
+                    if val:
+                        view.handle_key(val)
+        except KeyboardInterrupt:
+            self.exit()
+
+    def cleanup(self):
+        for view in self.views:
+            view.cleanup()
+        for pane in self.panes:
+            try:
+                subprocess.call(['tmux', 'kill-pane', '-t', pane])
+            except OSError:
+                pass
+        self.panes = []
+
+    def exit(self):
+        self.cleanup()
+        os._exit(0)
+
+
+class MultiViewPlugin(ViewPlugin):
+    plugin_type = 'view'
+    name = 'multi'
+    aliases = ('mu',)
+    view_class = MultiView
@@ -14,6 +14,8 @@ log = logging.getLogger("view")
 
 
 class RegisterView (TerminalView):
+    priority = 10
+
     FORMAT_INFO = {
         'x86_64': [
             {
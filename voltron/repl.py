@@ -1,12 +1,121 @@
+import struct
+import threading
+import six
+
 from .core import Client
+from .api import cast_b
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class REPLClient(Client):
     """
     A Voltron client for use in the Python REPL (e.g. Calculon).
+
+    In snapshot mode, all the registers are fetched in one request the first
+    time one is accessed after the debugger stops, and memory is read through
+    a page cache, so scripts that loop over registers or walk memory don't
+    make a request for every access. The client follows the server's events
+    to find out when the debugger stops.
     """
+    def __init__(self, *args, **kwargs):
+        self.snapshot = False
+        self.snapshot_registers = None
+        self.snapshot_thread = None
+        self.snapshot_ready = threading.Event()
+        super(REPLClient, self).__init__(*args, **kwargs)
+        # outside snapshot mode we don't know when the debugger stops, so memory can't be cached
+        self.cache_memory = False
+
+    def snapshot_mode(self, enabled=True):
+        """
+        Turn snapshot mode on or off.
+        """
+        self.snapshot = enabled
+        self.cache_memory = enabled
+        self.refresh()
+        if enabled and not (self.snapshot_thread and self.snapshot_thread.is_alive()):
+            self.snapshot_ready.clear()
+            self.snapshot_thread = threading.Thread(target=self.follow_events)
+            self.snapshot_thread.daemon = True
+            self.snapshot_thread.start()
+            # wait for the first event to tell us the current generation
+            self.snapshot_ready.wait(5)
+
+    def follow_events(self):
+        # `events` keeps self.generation up to date
+        try:
+            for event in self.events():
+                self.snapshot_ready.set()
+                if not self.snapshot:
+                    break
+        except Exception:
+            # without events, snapshots last until they're refreshed
+            self.generation = None
+        self.snapshot_ready.set()
+
+    def refresh(self):
+        """
+        Throw away the snapshot, so registers and memory are read again.
+        """
+        self.snapshot_registers = None
+        self.pages.invalidate()
+
+    def registers(self):
+        """
+        Return all the registers, from the snapshot if it's current.
+        """
+        generation = self.generation
+        if not self.snapshot_registers or self.snapshot_registers[0] != generation:
+            res = self.perform_request('registers')
+            if not res.is_success:
+                print("Error getting registers: {}".format(res.message))
+                return {}
+            self.snapshot_registers = (generation, res.registers)
+        return self.snapshot_registers[1]
+
+    def read(self, address, length):
+        """
+        Read memory, through the page cache in snapshot mode.
+
+        Returns a memoryview or bytes, or None if there was an error.
+        """
+        res = self.perform_request('memory', address=address, length=length)
+        if res.is_success:
+            return res.memory
+        print("Error reading memory: {}".format(res.message))
+
+    def array(self, address, dtype='B', count=1):
+        """
+        Read an array of `count` items of type `dtype` from memory at
+        `address`.
+
+        Returns a NumPy array if NumPy is installed (and `dtype` is a NumPy
+        dtype), otherwise a memoryview cast to the struct format `dtype`.
+        Neither copies the memory that was read.
+        """
+        try:
+            size = numpy.dtype(dtype).itemsize if numpy else struct.calcsize(dtype)
+            data = self.read(address, size * count)
+            if data is None:
+                return None
+            if numpy:
+                return numpy.frombuffer(data, dtype=dtype, count=count)
+            if six.PY2:
+                return memoryview(cast_b(data))
+            return memoryview(data).cast('B').cast(dtype)
+        except Exception as e:
+            print("Exception reading memory: {}".format(repr(e)))
+
     def __getattr__(self, key):
         try:
+            if self.snapshot:
+                regs = self.registers()
+                if key in regs:
+                    return regs[key]
             res = self.perform_request('registers', registers=[key])
             if res.is_success:
                 return res.registers[key]
@@ -17,20 +126,12 @@ class REPLClient(Client):
 
     def __getitem__(self, key):
         try:
-            d = {}
             if isinstance(key, slice):
-                d['address'] = key.start
-                d['length'] = key.stop - key.start
-            else:
-                d['address'] = key
-                d['length'] = 1
-
-            res = self.perform_request('memory', **d)
-
-            if res.is_success:
-                return res.memory
+                data = self.read(key.start, key.stop - key.start)
             else:
-                print("Error reading memory: {}".format(res.message))
+                data = self.read(key, 1)
+            if data is not None:
+                return cast_b(data)
         except Exception as e:
             print("Exception reading memory: {}".format(repr(e)))
 
@@ -47,6 +148,7 @@ class REPLClient(Client):
             res = self.perform_request('write_memory', **d)
 
             if res.is_success:
+                self.refresh()
                 return None
             else:
                 print("Error writing memory: {}".format(res.message))
@@ -55,7 +157,9 @@ class REPLClient(Client):
 
     def __call__(self, command):
         try:
-            res = self.perform_request('command', command=command)
+            res = self.perform_request('command', command=command, invalidate=True)
+            # the command could have changed anything
+            self.refresh()
             if res.is_success:
                 return res.output
             else:
@@ -144,6 +144,11 @@ class VoltronView (object):
     block = False
     supports_blocking = True
 
+    # Priority of the view's requests when they're queued on the server. Views that show the state of the target
+    # the user is looking at and scrolls around in get a higher priority than ones that are more expensive and less
+    # interactive (e.g. backtraces), so that they update first.
+    priority = None
+
     @classmethod
     def add_generic_arguments(cls, sp):
         sp.add_argument('--show-header', '-e', dest="header", action='store_true', help='show header', default=None)
@@ -163,7 +168,7 @@ class VoltronView (object):
 
     def __init__(self, args={}, loaded_config={}):
         log.debug('Loading view: ' + self.__class__.__name__)
-        self.client = Client(url=voltron.config.view.api_url)
+        self.client = Client(url=voltron.config.view.api_url, priority=self.priority)
         self.pm = None
         self.args = args
         self.loaded_config = loaded_config
@@ -245,6 +250,8 @@ class TerminalView (VoltronView):
                        "line_up", "line_down", "reset"]
 
     def __init__(self, *a, **kw):
+        # the terminal to render to, the multi view host hands views other terminals than its own
+        self.out = kw.pop('out', None) or sys.stdout
         self.init_window()
         self.trunc_top = False
         self.done = False
@@ -253,21 +260,24 @@ class TerminalView (VoltronView):
         super(TerminalView, self).__init__(*a, **kw)
 
     def init_window(self):
-        self.t = Terminal()
-        print(self.t.civis)
-        if cursor:
+        self.t = Terminal(stream=self.out)
+        print(self.t.civis, file=self.out)
+        if cursor and self.out is sys.stdout:
             cursor.hide()
 
     def cleanup(self):
         log.debug('Cleaning up view')
-        print(self.t.cnorm)
-        if cursor:
+        print(self.t.cnorm, file=self.out)
+        if cursor and self.out is sys.stdout:
             cursor.show()
 
     def clear(self):
         # blessed's clear doesn't work properly on windaz
         # maybe figure out the right way to do it some time
-        os.system('clear')
+        if self.out is sys.stdout:
+            os.system('clear')
+        else:
+            self.out.write(self.t.home + self.t.clear)
 
     def render(self, results):
         self.do_render()
@@ -291,11 +301,11 @@ class TerminalView (VoltronView):
             # Print the header, body and footer
             try:
                 if self.config.header.show:
-                    print(self.format_header_footer(self.config.header))
-                print(self.fmt_body, end='')
+                    print(self.format_header_footer(self.config.header), file=self.out)
+                print(self.fmt_body, end='', file=self.out)
                 if self.config.footer.show:
-                    print('\n' + self.format_header_footer(self.config.footer), end='')
-                sys.stdout.flush()
+                    print('\n' + self.format_header_footer(self.config.footer), end='', file=self.out)
+                self.out.flush()
             except IOError as e:
                 # if we get an EINTR while printing, just do it again
                 if e.errno == socket.EINTR:
@@ -307,7 +317,10 @@ class TerminalView (VoltronView):
         self.do_render()
 
     def window_size(self):
-        height, width = subprocess.check_output(['stty', 'size']).split()
+        if self.out is sys.stdout:
+            height, width = subprocess.check_output(['stty', 'size']).split()
+        else:
+            height, width = self.t.height, self.t.width
         height = int(height) - int(self.config.pad.pad_bottom)
         width = int(width) - int(self.config.pad.pad_right)
         return (height, width)